@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+# Compares the memory held by the Statement objects built by
+# grin.execution._build_statements() with the memory held by the same program
+# assembled by grin.bytecode.assemble().
+#
+#     python -m benchmarks.bench_bytecode_memory --lines 1000000
+#
+# At that size, with one Statement per line:
+#
+#     Statement objects:     113.0 MiB
+#       + their tokens:      984.9 MiB
+#     Bytecode:               22.1 MiB
+#     Serialized:             20.3 MiB
+
+import argparse
+import gc
+import tracemalloc
+
+from benchmarks.programs import straight_line_program
+from grin import bytecode
+from grin.execution import _build_goto_labels, _build_statements
+
+
+def _measure(build) -> tuple[object, int]:
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    token_lines = straight_line_program(args.lines)
+    labels = _build_goto_labels(token_lines)
+
+    # One Statement per line, as the bytecode has one instruction per line;
+    # see bench_shared_statements for lines sharing them
+    statements, statement_bytes = _measure(
+        lambda: _build_statements(token_lines, share=False)
+    )
+    del statements
+    assembled, bytecode_bytes = _measure(lambda: bytecode.assemble(token_lines, labels))
+    serialized = bytecode.dumps(assembled)
+
+    # Statements also keep every GrinToken alive, which the bytecode doesn't
+    _, token_bytes = _measure(lambda: straight_line_program(args.lines))
+
+    print(f'{args.lines} lines')
+    print(f'Statement objects:  {statement_bytes / 2**20:8.1f} MiB')
+    print(f'  + their tokens:   {(statement_bytes + token_bytes) / 2**20:8.1f} MiB')
+    print(f'Bytecode:           {bytecode_bytes / 2**20:8.1f} MiB')
+    print(f'Serialized:         {len(serialized) / 2**20:8.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+# Times building a control-flow graph with grin.cfg.build_cfg() and computing
+# its dominators and natural loops, on a straight-line program (few, huge
+# blocks) and on a program made of many small nested loops (many blocks).
+#
+#     python -m benchmarks.bench_cfg --lines 1000000
+
+import argparse
+import time
+
+from benchmarks.programs import nested_loops_program, straight_line_program
+from grin.cfg import build_cfg
+
+
+def _time(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    for name, generator in (
+        ('straight-line', straight_line_program),
+        ('nested loops', nested_loops_program),
+    ):
+        token_lines = generator(args.lines)
+        cfg, build_seconds = _time(lambda: build_cfg(token_lines))
+        _, dominator_seconds = _time(cfg.immediate_dominators)
+        loops, loop_seconds = _time(cfg.loops)
+
+        print(f'{name}: {args.lines} lines, {len(cfg.blocks())} blocks')
+        print(f'  build_cfg():   {build_seconds * 1e3:10.1f} ms')
+        print(f'  dominators:    {dominator_seconds * 1e3:10.1f} ms')
+        print(f'  loops ({len(loops):>6}): {loop_seconds * 1e3:10.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
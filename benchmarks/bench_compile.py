@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+# Compares running the same program many times through grin.execute(), which
+# builds the program on every call, against building it once with
+# grin.compile() and calling CompiledProgram.run() for each input.  Both run
+# the program on the same engine, 'statements' unless --engine says otherwise,
+# so the difference is only the cost of building it again.
+#
+#     python -m benchmarks.bench_compile --lines 10000 --runs 10000
+
+import argparse
+import time
+
+import grin
+from benchmarks.programs import straight_line_program
+
+
+def _inputs():
+    return '1'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=10_000)
+    parser.add_argument('--runs', type=int, default=10_000)
+    parser.add_argument('--engine', choices=grin.ENGINES, default='statements')
+    args = parser.parse_args()
+
+    token_lines = straight_line_program(args.lines)
+
+    start = time.perf_counter()
+    for _ in range(args.runs):
+        grin.execute(token_lines, input_func=_inputs, engine=args.engine)
+    execute_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    program = grin.compile(token_lines, args.engine)
+    compile_seconds = time.perf_counter() - start
+    for _ in range(args.runs):
+        program.run(_inputs)
+    run_seconds = time.perf_counter() - start - compile_seconds
+
+    print(f'{args.lines} lines, {args.runs} runs, {args.engine} engine')
+    print(f'execute():        {execute_seconds / args.runs * 1e6:10.1f} us/run')
+    print(f'compile() once:   {compile_seconds * 1e3:10.1f} ms')
+    print(f'CompiledProgram:  {run_seconds / args.runs * 1e6:10.1f} us/run')
+
+
+if __name__ == '__main__':
+    main()
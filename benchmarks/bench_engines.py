@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+# Runs a loop-heavy program on every engine in grin.execution.ENGINES and
+# reports instructions per second for each.
+#
+#     python -m benchmarks.bench_engines --iterations 200000
+#     python -m benchmarks.bench_engines --program variables
+
+import argparse
+import time
+
+import grin
+from benchmarks.programs import counting_loop_program, variable_heavy_program
+
+# Each program's generator, and the number of lines it runs per iteration and
+# outside its loop
+_PROGRAMS = {
+    'counting': (counting_loop_program, 5, 4),
+    'variables': (variable_heavy_program, 10, 5),
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=200_000)
+    parser.add_argument('--program', choices=_PROGRAMS, default='counting')
+    args = parser.parse_args()
+
+    generate, per_iteration, outside = _PROGRAMS[args.program]
+    token_lines = generate(args.iterations)
+    instructions = per_iteration * args.iterations + outside
+
+    baseline = None
+    for engine in grin.ENGINES:
+        program = grin.compile(token_lines, engine)
+        start = time.perf_counter()
+        program.run(str)
+        seconds = time.perf_counter() - start
+        rate = instructions / seconds
+        baseline = baseline or rate
+        print(
+            f'{engine:12} {rate / 1e6:8.2f} M instructions/s  {rate / baseline:5.2f}x'
+        )
+
+
+if __name__ == '__main__':
+    main()
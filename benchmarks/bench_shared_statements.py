@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+# Compares the memory held by the Statement objects built by
+# grin.execution._build_statements() for a program whose lines repeat, with
+# every line getting its own Statement against lines written the same way
+# sharing one.
+#
+#     python -m benchmarks.bench_shared_statements --lines 1000000
+
+import argparse
+import gc
+import tracemalloc
+
+from benchmarks.programs import repeated_line_program
+from grin.execution import _build_statements
+
+
+def _measure(build) -> tuple[object, int]:
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    token_lines = repeated_line_program(args.lines)
+
+    print(f'{args.lines} lines')
+    for name, share in (('own', False), ('shared', True)):
+        statements, size = _measure(lambda: _build_statements(token_lines, share=share))
+        distinct = len(set(map(id, statements)))
+        del statements
+        print(f'{name:6} {size / 2**20:8.1f} MiB   {distinct:9} Statement objects')
+
+
+if __name__ == '__main__':
+    main()
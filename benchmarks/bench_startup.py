@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+# Compares how long a huge program takes to start, building it with every
+# Statement up front against building each line the first time it runs
+# (grin.compile(..., lazy=True)).  The program jumps over nearly all of its
+# lines, so this is the time to its first output and its end.
+#
+#     python -m benchmarks.bench_startup --lines 300000
+
+import argparse
+import time
+
+import grin
+from benchmarks.programs import straight_line_program
+
+
+def _inputs():
+    return '1'
+
+
+def _startup(token_lines, lazy: bool) -> tuple[float, float]:
+    """Seconds spent building the program, and then running it once"""
+    start = time.perf_counter()
+    program = grin.compile(token_lines, lazy=lazy)
+    built = time.perf_counter()
+    program.run(_inputs)
+    return built - start, time.perf_counter() - built
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=300_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    token_lines = straight_line_program(args.lines)
+
+    print(f'{args.lines} lines, best of {args.repeat}')
+    for name, lazy in (('eager', False), ('lazy', True)):
+        build_seconds, run_seconds = min(
+            _startup(token_lines, lazy) for _ in range(args.repeat)
+        )
+        print(
+            f'{name:6} build {build_seconds * 1e3:9.1f} ms'
+            f'   run {run_seconds * 1e3:9.1f} ms'
+            f'   total {(build_seconds + run_seconds) * 1e3:9.1f} ms'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+# Synthetic Grin programs shared by the benchmark scripts.  Each generator
+# returns parsed token lines, ready to hand to grin.execute() or grin.compile().
+
+from grin.parsing import parse
+from grin.token import GrinToken
+
+
+def straight_line_program(line_count: int) -> list[list[GrinToken]]:
+    """A program that reads N, jumps over its body when N > 0, and otherwise
+    runs line_count - 4 lines of LET / ADD / MULT / PRINT."""
+    lines = ['INNUM N', 'GOTO "DONE" IF N > 0']
+    for index in range(line_count - 4):
+        name = f'V{index % 50}'
+        choice = index % 4
+        if choice == 0:
+            lines.append(f'LET {name} {index}')
+        elif choice == 1:
+            lines.append(f'ADD {name} N')
+        elif choice == 2:
+            lines.append(f'MULT {name} 2')
+        else:
+            lines.append(f'PRINT {name}')
+    lines += ['PRINT N', 'DONE: END', '.']
+    return list(parse(lines))
+
+
+def repeated_line_program(line_count: int) -> list[list[GrinToken]]:
+    """A program like straight_line_program, but the way generated programs
+    tend to be written: its body cycles through a few dozen lines, so most
+    lines are written exactly like many others."""
+    lines = ['INNUM N', 'GOTO "DONE" IF N > 0', 'LET SEP "-"']
+    for index in range(line_count - 5):
+        name = f'V{index % 8}'
+        choice = index % 4
+        if choice == 0:
+            lines.append('ADD COUNT 1')
+        elif choice == 1:
+            lines.append(f'ADD {name} N')
+        elif choice == 2:
+            lines.append(f'MULT {name} 2')
+        else:
+            lines.append('PRINT SEP')
+    lines += ['PRINT COUNT', 'DONE: END', '.']
+    return list(parse(lines))
+
+
+def counting_loop_program(iterations: int) -> list[list[GrinToken]]:
+    """A tight loop that adds to a handful of variables iterations times."""
+    lines = [
+        'LET I 0',
+        'LET TOTAL 0',
+        'LET STEP 3',
+        'TOP: ADD I 1',
+        'ADD TOTAL STEP',
+        'SUB TOTAL 1',
+        'MULT STEP 1',
+        f'GOTO "TOP" IF I < {iterations}',
+        'PRINT TOTAL',
+        '.',
+    ]
+    return list(parse(lines))
+
+
+def variable_heavy_program(iterations: int) -> list[list[GrinToken]]:
+    """A loop whose every line reads and writes several variables."""
+    lines = [
+        'LET I 0',
+        'LET A 1',
+        'LET B 2',
+        'LET C 3',
+        'TOP: ADD I 1',
+        'LET T A',
+        'ADD T B',
+        'ADD T C',
+        'LET A B',
+        'LET B C',
+        'LET C T',
+        'SUB C T',
+        'ADD C 3',
+        f'GOTO "TOP" IF I < {iterations}',
+        'PRINT T',
+        '.',
+    ]
+    return list(parse(lines))
+
+
+_NESTED_LOOP = [
+    'LET I 0',
+    'ADD I 1',
+    'LET J 0',
+    'ADD J 1',
+    'ADD T J',
+    'GOTO -2 IF J < 3',
+    'GOSUB "ADDONE"',
+    'MULT T 1',
+    'GOTO -7 IF I < 2',
+    'GOTO 2 IF T > 100',
+    'SUB T 1',
+    'PRINT T',
+]
+
+
+def nested_loops_program(line_count: int) -> list[list[GrinToken]]:
+    """Many small loops, each holding a nested loop and a GOSUB, so that
+    every few lines start a new basic block."""
+    tail = ['END', 'ADDONE: ADD T 1', 'RETURN', '.']
+    copies, padding = divmod(line_count - len(tail) + 1, len(_NESTED_LOOP))
+    lines = _NESTED_LOOP * copies + ['LET T T'] * padding + tail
+    return list(parse(lines))
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+
+# A compact bytecode form of a Grin program, and the VM that runs it.
+#
+# Every program line becomes one fixed-width instruction of WIDTH integers in
+# an array('i'): the opcode followed by its operand slots.  A value operand is
+# either an index into the constant pool (>= 0) or the bitwise complement of
+# an index into the name table (< 0), so both kinds fit in a single int.  The
+# name table doubles as the slot table of the SlotProgramState the VM runs
+# against, so a variable's name index is also the index of its slot.  Jump
+# targets that can be resolved at load time are stored as absolute line
+# indices under the JUMP / JUMPSUB opcodes instead.
+#
+# dumps() and loads() store a Bytecode as bytes, so a program can be run again
+# later without lexing or parsing it.
+
+import marshal
+import sys
+from array import array
+from typing import Any, Callable, Mapping
+
+from .slots import SlotProgramState
+from .token import GrinToken, GrinTokenKind
+from .utility import (
+    GrinRuntimeError,
+    add_values,
+    compare_values,
+    div_values,
+    get_starter_index,
+    is_tail_call,
+    jump_destination,
+    mult_values,
+    number_from_input,
+    sub_values,
+)
+
+WIDTH = 5
+
+LET = 1
+PRINT = 2
+END = 3
+ADD = 4
+SUB = 5
+MULT = 6
+DIV = 7
+GOTO = 8
+GOSUB = 9
+JUMP = 10
+JUMPSUB = 11
+RETURN = 12
+INSTR = 13
+INNUM = 14
+
+_MAGIC = b'GRINBC'
+_FORMAT_VERSION = 1
+
+_KEYWORD_OPCODES = {
+    GrinTokenKind.LET: LET,
+    GrinTokenKind.PRINT: PRINT,
+    GrinTokenKind.END: END,
+    GrinTokenKind.ADD: ADD,
+    GrinTokenKind.SUB: SUB,
+    GrinTokenKind.MULT: MULT,
+    GrinTokenKind.DIV: DIV,
+    GrinTokenKind.RETURN: RETURN,
+    GrinTokenKind.INSTR: INSTR,
+    GrinTokenKind.INNUM: INNUM,
+}
+
+# Comparison operators are stored by their token kind's index, with 0 meaning
+# that a jump has no IF clause
+_COMPARISON_KINDS = {
+    kind.index(): kind
+    for kind in (
+        GrinTokenKind.EQUAL,
+        GrinTokenKind.NOT_EQUAL,
+        GrinTokenKind.LESS_THAN,
+        GrinTokenKind.LESS_THAN_OR_EQUAL,
+        GrinTokenKind.GREATER_THAN,
+        GrinTokenKind.GREATER_THAN_OR_EQUAL,
+    )
+}
+
+_ARITHMETIC = {
+    ADD: add_values,
+    SUB: sub_values,
+    MULT: mult_values,
+    DIV: div_values,
+}
+
+
+class Bytecode:
+    """
+    An assembled Grin program
+    - code is the instruction stream, WIDTH ints per program line
+    - constants is the deduplicated pool of literal values
+    - names is the interned table of variable names
+    - goto_labels maps each label to the index of the line it's attached to
+    """
+
+    def __init__(
+        self,
+        code: array,
+        constants: tuple,
+        names: tuple[str, ...],
+        goto_labels: Mapping[str, int],
+    ):
+        self.code = code
+        self.constants = constants
+        self.names = names
+        self.goto_labels = dict(goto_labels)
+
+    def line_count(self) -> int:
+        return len(self.code) // WIDTH
+
+    def slot_table(self) -> dict[str, int]:
+        return {name: slot for slot, name in enumerate(self.names)}
+
+    def run(self, input_func: Callable = input, output_func: Callable | None = None):
+        """Runs the bytecode against a fresh ProgramState and returns its output.
+        A Bytecode doesn't keep the program's tokens, so the state has none"""
+        state = SlotProgramState([], self.slot_table(), input_func, output_func)
+        state.goto_labels = self.goto_labels
+        run_bytecode(self, state)
+        return state.output
+
+
+class _Assembler:
+    def __init__(self, goto_labels: Mapping[str, int], line_count: int):
+        self._goto_labels = goto_labels
+        self._line_count = line_count
+        self._code = array('i')
+        self._constants: list = []
+        self._constant_slots: dict[tuple[type, str], int] = {}
+        self._names: list[str] = []
+        self._name_slots: dict[str, int] = {}
+
+    def _name(self, name: str) -> int:
+        if name not in self._name_slots:
+            self._name_slots[name] = len(self._names)
+            self._names.append(name)
+        return self._name_slots[name]
+
+    def _constant(self, value: Any) -> int:
+        # Keyed on type and repr, so 1, 1.0 and -0.0 stay distinct
+        key = (type(value), repr(value))
+        if key not in self._constant_slots:
+            self._constant_slots[key] = len(self._constants)
+            self._constants.append(value)
+        return self._constant_slots[key]
+
+    def _operand(self, token: GrinToken) -> int:
+        if token.kind() == GrinTokenKind.IDENTIFIER:
+            return ~self._name(token.text())
+        return self._constant(token.value())
+
+    def _emit(self, opcode: int, a: int = 0, b: int = 0, c: int = 0, d: int = 0):
+        self._code.extend((opcode, a, b, c, d))
+
+    def _jump(
+        self, index: int, tokens: list[GrinToken], start: int, tail_call: bool
+    ) -> None:
+        # A tail call jumps without pushing, just like a GOTO
+        is_gosub = tokens[start].kind() == GrinTokenKind.GOSUB and not tail_call
+        target = tokens[start + 1]
+
+        comparison = left = right = 0
+        if len(tokens) > start + 2:
+            left = self._operand(tokens[start + 3])
+            comparison = tokens[start + 4].kind().index()
+            right = self._operand(tokens[start + 5])
+
+        if target.kind() != GrinTokenKind.IDENTIFIER:
+            try:
+                dest = jump_destination(
+                    index, target.value(), self._goto_labels, self._line_count
+                )
+            except GrinRuntimeError:
+                # Left for the VM to report, if the jump is ever taken
+                pass
+            else:
+                self._emit(JUMPSUB if is_gosub else JUMP, dest, comparison, left, right)
+                return
+
+        self._emit(
+            GOSUB if is_gosub else GOTO, self._operand(target), comparison, left, right
+        )
+
+    def line(
+        self, index: int, tokens: list[GrinToken], tail_call: bool = False
+    ) -> None:
+        start = get_starter_index(tokens)
+        keyword = tokens[start].kind()
+
+        if keyword in (GrinTokenKind.GOTO, GrinTokenKind.GOSUB):
+            self._jump(index, tokens, start, tail_call)
+        elif keyword == GrinTokenKind.PRINT:
+            self._emit(PRINT, self._operand(tokens[start + 1]))
+        elif keyword in (GrinTokenKind.INSTR, GrinTokenKind.INNUM):
+            self._emit(_KEYWORD_OPCODES[keyword], self._name(tokens[start + 1].text()))
+        elif keyword in (GrinTokenKind.END, GrinTokenKind.RETURN):
+            self._emit(_KEYWORD_OPCODES[keyword])
+        elif keyword in _KEYWORD_OPCODES:
+            self._emit(
+                _KEYWORD_OPCODES[keyword],
+                self._name(tokens[start + 1].text()),
+                self._operand(tokens[start + 2]),
+            )
+        else:
+            raise GrinRuntimeError('Not implemented')
+
+    def bytecode(self) -> Bytecode:
+        return Bytecode(
+            self._code, tuple(self._constants), tuple(self._names), self._goto_labels
+        )
+
+
+def assemble(
+    token_lines: list[list[GrinToken]],
+    goto_labels: Mapping[str, int],
+    tail_calls: bool = True,
+) -> Bytecode:
+    """Convert token lines into Bytecode (one instruction per program line).
+    tail_calls assembles each GOSUB followed by a RETURN as a jump (see
+    grin.utility.is_tail_call)"""
+    assembler = _Assembler(goto_labels, len(token_lines))
+    for index, tokens in enumerate(token_lines):
+        assembler.line(index, tokens, tail_calls and is_tail_call(token_lines, index))
+    return assembler.bytecode()
+
+
+def dumps(bytecode: Bytecode) -> bytes:
+    """Serializes bytecode so that loads() can rebuild it later"""
+    payload = (
+        _FORMAT_VERSION,
+        sys.byteorder,
+        bytecode.code.itemsize,
+        bytecode.code.tobytes(),
+        bytecode.constants,
+        bytecode.names,
+        bytecode.goto_labels,
+    )
+    return _MAGIC + marshal.dumps(payload)
+
+
+def loads(data: bytes) -> Bytecode:
+    """Rebuilds bytecode serialized by dumps()"""
+    if not data.startswith(_MAGIC):
+        raise ValueError('Not Grin bytecode')
+
+    version, byteorder, itemsize, raw_code, constants, names, labels = marshal.loads(
+        data[len(_MAGIC) :]
+    )
+    if version != _FORMAT_VERSION:
+        raise ValueError(f'Unsupported Grin bytecode version: {version}')
+
+    code = array('i')
+    if itemsize != code.itemsize:
+        raise ValueError('Grin bytecode was written with a different int size')
+    code.frombytes(raw_code)
+    if byteorder != sys.byteorder:
+        code.byteswap()
+
+    return Bytecode(code, constants, names, labels)
+
+
+def run_bytecode(bytecode: Bytecode, state: SlotProgramState) -> None:
+    """Runs bytecode from state.ip until the program ends, against a state
+    whose slot table is bytecode.slot_table()"""
+    code = bytecode.code
+    constants = bytecode.constants
+    labels = bytecode.goto_labels
+    line_count = bytecode.line_count()
+    slots = state.slots
+    stack = state.return_stack
+    ip = state.ip
+
+    try:
+        while 0 <= ip < line_count:
+            pc = ip * WIDTH
+            op = code[pc]
+            a = code[pc + 1]
+            b = code[pc + 2]
+
+            if op >= GOTO and op <= JUMPSUB:
+                if b:
+                    left = code[pc + 3]
+                    right = code[pc + 4]
+                    left = constants[left] if left >= 0 else slots[~left]
+                    right = constants[right] if right >= 0 else slots[~right]
+                    if not compare_values(left, _COMPARISON_KINDS[b], right):
+                        ip += 1
+                        continue
+
+                if op >= JUMP:
+                    dest = a
+                else:
+                    target = constants[a] if a >= 0 else slots[~a]
+                    dest = jump_destination(ip, target, labels, line_count)
+
+                if op == GOSUB or op == JUMPSUB:
+                    stack.append(ip + 1)
+                ip = dest
+            elif op == LET:
+                slots[a] = constants[b] if b >= 0 else slots[~b]
+                ip += 1
+            elif op >= ADD and op <= DIV:
+                right = constants[b] if b >= 0 else slots[~b]
+                slots[a] = _ARITHMETIC[op](slots[a], right)
+                ip += 1
+            elif op == PRINT:
+                text = str(constants[a] if a >= 0 else slots[~a])
+                state.output.append(text)
+                if state.output_func is not None:
+                    state.output_func(text)
+                ip += 1
+            elif op == END:
+                ip = line_count
+            elif op == RETURN:
+                if not stack:
+                    raise GrinRuntimeError('Runtime error: RETURN without GOSUB')
+                ip = stack.pop()
+            elif op == INSTR:
+                slots[a] = state.input_func()
+                ip += 1
+            elif op == INNUM:
+                slots[a] = number_from_input(state.input_func())
+                ip += 1
+            else:
+                raise GrinRuntimeError('Not implemented')
+    finally:
+        state.ip = ip
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+
+# Control-flow graphs over parsed Grin programs.  build_cfg() splits a
+# program's token lines into basic blocks -- runs of lines that are always
+# entered at the top and left at the bottom -- starting a block at the first
+# line, at every literal jump target and after every jump, RETURN and END.  A
+# label only starts a block if a literal jump leads to it, since a jump on a
+# variable could land on any line, labelled or not.  Blocks are connected
+# with edges:
+#
+# * FALLTHROUGH to the next line, after a plain line or an untaken IF
+# * JUMP for a GOTO, and BRANCH for a GOTO ... IF that's taken
+# * CALL for a GOSUB, which also falls through to the next line, standing
+#   for the subroutine returning there
+# * RETURN for a RETURN, which has no target since it goes back to whichever
+#   GOSUB called it
+# * EXIT for END, a jump to just past the last line, or running off the end
+# * DYNAMIC for a GOTO/GOSUB whose target is a variable, which could be
+#   any line, so its edge has no target as well
+#
+# A literal target that's invalid (say, a label that doesn't exist) gets no
+# edge at all, since taking it ends the program with an error.
+#
+# Dominators and natural loops are computed over every edge that has a
+# target, so they can't account for DYNAMIC edges; passes that rely on them
+# should check has_dynamic_edges() first.
+
+from bisect import bisect_right
+from typing import Mapping
+
+from .token import GrinToken, GrinTokenKind
+from .utility import (
+    GrinRuntimeError,
+    build_goto_labels,
+    get_starter_index,
+    jump_destination,
+)
+
+FALLTHROUGH = 'fallthrough'
+JUMP = 'jump'
+BRANCH = 'branch'
+CALL = 'call'
+RETURN = 'return'
+EXIT = 'exit'
+DYNAMIC = 'dynamic'
+
+
+class Edge:
+    """An edge from one basic block to another, identified by their indices;
+    the target is None for RETURN, EXIT and DYNAMIC edges"""
+
+    def __init__(self, source: int, target: int | None, kind: str):
+        self._source = source
+        self._target = target
+        self._kind = kind
+
+    def source(self) -> int:
+        return self._source
+
+    def target(self) -> int | None:
+        return self._target
+
+    def kind(self) -> str:
+        return self._kind
+
+    def __eq__(self, other) -> bool:
+        return (
+            isinstance(other, Edge)
+            and self._source == other._source
+            and self._target == other._target
+            and self._kind == other._kind
+        )
+
+    def __hash__(self) -> int:
+        return hash((self._source, self._target, self._kind))
+
+    def __repr__(self) -> str:
+        return f'Edge({self._source}, {self._target}, {self._kind!r})'
+
+
+class BasicBlock:
+    """A run of lines, from start up to (but not including) end, that are
+    always entered at start and left from the line before end"""
+
+    def __init__(self, index: int, start: int, end: int):
+        self._index = index
+        self._start = start
+        self._end = end
+        self._successors: list[Edge] = []
+        self._predecessors: list[Edge] = []
+
+    def index(self) -> int:
+        return self._index
+
+    def start(self) -> int:
+        return self._start
+
+    def end(self) -> int:
+        return self._end
+
+    def last_line(self) -> int:
+        return self._end - 1
+
+    def successors(self) -> list[Edge]:
+        return list(self._successors)
+
+    def predecessors(self) -> list[Edge]:
+        return list(self._predecessors)
+
+    def __repr__(self) -> str:
+        return f'BasicBlock({self._index}, {self._start}, {self._end})'
+
+
+class Loop:
+    """A natural loop: a header block that dominates every block in the loop,
+    and back edges into the header from inside it"""
+
+    def __init__(self, header: int, blocks: frozenset[int], back_edges: list[Edge]):
+        self._header = header
+        self._blocks = blocks
+        self._back_edges = back_edges
+
+    def header(self) -> int:
+        return self._header
+
+    def blocks(self) -> frozenset[int]:
+        return self._blocks
+
+    def back_edges(self) -> list[Edge]:
+        return list(self._back_edges)
+
+    def __repr__(self) -> str:
+        return f'Loop({self._header}, {sorted(self._blocks)})'
+
+
+class ControlFlowGraph:
+    """
+    The basic blocks of a program and the edges between them
+    - blocks are in the order of their first lines; block 0 is the entry
+    - line_count is how many lines the program has
+    """
+
+    def __init__(self, blocks: list[BasicBlock], line_count: int):
+        self._blocks = blocks
+        self._starts = [block.start() for block in blocks]
+        self._line_count = line_count
+        self._idom: list[int | None] | None = None
+        self._preorder: list[int] = []
+        self._postorder: list[int] = []
+        self._loops: list[Loop] | None = None
+
+    def blocks(self) -> list[BasicBlock]:
+        return list(self._blocks)
+
+    def block(self, index: int) -> BasicBlock:
+        return self._blocks[index]
+
+    def line_count(self) -> int:
+        return self._line_count
+
+    def block_of(self, line: int) -> BasicBlock:
+        """The block containing the given line"""
+        if not 0 <= line < self._line_count:
+            raise IndexError(f'No line {line} in a {self._line_count}-line program')
+        return self._blocks[bisect_right(self._starts, line) - 1]
+
+    def edges(self) -> list[Edge]:
+        return [edge for block in self._blocks for edge in block._successors]
+
+    def has_dynamic_edges(self) -> bool:
+        return any(edge.kind() == DYNAMIC for edge in self.edges())
+
+    def _depth_first(self) -> tuple[list[int], list[int]]:
+        """Blocks reachable from the entry in depth-first preorder, along with
+        each one's parent in the depth-first tree, by preorder number"""
+        if not self._blocks:
+            return [], []
+        number = [-1] * len(self._blocks)
+        vertex: list[int] = []
+        parent: list[int] = []
+        stack = [(0, -1)]
+        while stack:
+            index, from_number = stack.pop()
+            if number[index] != -1:
+                continue
+            number[index] = len(vertex)
+            vertex.append(index)
+            parent.append(from_number)
+            for edge in reversed(self._blocks[index]._successors):
+                target = edge.target()
+                if target is not None and number[target] == -1:
+                    stack.append((target, number[index]))
+        return vertex, parent
+
+    def _compute_dominators(self) -> None:
+        # Lengauer and Tarjan's algorithm, with path compression done by a
+        # loop rather than recursion, so that programs with a great many
+        # blocks are handled in near-linear time without hitting the stack
+        vertex, parent = self._depth_first()
+        count = len(vertex)
+        number = [-1] * len(self._blocks)
+        for position, index in enumerate(vertex):
+            number[index] = position
+
+        semi = list(range(count))
+        label = list(range(count))
+        ancestor = [-1] * count
+        dominator = [0] * count
+        bucket: list[list[int]] = [[] for _ in range(count)]
+
+        def evaluate(node: int) -> int:
+            if ancestor[node] == -1:
+                return node
+            path = []
+            step = node
+            while ancestor[ancestor[step]] != -1:
+                path.append(step)
+                step = ancestor[step]
+            for step in reversed(path):
+                above = ancestor[step]
+                if semi[label[above]] < semi[label[step]]:
+                    label[step] = label[above]
+                ancestor[step] = ancestor[above]
+            return label[node]
+
+        for position in range(count - 1, 0, -1):
+            for edge in self._blocks[vertex[position]]._predecessors:
+                source = number[edge.source()]
+                if source == -1:
+                    continue
+                candidate = semi[evaluate(source)]
+                if candidate < semi[position]:
+                    semi[position] = candidate
+            bucket[semi[position]].append(position)
+            above = parent[position]
+            ancestor[position] = above
+            for node in bucket[above]:
+                lowest = evaluate(node)
+                dominator[node] = lowest if semi[lowest] < semi[node] else above
+            bucket[above].clear()
+
+        for position in range(1, count):
+            if dominator[position] != semi[position]:
+                dominator[position] = dominator[dominator[position]]
+
+        idom: list[int | None] = [None] * len(self._blocks)
+        for position, index in enumerate(vertex):
+            idom[index] = vertex[dominator[position]]
+
+        # Numbering the dominator tree lets dominates() answer in constant time
+        children: list[list[int]] = [[] for _ in self._blocks]
+        for index in vertex[1:]:
+            children[idom[index]].append(index)
+        preorder = [-1] * len(self._blocks)
+        postorder = [-1] * len(self._blocks)
+        counter = 0
+        stack = [(0, iter(children[0]))] if vertex else []
+        if vertex:
+            preorder[0] = counter
+            counter += 1
+        while stack:
+            index, remaining = stack[-1]
+            child = next(remaining, None)
+            if child is None:
+                stack.pop()
+                postorder[index] = counter
+                counter += 1
+            else:
+                preorder[child] = counter
+                counter += 1
+                stack.append((child, iter(children[child])))
+
+        self._idom = idom
+        self._preorder = preorder
+        self._postorder = postorder
+
+    def immediate_dominators(self) -> list[int | None]:
+        """Each block's immediate dominator, by index; the entry is its own and
+        blocks that can't be reached from the entry have None"""
+        if self._idom is None:
+            self._compute_dominators()
+        return list(self._idom)
+
+    def dominates(self, dominator: int, index: int) -> bool:
+        """Whether every path from the entry to block index goes through block
+        dominator (which includes a block dominating itself)"""
+        if self._idom is None:
+            self._compute_dominators()
+        if self._idom[dominator] is None or self._idom[index] is None:
+            return False
+        return (
+            self._preorder[dominator] <= self._preorder[index]
+            and self._postorder[index] <= self._postorder[dominator]
+        )
+
+    def loops(self) -> list[Loop]:
+        """The program's natural loops, one per header, ordered by header"""
+        if self._loops is not None:
+            return list(self._loops)
+
+        back_edges: dict[int, list[Edge]] = {}
+        for edge in self.edges():
+            target = edge.target()
+            if target is not None and self.dominates(target, edge.source()):
+                back_edges.setdefault(target, []).append(edge)
+
+        loops = []
+        for header in sorted(back_edges):
+            body = {header}
+            work = [edge.source() for edge in back_edges[header]]
+            while work:
+                index = work.pop()
+                if index in body:
+                    continue
+                body.add(index)
+                work.extend(
+                    edge.source()
+                    for edge in self._blocks[index]._predecessors
+                    if self._idom[edge.source()] is not None
+                )
+            loops.append(Loop(header, frozenset(body), back_edges[header]))
+
+        self._loops = loops
+        return list(loops)
+
+
+def _leaders_and_exits(
+    token_lines: list[list[GrinToken]], goto_labels: Mapping[str, int]
+) -> tuple[list[int], dict[int, list[tuple[int | None, str]]]]:
+    """The first line of every basic block, and the edges (as target line and
+    kind) leaving every line that doesn't just fall through"""
+    line_count = len(token_lines)
+    leaders = {0} if line_count else set()
+    exits: dict[int, list[tuple[int | None, str]]] = {}
+
+    for index, tokens in enumerate(token_lines):
+        start = get_starter_index(tokens)
+        keyword = tokens[start].kind()
+
+        if keyword in (GrinTokenKind.GOTO, GrinTokenKind.GOSUB):
+            is_gosub = keyword == GrinTokenKind.GOSUB
+            conditional = len(tokens) > start + 2
+            target_token = tokens[start + 1]
+            edges = []
+
+            if target_token.kind() == GrinTokenKind.IDENTIFIER:
+                edges.append((None, DYNAMIC))
+            else:
+                try:
+                    dest = jump_destination(
+                        index, target_token.value(), goto_labels, line_count
+                    )
+                except GrinRuntimeError:
+                    pass
+                else:
+                    if dest == line_count:
+                        edges.append((None, EXIT))
+                    else:
+                        leaders.add(dest)
+                        kind = CALL if is_gosub else BRANCH if conditional else JUMP
+                        edges.append((dest, kind))
+
+            if conditional or is_gosub:
+                edges.append((index + 1, FALLTHROUGH))
+            exits[index] = edges
+            leaders.add(index + 1)
+        elif keyword == GrinTokenKind.RETURN:
+            exits[index] = [(None, RETURN)]
+            leaders.add(index + 1)
+        elif keyword == GrinTokenKind.END:
+            exits[index] = [(None, EXIT)]
+            leaders.add(index + 1)
+
+    return sorted(leader for leader in leaders if leader < line_count), exits
+
+
+def build_cfg(
+    token_lines: list[list[GrinToken]], goto_labels: Mapping[str, int] | None = None
+) -> ControlFlowGraph:
+    """Builds the control-flow graph of a program, given its token lines and
+    (if already known) its labels"""
+    if goto_labels is None:
+        goto_labels = build_goto_labels(token_lines)
+    line_count = len(token_lines)
+    leaders, exits = _leaders_and_exits(token_lines, goto_labels)
+
+    ends = leaders[1:] + [line_count]
+    blocks = [
+        BasicBlock(index, start, end)
+        for index, (start, end) in enumerate(zip(leaders, ends))
+    ]
+    block_index = {start: index for index, start in enumerate(leaders)}
+
+    for block in blocks:
+        last = block.last_line()
+        targets = exits.get(last, [(last + 1, FALLTHROUGH)])
+        for line, kind in targets:
+            if line is not None and line >= line_count:
+                line, kind = None, EXIT
+            target = None if line is None else block_index[line]
+            edge = Edge(block.index(), target, kind)
+            block._successors.append(edge)
+            if target is not None:
+                blocks[target]._predecessors.append(edge)
+
+    return ControlFlowGraph(blocks, line_count)
+
+
+__all__ = [
+    build_cfg.__name__,
+    ControlFlowGraph.__name__,
+    BasicBlock.__name__,
+    Edge.__name__,
+    Loop.__name__,
+]
@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+
+# An alternative to the Statement objects in grin.statements: every program
+# line is turned into a plain Python closure once, at load time.  Each closure
+# takes a SlotProgramState and its list of variable slots and returns the
+# index of the next line to run, so the main loop is just
+# "ip = closures[ip](state, slots)".
+#
+# Operands are resolved while building: a literal becomes a constant captured
+# by the closure, an identifier becomes the index of its variable's slot, and
+# jump targets that can never change are turned into absolute line indices.
+#
+# Arithmetic lines can also be built speculatively, for the operand types the
+# interpreter has seen there.  Such a closure only checks that its operands
+# still have those types and raises Deoptimization (see grin.deopt) when they
+# don't, instead of falling back to the generic operation itself.
+
+import operator
+from typing import Any, Callable, Mapping
+
+from .deopt import Deoptimization
+from .slots import SlotProgramState
+from .statements import AddStatement, DivStatement, MultStatement, SubStatement
+from .token import GrinToken, GrinTokenKind
+from .utility import (
+    COMPARISON_TABLE,
+    GrinRuntimeError,
+    add_values,
+    compare_values,
+    div_values,
+    get_starter_index,
+    is_tail_call,
+    jump_destination,
+    mult_values,
+    number_from_input,
+    sub_values,
+)
+
+Closure = Callable[[SlotProgramState, list], int]
+
+_GENERIC_ARITHMETIC = {
+    GrinTokenKind.ADD: add_values,
+    GrinTokenKind.SUB: sub_values,
+    GrinTokenKind.MULT: mult_values,
+    GrinTokenKind.DIV: div_values,
+}
+
+_NUMERIC_ARITHMETIC = {
+    GrinTokenKind.ADD: operator.add,
+    GrinTokenKind.SUB: operator.sub,
+    GrinTokenKind.MULT: operator.mul,
+}
+
+
+_SPECIALIZED_ARITHMETIC = {
+    GrinTokenKind.ADD: AddStatement.SPECIALIZED,
+    GrinTokenKind.SUB: SubStatement.SPECIALIZED,
+    GrinTokenKind.MULT: MultStatement.SPECIALIZED,
+    GrinTokenKind.DIV: DivStatement.SPECIALIZED,
+}
+
+
+def _is_literal(token: GrinToken) -> bool:
+    return token.kind() != GrinTokenKind.IDENTIFIER
+
+
+def _raiser(error: GrinRuntimeError) -> Callable:
+    """A closure that raises a runtime error found while building, so it
+    only surfaces if the line is actually reached"""
+
+    def run(*args):
+        raise error
+
+    return run
+
+
+def _build_let(
+    slot: int, value_token: GrinToken, slot_table: Mapping[str, int], nxt: int
+) -> Closure:
+    if _is_literal(value_token):
+        value = value_token.value()
+
+        def run(state, slots):
+            slots[slot] = value
+            return nxt
+    else:
+        source = slot_table[value_token.text()]
+
+        def run(state, slots):
+            slots[slot] = slots[source]
+            return nxt
+
+    return run
+
+
+def _build_print(
+    value_token: GrinToken, slot_table: Mapping[str, int], nxt: int
+) -> Closure:
+    if _is_literal(value_token):
+        text = str(value_token.value())
+
+        def run(state, slots):
+            state.output.append(text)
+            if state.output_func is not None:
+                state.output_func(text)
+            return nxt
+    else:
+        source = slot_table[value_token.text()]
+
+        def run(state, slots):
+            text = str(slots[source])
+            state.output.append(text)
+            if state.output_func is not None:
+                state.output_func(text)
+            return nxt
+
+    return run
+
+
+def _build_speculative_arithmetic(
+    keyword: GrinTokenKind,
+    slot: int,
+    value_token: GrinToken,
+    slot_table: Mapping[str, int],
+    index: int,
+    types: tuple[type, type],
+) -> Closure:
+    left_type, right_type = types
+    fast = _SPECIALIZED_ARITHMETIC[keyword][types]
+    reason = f'{keyword.name} on {left_type.__name__} and {right_type.__name__}'
+    nxt = index + 1
+
+    if _is_literal(value_token):
+        right = value_token.value()
+
+        def run(state, slots):
+            left = slots[slot]
+            if type(left) is not left_type:
+                raise Deoptimization(reason, index)
+            slots[slot] = fast(left, right)
+            return nxt
+    else:
+        source = slot_table[value_token.text()]
+
+        def run(state, slots):
+            left = slots[slot]
+            right = slots[source]
+            if type(left) is not left_type or type(right) is not right_type:
+                raise Deoptimization(reason, index)
+            slots[slot] = fast(left, right)
+            return nxt
+
+    return run
+
+
+def _build_arithmetic(
+    keyword: GrinTokenKind,
+    slot: int,
+    value_token: GrinToken,
+    slot_table: Mapping[str, int],
+    nxt: int,
+) -> Closure:
+    generic = _GENERIC_ARITHMETIC[keyword]
+    numeric = _NUMERIC_ARITHMETIC.get(keyword)
+
+    if not _is_literal(value_token):
+        source = slot_table[value_token.text()]
+
+        if numeric is None:
+
+            def run(state, slots):
+                slots[slot] = generic(slots[slot], slots[source])
+                return nxt
+        else:
+
+            def run(state, slots):
+                left = slots[slot]
+                right = slots[source]
+                if type(left) is int and type(right) is int:
+                    slots[slot] = numeric(left, right)
+                else:
+                    slots[slot] = generic(left, right)
+                return nxt
+
+        return run
+
+    value = value_token.value()
+
+    if keyword == GrinTokenKind.ADD and isinstance(value, int):
+
+        def run(state, slots):
+            left = slots[slot]
+            if type(left) is int:
+                slots[slot] = left + value
+            else:
+                slots[slot] = generic(left, value)
+            return nxt
+    elif keyword == GrinTokenKind.SUB and isinstance(value, int):
+
+        def run(state, slots):
+            left = slots[slot]
+            if type(left) is int:
+                slots[slot] = left - value
+            else:
+                slots[slot] = generic(left, value)
+            return nxt
+    elif numeric is not None and not isinstance(value, str):
+        # Any number combines with any other number, so only the variable
+        # needs a type check
+        def run(state, slots):
+            left = slots[slot]
+            if type(left) is int or type(left) is float:
+                slots[slot] = numeric(left, value)
+            else:
+                slots[slot] = generic(left, value)
+            return nxt
+    else:
+
+        def run(state, slots):
+            slots[slot] = generic(slots[slot], value)
+            return nxt
+
+    return run
+
+
+def _build_condition(condition, slot_table: Mapping[str, int]) -> Callable[[list], Any]:
+    """Builds a function of the variable slots that evaluates an IF clause"""
+    left_token, comp_op_token, right_token = condition
+    op_kind = comp_op_token.kind()
+    # Every pair of numbers is compared by the same operator
+    op = COMPARISON_TABLE[(int, op_kind, int)]
+
+    if _is_literal(left_token) and _is_literal(right_token):
+        left = left_token.value()
+        right = right_token.value()
+        try:
+            result = compare_values(left, op_kind, right)
+        except GrinRuntimeError as error:
+            return _raiser(error)
+        else:
+
+            def check(slots):
+                return result
+
+        return check
+
+    if _is_literal(right_token) and not isinstance(right_token.value(), str):
+        left_slot = slot_table[left_token.text()]
+        right = right_token.value()
+
+        def check(slots):
+            left = slots[left_slot]
+            if type(left) is int or type(left) is float:
+                return op(left, right)
+            return compare_values(left, op_kind, right)
+
+        return check
+
+    if _is_literal(left_token):
+        left = left_token.value()
+        right_slot = slot_table[right_token.text()]
+
+        def check(slots):
+            return compare_values(left, op_kind, slots[right_slot])
+
+        return check
+
+    left_slot = slot_table[left_token.text()]
+
+    if _is_literal(right_token):
+        right = right_token.value()
+
+        def check(slots):
+            return compare_values(slots[left_slot], op_kind, right)
+
+        return check
+
+    right_slot = slot_table[right_token.text()]
+
+    def check(slots):
+        return compare_values(slots[left_slot], op_kind, slots[right_slot])
+
+    return check
+
+
+def _build_jump(
+    index: int,
+    tokens: list[GrinToken],
+    start: int,
+    goto_labels: Mapping[str, int],
+    slot_table: Mapping[str, int],
+    line_count: int,
+    tail_call: bool,
+) -> Closure:
+    # A tail call jumps without pushing, just like a GOTO
+    is_gosub = tokens[start].kind() == GrinTokenKind.GOSUB and not tail_call
+    target_token = tokens[start + 1]
+    nxt = index + 1
+
+    if _is_literal(target_token):
+        try:
+            dest = jump_destination(
+                index, target_token.value(), goto_labels, line_count
+            )
+        except GrinRuntimeError as error:
+            taken = _raiser(error)
+        else:
+            if is_gosub:
+
+                def taken(state, slots):
+                    state.return_stack.append(nxt)
+                    return dest
+            else:
+
+                def taken(state, slots):
+                    return dest
+    else:
+        target_slot = slot_table[target_token.text()]
+
+        if is_gosub:
+
+            def taken(state, slots):
+                dest = jump_destination(
+                    index, slots[target_slot], goto_labels, line_count
+                )
+                state.return_stack.append(nxt)
+                return dest
+        else:
+
+            def taken(state, slots):
+                return jump_destination(
+                    index, slots[target_slot], goto_labels, line_count
+                )
+
+    if len(tokens) <= start + 2:
+        return taken
+
+    check = _build_condition(tokens[start + 3 : start + 6], slot_table)
+
+    def run(state, slots):
+        if check(slots):
+            return taken(state, slots)
+        return nxt
+
+    return run
+
+
+def _build_closure(
+    index: int,
+    tokens: list[GrinToken],
+    start: int,
+    goto_labels: Mapping[str, int],
+    slot_table: Mapping[str, int],
+    line_count: int,
+    speculation: Mapping[int, tuple[type, type]],
+    tail_call: bool,
+) -> Closure:
+    keyword = tokens[start].kind()
+    nxt = index + 1
+
+    if keyword == GrinTokenKind.LET:
+        return _build_let(
+            slot_table[tokens[start + 1].text()], tokens[start + 2], slot_table, nxt
+        )
+    elif keyword == GrinTokenKind.PRINT:
+        return _build_print(tokens[start + 1], slot_table, nxt)
+    elif keyword == GrinTokenKind.END:
+
+        def run(state, slots):
+            return line_count
+
+        return run
+    elif keyword in _GENERIC_ARITHMETIC and index in speculation:
+        return _build_speculative_arithmetic(
+            keyword,
+            slot_table[tokens[start + 1].text()],
+            tokens[start + 2],
+            slot_table,
+            index,
+            speculation[index],
+        )
+    elif keyword in _GENERIC_ARITHMETIC:
+        return _build_arithmetic(
+            keyword,
+            slot_table[tokens[start + 1].text()],
+            tokens[start + 2],
+            slot_table,
+            nxt,
+        )
+    elif keyword in (GrinTokenKind.GOTO, GrinTokenKind.GOSUB):
+        return _build_jump(
+            index, tokens, start, goto_labels, slot_table, line_count, tail_call
+        )
+    elif keyword == GrinTokenKind.RETURN:
+
+        def run(state, slots):
+            if not state.return_stack:
+                raise GrinRuntimeError('Runtime error: RETURN without GOSUB')
+            return state.return_stack.pop()
+
+        return run
+    elif keyword == GrinTokenKind.INSTR:
+        slot = slot_table[tokens[start + 1].text()]
+
+        def run(state, slots):
+            slots[slot] = state.input_func()
+            return nxt
+
+        return run
+    elif keyword == GrinTokenKind.INNUM:
+        slot = slot_table[tokens[start + 1].text()]
+
+        def run(state, slots):
+            slots[slot] = number_from_input(state.input_func())
+            return nxt
+
+        return run
+    else:
+        raise GrinRuntimeError('Not implemented')
+
+
+def build_closures(
+    token_lines: list[list[GrinToken]],
+    goto_labels: Mapping[str, int],
+    slot_table: Mapping[str, int],
+    speculation: Mapping[int, tuple[type, type]] | None = None,
+    tail_calls: bool = True,
+) -> list[Closure]:
+    """Convert token lines into one closure per program line, with variables
+    stored at the indices given by slot_table (see grin.slots.assign_slots).
+    speculation maps the indices of arithmetic lines to build speculatively to
+    the (variable type, operand type) to specialize them for, and tail_calls
+    builds each GOSUB followed by a RETURN as a jump (see
+    grin.utility.is_tail_call)"""
+    line_count = len(token_lines)
+    speculation = {} if speculation is None else speculation
+    return [
+        _build_closure(
+            index,
+            tokens,
+            get_starter_index(tokens),
+            goto_labels,
+            slot_table,
+            line_count,
+            speculation,
+            tail_calls and is_tail_call(token_lines, index),
+        )
+        for index, tokens in enumerate(token_lines)
+    ]
+
+
+def run_closures(closures: list[Closure], state: SlotProgramState) -> None:
+    """Runs closures from state.ip until the program ends"""
+    slots = state.slots
+    ip = state.ip
+    line_count = len(closures)
+    try:
+        while 0 <= ip < line_count:
+            ip = closures[ip](state, slots)
+    finally:
+        state.ip = ip
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+
+# Constant propagation and folding.  A forward dataflow analysis works out,
+# for every line, which variables are sure to hold a known value whenever it
+# runs (every variable starts as 0), and then
+#
+# * ADD/SUB/MULT/DIV on two known values become a LET of the result,
+# * variables with a known value are replaced by literals in LET, PRINT and
+#   the operands of arithmetic,
+# * a GOTO/GOSUB whose condition always comes out the same way becomes an
+#   unconditional jump or a NopStatement, and
+# * a stretch of lines that now LET variables to literals is run at once by
+#   a ConstantLetsStatement on its first line.
+#
+# Anything that would fail at run time (division by zero, mismatched types)
+# is left in place to fail there.  A GOTO or GOSUB whose target is a variable
+# could go anywhere, so in a program with one only conditions between two
+# literals are folded.  No line moves, so every line is still a valid target.
+
+from typing import Any
+
+from .location import GrinLocation
+from .statements import (
+    ArithmeticStatement,
+    ConstantLetsStatement,
+    CountingLoopStatement,
+    EndStatement,
+    FusedStatement,
+    GoSubStatement,
+    InlinedCallStatement,
+    InnumStatement,
+    InstrStatement,
+    JumpStatement,
+    LetStatement,
+    MultStatement,
+    NopStatement,
+    PrintStatement,
+    ReturnStatement,
+    Statement,
+)
+from .token import GrinToken, GrinTokenKind
+from .utility import GrinRuntimeError, compare_values
+
+CONSTANT_ARITHMETIC = 'constant arithmetic'
+PROPAGATED_CONSTANTS = 'propagated constants'
+CONSTANT_CONDITIONS = 'constant conditions'
+COMBINED_LETS = 'combined LETs'
+
+# Values bigger than these aren't folded, since the program might never
+# actually make them
+_MAX_STRING_LENGTH = 1000
+_MAX_INT_BITS = 1024
+
+_LITERAL_KINDS = {
+    int: GrinTokenKind.LITERAL_INTEGER,
+    float: GrinTokenKind.LITERAL_FLOAT,
+    str: GrinTokenKind.LITERAL_STRING,
+}
+
+# Stands for a value the analysis can't know
+_UNKNOWN = object()
+
+
+def _literal(value: Any, location: GrinLocation) -> GrinToken:
+    text = f'"{value}"' if isinstance(value, str) else str(value)
+    return GrinToken(
+        kind=_LITERAL_KINDS[type(value)], text=text, location=location, value=value
+    )
+
+
+def _same(left: Any, right: Any) -> bool:
+    # 1 and 1.0 are equal but aren't the same value to Grin, and neither are
+    # 0.0 and -0.0, which print differently
+    if type(left) is float and type(right) is float:
+        return repr(left) == repr(right)
+    return type(left) is type(right) and left == right
+
+
+def _value(token: GrinToken, known: dict[str, Any]) -> Any:
+    if token.kind() == GrinTokenKind.IDENTIFIER:
+        return known.get(token.text(), _UNKNOWN)
+    return token.value()
+
+
+def _fold(statement: ArithmeticStatement, left: Any, right: Any) -> Any:
+    """The value the arithmetic statement gives its variable, or _UNKNOWN if
+    it's too big to fold; raises GrinRuntimeError if the statement would"""
+    if isinstance(statement, MultStatement):
+        for text, count in ((left, right), (right, left)):
+            if (
+                isinstance(text, str)
+                and type(count) is int
+                and len(text) * count > _MAX_STRING_LENGTH
+            ):
+                return _UNKNOWN
+    value = statement.apply(left, right)
+    if isinstance(value, str) and len(value) > _MAX_STRING_LENGTH:
+        return _UNKNOWN
+    if isinstance(value, int) and value.bit_length() > _MAX_INT_BITS:
+        return _UNKNOWN
+    return value
+
+
+def _condition_outcome(statement: JumpStatement, known: dict[str, Any]) -> bool | None:
+    """Whether the jump is always (True) or never (False) taken, or None if
+    that isn't known"""
+    if statement.condition() is None:
+        return True
+    left_token, op_token, right_token = statement.condition()
+    left = _value(left_token, known)
+    right = _value(right_token, known)
+    if left is _UNKNOWN or right is _UNKNOWN:
+        return None
+    try:
+        return compare_values(left, op_token.kind(), right)
+    except GrinRuntimeError:
+        return None
+
+
+def _plain(statement: Statement) -> Statement:
+    """The statement a superinstruction or folded loop starts by running"""
+    if isinstance(statement, CountingLoopStatement):
+        statement = statement.original()
+    if isinstance(statement, FusedStatement):
+        statement = statement.parts()[0]
+    return statement
+
+
+def _step(
+    statement: Statement, index: int, known: dict[str, Any], return_sites: list[int]
+) -> tuple[dict[str, Any], list[int]] | None:
+    """What's known after the statement on line index runs, given what's
+    known before, and the lines it can go to, or None if it could go anywhere
+    or do anything"""
+    if isinstance(statement, CountingLoopStatement):
+        step = _step(_plain(statement), index, known, return_sites)
+        if step is None:
+            return None
+        after, successors = step
+        for name in statement.updated_names():
+            after.pop(name, None)
+        return after, successors + [statement.exit()]
+    if isinstance(statement, InlinedCallStatement):
+        after = known
+        for part in statement.body():
+            step = _step(part, index, after, return_sites)
+            if step is None:
+                return None
+            after, successors = step
+            # A statement that's sure to fail ends the call
+            if not successors:
+                return after, []
+        return after, [index + 1]
+    # The second half of a superinstruction has its own line to be analyzed
+    statement = _plain(statement)
+
+    after = dict(known)
+    if isinstance(statement, LetStatement):
+        value = _value(statement.value_token(), known)
+        after[statement.var_name()] = value
+    elif isinstance(statement, ArithmeticStatement):
+        left = known.get(statement.var_name(), _UNKNOWN)
+        right = _value(statement.value_token(), known)
+        value = _UNKNOWN
+        if left is not _UNKNOWN and right is not _UNKNOWN:
+            try:
+                value = _fold(statement, left, right)
+            except GrinRuntimeError:
+                return after, []
+        after[statement.var_name()] = value
+    elif isinstance(statement, (InstrStatement, InnumStatement)):
+        after[statement.var_name()] = _UNKNOWN
+    elif isinstance(statement, EndStatement):
+        return after, []
+    elif isinstance(statement, ReturnStatement):
+        return after, return_sites
+    elif isinstance(statement, JumpStatement):
+        if statement.target_token().kind() == GrinTokenKind.IDENTIFIER:
+            return None
+        outcome = _condition_outcome(statement, known)
+        successors = []
+        # A jump to an invalid target fails instead of going anywhere
+        if outcome is not False and statement.static_destination() is not None:
+            successors.append(statement.static_destination())
+        if outcome is not True:
+            successors.append(index + 1)
+        return after, successors
+    elif not isinstance(statement, PrintStatement):
+        return None
+
+    for name, value in list(after.items()):
+        if value is _UNKNOWN:
+            del after[name]
+    return after, [index + 1]
+
+
+def _variable_names(statements: list[Statement]) -> set[str]:
+    names = set()
+    for statement in statements:
+        statement = _plain(statement)
+        if isinstance(statement, InlinedCallStatement):
+            names |= _variable_names(list(statement.body()))
+        if isinstance(
+            statement,
+            (LetStatement, ArithmeticStatement, InstrStatement, InnumStatement),
+        ):
+            names.add(statement.var_name())
+        tokens = []
+        if isinstance(statement, (LetStatement, ArithmeticStatement, PrintStatement)):
+            tokens.append(statement.value_token())
+        if isinstance(statement, JumpStatement) and statement.condition() is not None:
+            tokens.extend(statement.condition())
+        names.update(
+            token.text() for token in tokens if token.kind() == GrinTokenKind.IDENTIFIER
+        )
+    return names
+
+
+def _analyze(statements: list[Statement]) -> list[dict[str, Any] | None] | None:
+    """For each line, the variables sure to hold a known value whenever it
+    runs, or None if it never runs; None altogether if a line that might run
+    could go anywhere"""
+    known: list[dict[str, Any] | None] = [None] * len(statements)
+    if not statements:
+        return known
+    return_sites = [
+        index + 1
+        for index, statement in enumerate(statements)
+        if isinstance(statement, GoSubStatement)
+    ]
+
+    known[0] = dict.fromkeys(_variable_names(statements), 0)
+    pending = [0]
+    while pending:
+        index = pending.pop()
+        step = _step(statements[index], index, known[index], return_sites)
+        if step is None:
+            return None
+        after, successors = step
+        for successor in successors:
+            if successor >= len(statements):
+                continue
+            before = known[successor]
+            if before is None:
+                known[successor] = after
+                pending.append(successor)
+                continue
+            joined = {
+                name: value
+                for name, value in before.items()
+                if name in after and _same(after[name], value)
+            }
+            if len(joined) != len(before):
+                known[successor] = joined
+                pending.append(successor)
+    return known
+
+
+def _rewrite(
+    statement: Statement, known: dict[str, Any], report: dict[str, int]
+) -> Statement | None:
+    """The statement to run in place of this one, given what's known before
+    it runs, or None to keep it"""
+    if isinstance(statement, (LetStatement, PrintStatement)):
+        token = statement.value_token()
+        value = _value(token, known)
+        if token.kind() != GrinTokenKind.IDENTIFIER or value is _UNKNOWN:
+            return None
+        report[PROPAGATED_CONSTANTS] += 1
+        literal = _literal(value, token.location())
+        if isinstance(statement, LetStatement):
+            return LetStatement(statement.var_token(), literal)
+        return PrintStatement(literal)
+
+    if isinstance(statement, ArithmeticStatement):
+        token = statement.value_token()
+        left = known.get(statement.var_name(), _UNKNOWN)
+        right = _value(token, known)
+        if right is _UNKNOWN:
+            return None
+        if left is not _UNKNOWN:
+            try:
+                value = _fold(statement, left, right)
+            except GrinRuntimeError:
+                return None
+            if value is not _UNKNOWN:
+                report[CONSTANT_ARITHMETIC] += 1
+                literal = _literal(value, token.location())
+                return LetStatement(statement.var_token(), literal)
+        if token.kind() != GrinTokenKind.IDENTIFIER:
+            return None
+        report[PROPAGATED_CONSTANTS] += 1
+        return type(statement)(statement.var_token(), _literal(right, token.location()))
+
+    if isinstance(statement, JumpStatement) and statement.condition() is not None:
+        outcome = _condition_outcome(statement, known)
+        if outcome is False:
+            report[CONSTANT_CONDITIONS] += 1
+            return NopStatement()
+        if outcome is True and statement.static_destination() is not None:
+            report[CONSTANT_CONDITIONS] += 1
+            jump = type(statement)(statement.target_token())
+            jump.thread_to(statement.static_destination())
+            return jump
+    return None
+
+
+def _is_constant_let(statement: Statement) -> bool:
+    return (
+        isinstance(statement, LetStatement)
+        and statement.value_token().kind() != GrinTokenKind.IDENTIFIER
+    )
+
+
+def _combine_lets(statements: list[Statement], report: dict[str, int]) -> None:
+    index = 0
+    while index < len(statements):
+        end = index
+        values = {}
+        while end < len(statements) and _is_constant_let(statements[end]):
+            values[statements[end].var_name()] = statements[end].value_token().value()
+            end += 1
+        if end - index > 1:
+            statements[index] = ConstantLetsStatement(statements[index], values, end)
+            report[COMBINED_LETS] += end - index
+        index = max(end, index + 1)
+
+
+def propagate_constants(
+    statements: list[Statement],
+) -> tuple[list[Statement], dict[str, int]]:
+    """Returns the statements with constants propagated and folded, along
+    with how many of each kind of change were made"""
+    report = {
+        CONSTANT_ARITHMETIC: 0,
+        PROPAGATED_CONSTANTS: 0,
+        CONSTANT_CONDITIONS: 0,
+        COMBINED_LETS: 0,
+    }
+    known = _analyze(statements)
+    if known is None:
+        known = [{}] * len(statements)
+
+    propagated = list(statements)
+    for index, statement in enumerate(statements):
+        if known[index] is not None:
+            replacement = _rewrite(statement, known[index], report)
+            if replacement is not None:
+                propagated[index] = replacement
+    _combine_lets(propagated, report)
+    return propagated, report
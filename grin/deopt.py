@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+# Deoptimization: the way back from speculative compiled code to the
+# reference Statement interpreter.  Speculative code checks its assumptions
+# with guards; when one fails, it raises Deoptimization before the line it
+# was running has changed anything.  The engine that ran it copies its state
+# back into a plain ProgramState with to_program_state(), records why in a
+# DeoptStats, and lets the interpreter carry on from the same line.
+
+from typing import Mapping
+
+from .program_state import ProgramState
+from .slots import SlotProgramState
+
+
+class Deoptimization(Exception):
+    """
+    Raised by speculative code when a guard fails
+    - reason says which assumption broke
+    - ip is the line to resume at, which the failed guard left untouched
+    """
+
+    def __init__(self, reason: str, ip: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.ip = ip
+
+
+class DeoptStats:
+    """
+    Counts deoptimizations
+    - reasons is keyed by the reason each one gave
+    - sites is keyed by the line each one resumed at
+    """
+
+    def __init__(self):
+        self.reasons: dict[str, int] = {}
+        self.sites: dict[int, int] = {}
+
+    def record(self, deoptimization: Deoptimization) -> None:
+        self.reasons[deoptimization.reason] = (
+            self.reasons.get(deoptimization.reason, 0) + 1
+        )
+        self.sites[deoptimization.ip] = self.sites.get(deoptimization.ip, 0) + 1
+
+    def total(self) -> int:
+        return sum(self.reasons.values())
+
+    def as_dict(self) -> dict[str, dict]:
+        return {'reasons': dict(self.reasons), 'sites': dict(self.sites)}
+
+
+def from_program_state(
+    state: ProgramState, slot_table: Mapping[str, int]
+) -> SlotProgramState:
+    """A SlotProgramState that carries on from where state is, sharing its
+    return stack and output"""
+    compiled = SlotProgramState(
+        state.token_lines, slot_table, state.input_func, state.output_func
+    )
+    compiled.vars = state.vars
+    compiled.ip = state.ip
+    compiled.goto_labels = state.goto_labels
+    compiled.return_stack = state.return_stack
+    compiled.output = state.output
+    return compiled
+
+
+def to_program_state(compiled: SlotProgramState, state: ProgramState) -> None:
+    """Copies everything a run on compiled can change back into state, the
+    ProgramState it was made from"""
+    state.ip = compiled.ip
+    state.vars = dict(compiled.vars)
+    state.return_stack = compiled.return_stack
+    state.output = compiled.output
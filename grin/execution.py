@@ -1,6 +1,11 @@
 #!/usr/bin/env python3
 
-from .utility import GrinRuntimeError
+from .utility import (
+    GrinRuntimeError,
+    build_goto_labels as _build_goto_labels,
+    get_starter_index as _get_starter_index,
+    is_tail_call as _is_tail_call,
+)
 from .token import GrinToken, GrinTokenKind
 from .statements import (
     AddStatement,
@@ -16,95 +21,504 @@ from .statements import (
     ReturnStatement,
     InstrStatement,
     InnumStatement,
+    JumpStatement,
+    ArithmeticStatement,
+    FusedStatement,
+    TailCallStatement,
+    UnbuiltStatement,
 )
-from typing import Callable
+from functools import partial
+from types import MappingProxyType
+from typing import Callable, Mapping
 from .program_state import ProgramState
+from .slots import SlotProgramState, assign_slots
+from .closures import build_closures, run_closures
+from .transpiler import transpile
+from .bytecode import assemble, run_bytecode
+from .cfg import build_cfg
+from .constants import propagate_constants
+from .hoisting import HOISTED_STATEMENTS, hoist_loop_invariants
+from .inlining import INLINED_CALLS, inline_subroutines
+from .jumps import drop_unreachable, thread_jumps
+from .liveness import DEAD_STORES, eliminate_dead_stores, unread_variables
+from .loops import fold_counting_loops
+from .memoization import memoize_subroutines
+from .peephole import fuse_superinstructions
+from .profiles import Profile, load_profile, run_profiled, save_profile
+from .tiers import TieredRunner
+from .tracing import TracingJIT
 
+ENGINES = ('statements', 'closures', 'python', 'bytecode', 'tracing', 'tiered')
 
-def _get_starter_index(tokens: list[GrinToken]):
-    """A function that gets the token considering the possiblity of labels"""
-    if (
-        len(tokens) >= 2
-        and tokens[0].kind() == GrinTokenKind.IDENTIFIER
-        and tokens[1].kind() == GrinTokenKind.COLON
-    ):
-        return 2
+
+def _build_statement(
+    token_lines: list[list[GrinToken]], index: int, tail_calls: bool = True
+) -> Statement:
+    """Convert the token line at index into an executable Statement.
+    With tail_calls, a GOSUB followed by a RETURN becomes a TailCallStatement."""
+    tokens = token_lines[index]
+    start = _get_starter_index(tokens)
+    keyword = tokens[start].kind()
+    if keyword == GrinTokenKind.LET:
+        return LetStatement(tokens[start + 1], tokens[start + 2])
+    elif keyword == GrinTokenKind.PRINT:
+        return PrintStatement(tokens[start + 1])
+    elif keyword == GrinTokenKind.END:
+        return EndStatement()
+    elif keyword == GrinTokenKind.ADD:
+        return AddStatement(tokens[start + 1], tokens[start + 2])
+    elif keyword == GrinTokenKind.SUB:
+        return SubStatement(tokens[start + 1], tokens[start + 2])
+    elif keyword == GrinTokenKind.MULT:
+        return MultStatement(tokens[start + 1], tokens[start + 2])
+    elif keyword == GrinTokenKind.DIV:
+        return DivStatement(tokens[start + 1], tokens[start + 2])
+    elif keyword == GrinTokenKind.GOTO:
+        if len(tokens) > start + 2:
+            # start+2: IF
+            # 3, 4, 5 are operands and comparison operator
+            condition = (tokens[start + 3], tokens[start + 4], tokens[start + 5])
+        else:
+            condition = None
+        return GoToStatement(tokens[start + 1], condition)
+    elif keyword == GrinTokenKind.GOSUB:
+        target = tokens[start + 1]
+        cond = None
+        if len(tokens) > start + 2:
+            cond = (tokens[start + 3], tokens[start + 4], tokens[start + 5])
+        if tail_calls and _is_tail_call(token_lines, index):
+            return TailCallStatement(target, cond)
+        return GoSubStatement(target, cond)
+    elif keyword == GrinTokenKind.RETURN:
+        return ReturnStatement()
+    elif keyword == GrinTokenKind.INSTR:
+        return InstrStatement(tokens[start + 1])
+    elif keyword == GrinTokenKind.INNUM:
+        return InnumStatement(tokens[start + 1])
     else:
-        return 0
+        raise GrinRuntimeError('Not implemented')
+
+
+# The keywords whose Statements don't depend on the line they're on, so that
+# every line spelled the same way can share one.  Jumps resolve their targets
+# relative to their own lines and cache where those lead, so each has its own
+_SHAREABLE_KEYWORDS = frozenset(
+    (
+        GrinTokenKind.LET,
+        GrinTokenKind.PRINT,
+        GrinTokenKind.END,
+        GrinTokenKind.ADD,
+        GrinTokenKind.SUB,
+        GrinTokenKind.MULT,
+        GrinTokenKind.DIV,
+        GrinTokenKind.RETURN,
+        GrinTokenKind.INSTR,
+        GrinTokenKind.INNUM,
+    )
+)
+
 
+def _shared_key(tokens: list[GrinToken]) -> tuple | None:
+    """The keyword and operands of a line as written, leaving out its label
+    and where it is, or None if the line needs a Statement of its own"""
+    start = _get_starter_index(tokens)
+    if tokens[start].kind() not in _SHAREABLE_KEYWORDS:
+        return None
+    return tuple((token.kind(), token.text()) for token in tokens[start:])
+
+
+def _build_shared_statement(
+    token_lines: list[list[GrinToken]],
+    index: int,
+    tail_calls: bool,
+    shared: dict[tuple, Statement],
+) -> Statement:
+    """Like _build_statement, but hands back the Statement already built for
+    an earlier line spelled the same way, if it can be shared"""
+    key = _shared_key(token_lines[index])
+    if key is None:
+        return _build_statement(token_lines, index, tail_calls)
+    statement = shared.get(key)
+    if statement is None:
+        statement = shared[key] = _build_statement(token_lines, index, tail_calls)
+    return statement
+
+
+def _build_statements(
+    token_lines: list[list[GrinToken]], tail_calls: bool = True, share: bool = True
+) -> list[Statement]:
+    """Convert token lines into executable Statement objects (one per program line).
+    With share, lines spelled the same way share one Statement where they can."""
+    if not share:
+        return [
+            _build_statement(token_lines, index, tail_calls)
+            for index in range(len(token_lines))
+        ]
+    shared: dict[tuple, Statement] = {}
+    return [
+        _build_shared_statement(token_lines, index, tail_calls, shared)
+        for index in range(len(token_lines))
+    ]
+
+
+def _build_lazy_statements(
+    token_lines: list[list[GrinToken]],
+    goto_labels: Mapping[str, int],
+    tail_calls: bool = True,
+) -> list[Statement]:
+    """A table of one Statement per program line in which each line's
+    Statement is only built, and its literal target resolved, the first time
+    the line runs"""
+    line_count = len(token_lines)
+    shared: dict[tuple, Statement] = {}
+
+    def build(index: int) -> Statement:
+        statement = _build_shared_statement(token_lines, index, tail_calls, shared)
+        if isinstance(statement, JumpStatement):
+            statement.resolve_static(index, goto_labels, line_count)
+        return statement
 
-def _build_statements(token_lines: list[list[GrinToken]]) -> list[Statement]:
-    """Convert token lines into executable Statement objects (one per program line)."""
     statements: list[Statement] = []
-    for tokens in token_lines:
-        start = _get_starter_index(tokens)
-        keyword = tokens[start].kind()
-        if keyword == GrinTokenKind.LET:
-            statements.append(LetStatement(tokens[start + 1], tokens[start + 2]))
-        elif keyword == GrinTokenKind.PRINT:
-            statements.append(PrintStatement(tokens[start + 1]))
-        elif keyword == GrinTokenKind.END:
-            statements.append(EndStatement())
-        elif keyword == GrinTokenKind.ADD:
-            statements.append(AddStatement(tokens[start + 1], tokens[start + 2]))
-        elif keyword == GrinTokenKind.SUB:
-            statements.append(SubStatement(tokens[start + 1], tokens[start + 2]))
-        elif keyword == GrinTokenKind.MULT:
-            statements.append(MultStatement(tokens[start + 1], tokens[start + 2]))
-        elif keyword == GrinTokenKind.DIV:
-            statements.append(DivStatement(tokens[start + 1], tokens[start + 2]))
-        elif keyword == GrinTokenKind.GOTO:
-            if len(tokens) > start + 2:
-                # start+2: IF
-                # 3, 4, 5 are operands and comparison operator
-                condition = (tokens[start + 3], tokens[start + 4], tokens[start + 5])
-            else:
-                condition = None
-            statements.append(GoToStatement(tokens[start + 1], condition))
-        elif keyword == GrinTokenKind.GOSUB:
-            target = tokens[start + 1]
-            cond = None
-            if len(tokens) > start + 2:
-                cond = (tokens[start + 3], tokens[start + 4], tokens[start + 5])
-            statements.append(GoSubStatement(target, cond))
-        elif keyword == GrinTokenKind.RETURN:
-            statements.append(ReturnStatement())
-        elif keyword == GrinTokenKind.INSTR:
-            statements.append(InstrStatement(tokens[start + 1]))
-        elif keyword == GrinTokenKind.INNUM:
-            statements.append(InnumStatement(tokens[start + 1]))
-        else:
-            raise GrinRuntimeError('Not implemented')
+    statements.extend([UnbuiltStatement(statements, build)] * line_count)
     return statements
 
 
-def _build_goto_labels(token_lines: list[list[GrinToken]]) -> dict[str, int]:
-    """Builds labels reference for GOTO statements"""
-    labels = {}
-    for index, tokens in enumerate(token_lines):
-        if (
-            len(tokens) >= 2
-            and tokens[0].kind() == GrinTokenKind.IDENTIFIER
-            and tokens[1].kind() == GrinTokenKind.COLON
-        ):
-            labels[tokens[0].text()] = index
-    return labels
+def run_statements(statements: tuple[Statement, ...], state: ProgramState) -> None:
+    """Runs Statement objects from state.ip until the program ends"""
+    # This while loop condition is a way
+    # to safeguard proper GOTO # or "Label"
+    # Also to end by unbounding state.ip
+    while 0 <= state.ip < len(statements):
+        statements[state.ip].execute(state)
+
+
+def _resolve_static_targets(
+    statements: list[Statement], goto_labels: Mapping[str, int]
+) -> None:
+    """Resolves every literal GOTO/GOSUB target to an absolute line index once,
+    so only identifier targets are resolved while the program runs"""
+    for index, statement in enumerate(statements):
+        if isinstance(statement, JumpStatement):
+            statement.resolve_static(index, goto_labels, len(statements))
+
+
+class CompiledProgram:
+    """
+    A Grin program that has been built once and can be run many times.
+    - token_lines is the program itself in grin tokens
+    - statements holds one executable Statement per program line; lines
+      other than jumps that are written the same way share one
+    - goto_labels maps each label to the index of the line it's attached to
+    - engine names what runs the program: 'statements' walks the Statement
+      objects, 'closures' runs closures built by grin.closures, 'python'
+      runs a single Python function generated by grin.transpiler,
+      'bytecode' runs the VM in grin.bytecode, 'tracing' walks the
+      Statement objects, compiling hot loops with grin.tracing, and
+      'tiered' walks the Statement objects until the program proves hot,
+      then switches to closures (see grin.tiers)
+    - optimize turns on the optimization passes over the Statement objects;
+      optimization_report() counts what each of them did.  Under the
+      'tiered' engine subroutines aren't inlined, loop invariants aren't
+      hoisted and dead stores aren't removed, so the report counts 0 of
+      each
+    - profile, recorded by earlier runs (see grin.profiles), pre-specializes
+      the arithmetic lines that only ever saw one pair of operand types, puts
+      the hottest blocks first in the 'python' engine's dispatch and
+      promotes a program it shows to be hot under the 'tiered' engine
+    - tail_calls runs every GOSUB followed by a RETURN as a jump that leaves
+      the subroutine to return straight to its caller's caller, so recursing
+      through one doesn't grow the return stack; turning it off keeps every
+      return address, which can help when debugging
+    - memoize remembers what each call to a pure subroutine (see
+      grin.memoization) set, so that calls with the same values skip it;
+      memo_stats() says how often they did.  Only the engines that run the
+      Statement objects memoize: 'statements', 'tracing' and 'tiered' until
+      it promotes the program
+    - lazy builds each line's Statement the first time it runs instead of
+      every one up front, which saves time starting a huge program that
+      only runs a few of its lines; labels are still found up front.  The
+      optimization passes, memoization and a profile need every Statement
+      at once, so none of them can be used with it
+    One instance can be run from several threads at once, since every run
+    gets its own ProgramState.  What changes as it runs is shared by every
+    run, in any thread:
+    arithmetic statements quicken themselves, jumps to variables cache where
+    they led, subroutine memos remember calls, a lazy program builds its
+    lines, the 'tracing' engine records traces and the 'tiered' engine
+    promotes the program.  Each of those is safe to share, but the counters
+    kept alongside them (inline_cache_stats(), memo_stats(), the tracer's
+    stats() and the counts kept by tiers()) aren't locked, so they can miss
+    updates made by runs in different threads at the same time.
+    """
+
+    def __init__(
+        self,
+        token_lines: list[list[GrinToken]],
+        engine: str = 'statements',
+        cache_dir: str | None = None,
+        optimize: bool = False,
+        profile: Profile | None = None,
+        tail_calls: bool = True,
+        memoize: bool = False,
+        lazy: bool = False,
+    ):
+        if engine not in ENGINES:
+            raise ValueError(f'Unknown engine: {engine}')
+        if lazy and (optimize or memoize or profile is not None):
+            raise ValueError(
+                'Lazily built statements cannot be optimized, memoized or profiled'
+            )
+
+        self._token_lines = tuple(token_lines)
+        self._engine = engine
+        self._goto_labels = MappingProxyType(_build_goto_labels(self._token_lines))
+        self._optimization_report: dict[str, int] = {}
+        if lazy:
+            # Left a list, which the lines fill in as they're built
+            self._statements = _build_lazy_statements(
+                self._token_lines, self._goto_labels, tail_calls
+            )
+        else:
+            statements = _build_statements(self._token_lines, tail_calls)
+            _resolve_static_targets(statements, self._goto_labels)
+            if optimize:
+                statements = self._optimize(statements)
+            if memoize:
+                # Last, so the memos run the statements as they'll finally be
+                statements, memoized = memoize_subroutines(statements)
+                self._optimization_report.update(memoized)
+            self._statements = tuple(statements)
+        if profile is not None:
+            self._specialize(profile)
+
+        # _runner takes a ProgramState made by _new_state and runs the program
+        # to its end
+        self._new_state = partial(ProgramState, self._token_lines)
+        self._tracer = None
+        self._tiers = None
+        if engine == 'closures':
+            slot_table = MappingProxyType(assign_slots(self._token_lines))
+            closures = tuple(
+                build_closures(
+                    self._token_lines, self._goto_labels, slot_table, None, tail_calls
+                )
+            )
+            self._new_state = partial(SlotProgramState, self._token_lines, slot_table)
+            self._runner = partial(run_closures, closures)
+        elif engine == 'python':
+            hot_lines = () if profile is None else profile.hot_lines()
+            self._runner = transpile(
+                self._token_lines, self._goto_labels, cache_dir, hot_lines, tail_calls
+            )
+        elif engine == 'bytecode':
+            bytecode = assemble(self._token_lines, self._goto_labels, tail_calls)
+            self._new_state = partial(
+                SlotProgramState, self._token_lines, bytecode.slot_table()
+            )
+            self._runner = partial(run_bytecode, bytecode)
+        elif engine == 'tracing':
+            self._tracer = TracingJIT(self._statements)
+            self._runner = self._tracer.run
+        elif engine == 'tiered':
+            self._tiers = TieredRunner(
+                self._token_lines,
+                self._goto_labels,
+                self._statements,
+                tail_calls=tail_calls,
+            )
+            self._runner = self._tiers.run
+            if (
+                profile is not None
+                and profile.total_hits() >= self._tiers.promotion_instructions
+            ):
+                self._tiers.promote()
+        else:
+            self._runner = partial(run_statements, self._statements)
+
+    def _optimize(self, statements: list[Statement]) -> list[Statement]:
+        # The 'tiered' engine can switch between these statements and closures
+        # built from the program as written at any line, so it skips the
+        # passes after which the variables there, or whether the line runs at
+        # all, can differ from the program as written
+        reshape = self._engine != 'tiered'
+        if reshape:
+            statements, inlined = inline_subroutines(statements)
+            self._optimization_report.update(inlined)
+            cfg = build_cfg(self._token_lines, self._goto_labels)
+            statements, hoisted = hoist_loop_invariants(statements, cfg)
+            self._optimization_report.update(hoisted)
+        else:
+            self._optimization_report.update(
+                {INLINED_CALLS: 0, HOISTED_STATEMENTS: 0, DEAD_STORES: 0}
+            )
+        statements, fusions = fuse_superinstructions(statements)
+        self._optimization_report.update(fusions)
+        statements, loops = fold_counting_loops(statements)
+        self._optimization_report.update(loops)
+        # Constants are propagated after the loop passes, which look for loops
+        # written out in full, and before the jump passes, which then follow
+        # the conditions it settled
+        statements, constants = propagate_constants(statements)
+        self._optimization_report.update(constants)
+        statements, threaded = thread_jumps(statements)
+        self._optimization_report.update(threaded)
+        statements, unreachable = drop_unreachable(statements)
+        self._optimization_report.update(unreachable)
+        # Last, so that the stores the other passes stopped reading are dead
+        if reshape:
+            statements, dead = eliminate_dead_stores(statements)
+            self._optimization_report.update(dead)
+        return statements
+
+    def _specialize(self, profile: Profile) -> None:
+        for index, statement in enumerate(self._statements):
+            if isinstance(statement, FusedStatement):
+                statement = statement.parts()[0]
+            types = profile.monomorphic_types(index)
+            if isinstance(statement, ArithmeticStatement) and types is not None:
+                statement.specialize(*types)
+
+    def optimization_report(self) -> dict[str, int]:
+        """How many times each optimization was applied to this program"""
+        return dict(self._optimization_report)
+
+    def unread_variables(self) -> list[str]:
+        """The names of the variables the program changes but never reads,
+        in order, whether or not it was optimized"""
+        return unread_variables(_build_statements(self._token_lines))
+
+    def token_lines(self) -> tuple[list[GrinToken], ...]:
+        return self._token_lines
+
+    def statements(self) -> tuple[Statement, ...]:
+        """One Statement per line; in a lazy program, each line that hasn't
+        run yet holds the same UnbuiltStatement"""
+        return tuple(self._statements)
+
+    def goto_labels(self) -> Mapping[str, int]:
+        return self._goto_labels
+
+    def line_count(self) -> int:
+        return len(self._token_lines)
+
+    def engine(self) -> str:
+        return self._engine
+
+    def inline_cache_stats(self) -> dict[int, tuple[int, int]]:
+        """Maps the index of each GOTO/GOSUB whose identifier target has been
+        looked up to its inline cache's (hits, misses), summed over every run"""
+        return {
+            index: (statement.cache_hits, statement.cache_misses)
+            for index, statement in enumerate(self._statements)
+            if isinstance(statement, JumpStatement)
+            and statement.cache_hits + statement.cache_misses > 0
+        }
+
+    def memo_stats(self) -> dict[int, tuple[int, int]]:
+        """Maps the index of each memoized GOSUB that has been taken to how
+        many of its calls were remembered and how many had to run, as (hits,
+        misses), summed over every run"""
+        return {
+            index: (statement.memo_hits, statement.memo_misses)
+            for index, statement in enumerate(self._statements)
+            if isinstance(statement, GoSubStatement)
+            and statement.memo_hits + statement.memo_misses > 0
+        }
+
+    def tracer(self) -> TracingJIT | None:
+        """The TracingJIT running this program under the 'tracing' engine, whose
+        stats() say which loops were traced and how often they were left"""
+        return self._tracer
+
+    def tiers(self) -> TieredRunner | None:
+        """The TieredRunner running this program under the 'tiered' engine,
+        which says whether and when the program was promoted"""
+        return self._tiers
+
+    def run(
+        self,
+        input_func: Callable = input,
+        output_func: Callable | None = None,
+        profile: Profile | None = None,
+    ):
+        """Runs the program against a fresh ProgramState and returns its output.
+        Given a profile, the program runs on the Statement interpreter whatever
+        the engine, recording what it does into that profile"""
+        if profile is not None:
+            state = ProgramState(self._token_lines, input_func, output_func)
+            state.goto_labels = self._goto_labels
+            run_profiled(self._statements, state, profile)
+            return state.output
+
+        state = self._new_state(input_func, output_func)
+        state.goto_labels = self._goto_labels
+        self._runner(state)
+        return state.output
+
+
+def compile(
+    token_lines: list[list[GrinToken]],
+    engine: str = 'statements',
+    cache_dir: str | None = None,
+    optimize: bool = False,
+    profile: Profile | None = None,
+    tail_calls: bool = True,
+    memoize: bool = False,
+    lazy: bool = False,
+) -> CompiledProgram:
+    """Builds grin tokens into a CompiledProgram that can be run repeatedly.
+    cache_dir is where the 'python' engine keeps its compiled code objects,
+    optimize turns on the optimization passes, profile guides the build,
+    tail_calls runs GOSUBs followed by RETURNs as jumps, memoize remembers
+    the calls to pure subroutines and lazy builds each line the first time it
+    runs (see CompiledProgram)"""
+    return CompiledProgram(
+        token_lines, engine, cache_dir, optimize, profile, tail_calls, memoize, lazy
+    )
 
 
 def execute(
     token_lines: list[list[GrinToken]],
     input_func: Callable = input,
     output_func: Callable | None = None,
+    engine: str = 'tiered',
+    optimize: bool = False,
+    profile_dir: str | None = None,
+    tail_calls: bool = True,
+    memoize: bool = False,
 ):
-    """Executes gin tokens with optional input_func parameter for testing INNUM, INSTR"""
-    state = ProgramState(token_lines, input_func, output_func)
+    """Executes gin tokens with optional input_func parameter for testing INNUM, INSTR,
+    engine parameter choosing how the program is run (see ENGINES; by default
+    it starts on the Statement interpreter and promotes hot programs),
+    optimize parameter turning on the optimization passes and profile_dir
+    parameter turning on profiles: the program is built with the profile saved
+    there for it, or if there isn't one yet, runs while recording one, and
+    tail_calls parameter, which can be turned off for debugging to keep the
+    return address of every GOSUB, even one followed by a RETURN, and memoize
+    parameter remembering the calls to pure subroutines (see CompiledProgram)"""
+    profile = None if profile_dir is None else load_profile(profile_dir, token_lines)
+    program = compile(
+        token_lines,
+        engine,
+        optimize=optimize,
+        profile=profile,
+        tail_calls=tail_calls,
+        memoize=memoize,
+    )
+    if profile_dir is None or profile is not None:
+        return program.run(input_func, output_func)
+
+    profile = Profile()
+    try:
+        return program.run(input_func, output_func, profile)
+    finally:
+        save_profile(profile, profile_dir, token_lines)
 
-    statements = _build_statements(token_lines)
-    state.goto_labels = _build_goto_labels(token_lines)
-    # This while loop condition is a way
-    # to safeguard proper GOTO # or "Label"
-    # Also to end by unbounding state.ip
-    while 0 <= state.ip < len(state.token_lines):
-        statements[state.ip].execute(state)
 
-    return state.output
+__all__ = [
+    'ENGINES',
+    CompiledProgram.__name__,
+    compile.__name__,
+    execute.__name__,
+    run_statements.__name__,
+]
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+# Loop-invariant code motion over the natural loops of grin.cfg.
+#
+# Line indices can't change, so instead of moving invariant statements out to
+# a new preheader, the pass reorders the loop's header block so that they
+# come first and then points the loop's back edges just past them.  Those
+# lines then act as the preheader: they run when the loop is entered, and
+# never again until it's left and entered anew.  A LET or ADD/SUB/MULT/DIV
+# in the header block is hoisted when
+#
+# * every line of the loop that changes its variable is hoisted with it,
+# * whatever it reads is either changed nowhere in the loop or set by a LET
+#   hoisted ahead of it, so running the hoisted lines again would give every
+#   variable the value it already has, and
+# * it can be moved ahead of the header block's other lines: it doesn't read
+#   or change what they change, or change what they read, and it isn't moved
+#   ahead of anything that could fail or print or read input unless it's a
+#   LET, which can't fail itself.
+#
+# The only lines of a block that jumps can land on are its first, so
+# reordering the lines of one doesn't disturb any jump, and jumps themselves
+# never move.  A loop that contains a GOSUB (whose subroutine could change
+# anything) or a tail call into one, or that's re-entered by falling through
+# into its header, is left alone, as is every loop in a program with a
+# GOTO/GOSUB on a variable.
+
+from .cfg import ControlFlowGraph, Loop
+from .statements import (
+    ArithmeticStatement,
+    GoSubStatement,
+    GoToStatement,
+    InlinedCallStatement,
+    InnumStatement,
+    InstrStatement,
+    JumpStatement,
+    LetStatement,
+    PrintStatement,
+    Statement,
+    TailCallStatement,
+)
+from .token import GrinTokenKind
+
+HOISTED_STATEMENTS = 'hoisted statements'
+
+
+def _reads(statement: Statement) -> set[str]:
+    if isinstance(statement, InlinedCallStatement):
+        return set().union(*map(_reads, statement.body()))
+    tokens = []
+    if isinstance(statement, (LetStatement, ArithmeticStatement, PrintStatement)):
+        tokens.append(statement.value_token())
+    if isinstance(statement, JumpStatement) and statement.condition() is not None:
+        tokens.extend(statement.condition())
+    reads = {
+        token.text() for token in tokens if token.kind() == GrinTokenKind.IDENTIFIER
+    }
+    if isinstance(statement, ArithmeticStatement):
+        reads.add(statement.var_name())
+    return reads
+
+
+def _writes(statement: Statement) -> set[str]:
+    if isinstance(statement, InlinedCallStatement):
+        return set().union(*map(_writes, statement.body()))
+    if isinstance(
+        statement, (LetStatement, ArithmeticStatement, InstrStatement, InnumStatement)
+    ):
+        return {statement.var_name()}
+    return set()
+
+
+def _can_move_ahead(statement: Statement, other: Statement) -> bool:
+    """Whether statement can run before other, which runs first now"""
+    if _writes(other) & (_reads(statement) | _writes(statement)):
+        return False
+    if _writes(statement) & _reads(other):
+        return False
+    # A failure has to come from the same line, after the same output
+    return isinstance(statement, LetStatement) or isinstance(other, LetStatement)
+
+
+def _hoistable(
+    statements: list[Statement],
+    header_lines: range,
+    writers: dict[str, list[int]],
+    banned: set[str],
+) -> list[int]:
+    """The lines at the top of the header block that can be hoisted, in the
+    order they'll run"""
+    hoisted = []
+    kept = []
+    assigned = set()
+    for line in header_lines:
+        statement = statements[line]
+        if not isinstance(statement, (LetStatement, ArithmeticStatement)):
+            kept.append(line)
+            continue
+        name = statement.var_name()
+        if (
+            name not in banned
+            and all(writer in header_lines for writer in writers[name])
+            and all(
+                read in assigned or read not in writers for read in _reads(statement)
+            )
+            and all(_can_move_ahead(statement, statements[other]) for other in kept)
+        ):
+            hoisted.append(line)
+            if isinstance(statement, LetStatement):
+                assigned.add(name)
+        else:
+            kept.append(line)
+    return hoisted
+
+
+def _hoist(statements: list[Statement], cfg: ControlFlowGraph, loop: Loop) -> int:
+    """Hoists the loop's invariant statements, returning how many there were"""
+    lines = sorted(
+        line
+        for index in loop.blocks()
+        for line in range(cfg.block(index).start(), cfg.block(index).end())
+    )
+    header = cfg.block(loop.header())
+    head = header.start()
+    if any(
+        isinstance(statements[line], (GoSubStatement, TailCallStatement))
+        for line in lines
+    ):
+        return 0
+    before = statements[head - 1] if head > 0 else None
+    if head - 1 in lines and not (
+        isinstance(before, GoToStatement) and before.condition() is None
+    ):
+        return 0
+
+    writers: dict[str, list[int]] = {}
+    for line in lines:
+        for name in _writes(statements[line]):
+            writers.setdefault(name, []).append(line)
+
+    # A variable with a line that can't be hoisted keeps all of its lines in
+    # the loop, which can stop others from being hoisted in turn
+    header_lines = range(head, header.end())
+    banned: set[str] = set()
+    while True:
+        hoisted = _hoistable(statements, header_lines, writers, banned)
+        unhoisted = {
+            name
+            for line in hoisted
+            for name in _writes(statements[line])
+            if not set(writers[name]) <= set(hoisted)
+        }
+        if not unhoisted:
+            break
+        banned |= unhoisted
+    if not hoisted:
+        return 0
+
+    moved = set(hoisted)
+    kept = [line for line in header_lines if line not in moved]
+    reordered = [statements[line] for line in hoisted + kept]
+    statements[head : header.end()] = reordered
+
+    entry = head + len(hoisted)
+    for line in lines:
+        statement = statements[line]
+        if (
+            isinstance(statement, JumpStatement)
+            and statement.static_destination() == head
+        ):
+            statement.thread_to(entry)
+    return len(hoisted)
+
+
+def hoist_loop_invariants(
+    statements: list[Statement], cfg: ControlFlowGraph
+) -> tuple[list[Statement], dict[str, int]]:
+    """Returns the statements with every loop's invariant statements hoisted,
+    given the program's control-flow graph, along with how many were"""
+    hoisted = list(statements)
+    report = {HOISTED_STATEMENTS: 0}
+    if cfg.has_dynamic_edges():
+        return hoisted, report
+    for loop in cfg.loops():
+        report[HOISTED_STATEMENTS] += _hoist(hoisted, cfg, loop)
+    return hoisted, report
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+# Subroutine inlining.  A GOSUB with a literal target and no condition whose
+# subroutine is short and straight-line (up to MAX_INLINED_STATEMENTS LETs,
+# PRINTs, ADD/SUB/MULT/DIVs, INNUMs and INSTRs, then a RETURN) is replaced by
+# an InlinedCallStatement that runs copies of those statements itself.  A
+# call then costs neither the return stack's push and pop nor the jumps
+# there and back.
+#
+# The subroutine keeps its lines, so a GOSUB on a variable, or any other
+# GOSUB, can still call it.  Nothing in the subroutine jumps, so its copies
+# do whatever running it would, wherever else it's entered from; no line
+# moves, so every line is still a valid target.
+
+import copy
+
+from .statements import (
+    ArithmeticStatement,
+    GoSubStatement,
+    InlinedCallStatement,
+    InnumStatement,
+    InstrStatement,
+    LetStatement,
+    PrintStatement,
+    ReturnStatement,
+    Statement,
+)
+
+INLINED_CALLS = 'inlined calls'
+
+# Statements a subroutine may run before its RETURN and still be inlined
+MAX_INLINED_STATEMENTS = 8
+
+_STRAIGHT_LINE = (
+    LetStatement,
+    ArithmeticStatement,
+    PrintStatement,
+    InstrStatement,
+    InnumStatement,
+)
+
+
+def _body(statements: list[Statement], start: int) -> list[Statement] | None:
+    """The statements of the subroutine starting on line start, up to its
+    RETURN, or None if it's too long or doesn't go straight there"""
+    end = min(len(statements), start + MAX_INLINED_STATEMENTS + 1)
+    for line in range(start, end):
+        if isinstance(statements[line], ReturnStatement):
+            return statements[start:line]
+        if not isinstance(statements[line], _STRAIGHT_LINE):
+            return None
+    return None
+
+
+def inline_subroutines(
+    statements: list[Statement],
+) -> tuple[list[Statement], dict[str, int]]:
+    """Returns the statements with every call to a short, straight-line
+    subroutine inlined, along with how many calls were"""
+    inlined = list(statements)
+    report = {INLINED_CALLS: 0}
+    bodies: dict[int, list[Statement] | None] = {}
+    for index, statement in enumerate(statements):
+        if (
+            not isinstance(statement, GoSubStatement)
+            or statement.condition() is not None
+        ):
+            continue
+        start = statement.static_destination()
+        if start is None:
+            continue
+        if start not in bodies:
+            bodies[start] = _body(statements, start)
+        if bodies[start] is None:
+            continue
+
+        # Every call gets its own copies, which quicken for the types of the
+        # values it passes
+        body = tuple(copy.copy(part) for part in bodies[start])
+        inlined[index] = InlinedCallStatement(statement, body)
+        report[INLINED_CALLS] += 1
+    return inlined, report
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+# Two passes over a program's control flow:
+#
+# * thread_jumps() points every GOTO/GOSUB with a literal target that lands
+#   on an unconditional GOTO straight at the line that chain of GOTOs ends on,
+#   so taking it no longer runs the GOTOs in between.
+# * drop_unreachable() replaces every line that no path from the first line
+#   can reach with an UnreachableStatement (see grin.statements).  A GOTO or
+#   GOSUB whose target is a variable could reach any line, so a program with
+#   one keeps every line.
+#
+# Neither pass moves a line, so labels and the relative targets of the jumps
+# that are left still mean what they did.
+
+from .statements import (
+    CountingLoopStatement,
+    EndStatement,
+    FusedStatement,
+    GoSubStatement,
+    GoToStatement,
+    JumpStatement,
+    ReturnStatement,
+    Statement,
+    UnreachableStatement,
+)
+from .token import GrinTokenKind
+
+SKIPPED_GOTOS = 'skipped GOTOs'
+UNREACHABLE_LINES = 'unreachable lines'
+
+
+def _is_unconditional_goto(statement: Statement) -> bool:
+    return (
+        isinstance(statement, GoToStatement)
+        and statement.condition() is None
+        and statement.static_destination() is not None
+    )
+
+
+def thread_jumps(
+    statements: list[Statement],
+) -> tuple[list[Statement], dict[str, int]]:
+    """Returns the statements with every literal jump threaded through the
+    chain of unconditional GOTOs it lands on, along with how many GOTOs those
+    jumps now skip between them"""
+    report = {SKIPPED_GOTOS: 0}
+    for statement in statements:
+        if not isinstance(statement, JumpStatement):
+            continue
+        destination = statement.static_destination()
+        if destination is None:
+            continue
+
+        skipped = 0
+        visited = set()
+        while (
+            destination < len(statements)
+            and destination not in visited
+            and _is_unconditional_goto(statements[destination])
+        ):
+            visited.add(destination)
+            destination = statements[destination].static_destination()
+            skipped += 1
+
+        # A chain that loops forever is left to loop forever
+        if skipped > 0 and destination not in visited:
+            statement.thread_to(destination)
+            report[SKIPPED_GOTOS] += skipped
+    return list(statements), report
+
+
+def _successors(statement: Statement, index: int) -> list[int] | None:
+    """The lines that can run after the statement on line index, or None if
+    it could jump anywhere"""
+    if isinstance(statement, CountingLoopStatement):
+        successors = _successors(statement.original(), index)
+        return None if successors is None else successors + [statement.exit()]
+    if isinstance(statement, FusedStatement):
+        # The second half runs as it was when the two were fused, even if its
+        # own line has been rewritten since, so it counts as jumping from here
+        first, second = statement.parts()
+        successors = _successors(first, index)
+        rest = _successors(second, index + 1)
+        if successors is None or rest is None:
+            return None
+        return successors + rest
+    if isinstance(statement, (EndStatement, ReturnStatement)):
+        # Every line a RETURN can go back to follows a GOSUB, which leads
+        # there itself
+        return []
+    if not isinstance(statement, JumpStatement):
+        return [index + 1]
+    if statement.target_token().kind() == GrinTokenKind.IDENTIFIER:
+        return None
+
+    successors = []
+    # A jump to an invalid target fails instead of going anywhere
+    if statement.static_destination() is not None:
+        successors.append(statement.static_destination())
+    if statement.condition() is not None or isinstance(statement, GoSubStatement):
+        successors.append(index + 1)
+    return successors
+
+
+def drop_unreachable(
+    statements: list[Statement],
+) -> tuple[list[Statement], dict[str, int]]:
+    """Returns the statements with every line that can't be reached from the
+    first replaced by an UnreachableStatement, along with how many were"""
+    report = {UNREACHABLE_LINES: 0}
+    reachable = [False] * len(statements)
+    pending = [0] if statements else []
+    while pending:
+        index = pending.pop()
+        if index >= len(statements) or reachable[index]:
+            continue
+        reachable[index] = True
+        successors = _successors(statements[index], index)
+        if successors is None:
+            return list(statements), report
+        pending.extend(successors)
+
+    dropped = list(statements)
+    unreachable = UnreachableStatement()
+    for index, is_reachable in enumerate(reachable):
+        if not is_reachable:
+            dropped[index] = unreachable
+            report[UNREACHABLE_LINES] += 1
+    return dropped, report
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+
+# Liveness analysis and dead-store elimination.  A backward dataflow analysis
+# works out, for every line, which variables might be read before they're
+# next changed (are live) once it has run; nothing is live once the program
+# ends.  Then
+#
+# * a LET, or an ADD/SUB/MULT that can't fail, that changes a variable that
+#   isn't live afterwards becomes a NopStatement, and
+# * a ConstantLetsStatement stops setting the variables that aren't live
+#   after it,
+#
+# so neither the store nor the entry it would make in state.vars is left.
+# Whether arithmetic can fail depends on the types of its operands, so a
+# forward analysis works out which variables are sure to hold an int, a float
+# or a string whenever each line runs (every variable starts as the int 0).
+# DIV can always divide by zero, so it's never removed.
+#
+# A GOTO or GOSUB whose target is a variable could go anywhere, so a program
+# with one keeps every store.  No line moves, so every line is still a valid
+# target.  unread_variables() lists the variables a program changes but never
+# reads, whatever its jumps.
+
+from .statements import (
+    AddStatement,
+    ArithmeticStatement,
+    ConstantLetsStatement,
+    CountingLoopStatement,
+    EndStatement,
+    FusedStatement,
+    GoSubStatement,
+    InlinedCallStatement,
+    InnumStatement,
+    InstrStatement,
+    JumpStatement,
+    LetStatement,
+    MultStatement,
+    NopStatement,
+    PrintStatement,
+    ReturnStatement,
+    Statement,
+    SubStatement,
+    UnreachableStatement,
+)
+from .token import GrinToken, GrinTokenKind
+
+DEAD_STORES = 'dead stores'
+
+_LITERAL_TYPES = {
+    GrinTokenKind.LITERAL_INTEGER: int,
+    GrinTokenKind.LITERAL_FLOAT: float,
+    GrinTokenKind.LITERAL_STRING: str,
+}
+
+_NUMBERS = (int, float)
+
+
+def _uses(statement: Statement) -> set[str]:
+    tokens = []
+    if isinstance(statement, (LetStatement, ArithmeticStatement, PrintStatement)):
+        tokens.append(statement.value_token())
+    if isinstance(statement, JumpStatement):
+        tokens.append(statement.target_token())
+        if statement.condition() is not None:
+            tokens.extend(statement.condition())
+    uses = {
+        token.text() for token in tokens if token.kind() == GrinTokenKind.IDENTIFIER
+    }
+    if isinstance(statement, ArithmeticStatement):
+        uses.add(statement.var_name())
+    return uses
+
+
+def defined_names(statement: Statement) -> set[str]:
+    """The variables the statement on its own sets"""
+    if isinstance(
+        statement, (LetStatement, ArithmeticStatement, InstrStatement, InnumStatement)
+    ):
+        return {statement.var_name()}
+    return set()
+
+
+def successor_lines(
+    statement: Statement, index: int, return_sites: list[int]
+) -> list[int] | None:
+    """The lines that can run after the statement on line index, or None if
+    it could jump anywhere"""
+    if isinstance(statement, FusedStatement):
+        first, second = statement.parts()
+        successors = successor_lines(first, index, return_sites)
+        if successors is None or index + 1 not in successors:
+            return successors
+        rest = successor_lines(second, index + 1, return_sites)
+        if rest is None:
+            return None
+        return [line for line in successors if line != index + 1] + rest
+    if isinstance(statement, CountingLoopStatement):
+        successors = successor_lines(statement.original(), index, return_sites)
+        return None if successors is None else successors + [statement.exit()]
+    if isinstance(statement, ConstantLetsStatement):
+        return [statement.exit()]
+    if isinstance(statement, (EndStatement, UnreachableStatement)):
+        return []
+    if isinstance(statement, ReturnStatement):
+        return return_sites
+    if isinstance(statement, JumpStatement):
+        if statement.target_token().kind() == GrinTokenKind.IDENTIFIER:
+            return None
+        successors = []
+        # A jump to an invalid target fails instead of going anywhere
+        if statement.static_destination() is not None:
+            successors.append(statement.static_destination())
+        # A GOSUB comes back to the next line through a RETURN
+        if statement.condition() is not None:
+            successors.append(index + 1)
+        return successors
+    if isinstance(
+        statement,
+        (
+            LetStatement,
+            ArithmeticStatement,
+            PrintStatement,
+            InstrStatement,
+            InnumStatement,
+            NopStatement,
+            InlinedCallStatement,
+        ),
+    ):
+        return [index + 1]
+    return None
+
+
+def _return_sites(statements: list[Statement]) -> list[int]:
+    return [
+        index + 1
+        for index, statement in enumerate(statements)
+        if isinstance(statement, GoSubStatement)
+    ]
+
+
+# Backward: which variables are live
+
+
+def live_before(
+    statement: Statement,
+    index: int,
+    live: list[set[str]],
+    return_sites: list[int],
+) -> set[str]:
+    """The variables live just before the statement on line index runs,
+    given those live before every line"""
+    if isinstance(statement, FusedStatement):
+        # The second half runs as it was when the two were fused, which
+        # isn't necessarily what its own line runs now
+        first, second = statement.parts()
+        after = set()
+        for line in successor_lines(first, index, return_sites):
+            if line == index + 1:
+                after |= live_before(second, line, live, return_sites)
+            else:
+                after |= live[line]
+        return _uses(first) | (after - defined_names(first))
+    if isinstance(statement, CountingLoopStatement):
+        before = live_before(statement.original(), index, live, return_sites)
+        before |= live[statement.exit()]
+        before.update(statement.updated_names())
+        if isinstance(statement.bound(), str):
+            before.add(statement.bound())
+        return before
+    if isinstance(statement, ConstantLetsStatement):
+        return live[statement.exit()] - statement.values().keys()
+    if isinstance(statement, InlinedCallStatement):
+        before = set(live[index + 1])
+        for part in reversed(statement.body()):
+            before = _uses(part) | (before - defined_names(part))
+        return before
+
+    after = set()
+    for line in successor_lines(statement, index, return_sites):
+        after |= live[line]
+    return _uses(statement) | (after - defined_names(statement))
+
+
+def _liveness(statements: list[Statement]) -> list[set[str]] | None:
+    """For each line, the variables live just before it runs, followed by
+    the (empty) set live once the program has run off its end; None if a
+    line could go anywhere"""
+    return_sites = _return_sites(statements)
+    predecessors: list[list[int]] = [[] for _ in range(len(statements) + 1)]
+    for index, statement in enumerate(statements):
+        successors = successor_lines(statement, index, return_sites)
+        if successors is None:
+            return None
+        for successor in successors:
+            predecessors[successor].append(index)
+
+    live: list[set[str]] = [set() for _ in range(len(statements) + 1)]
+    pending = list(range(len(statements)))
+    queued = [True] * len(statements)
+    while pending:
+        index = pending.pop()
+        queued[index] = False
+        before = live_before(statements[index], index, live, return_sites)
+        if before != live[index]:
+            live[index] = before
+            for predecessor in predecessors[index]:
+                if not queued[predecessor]:
+                    queued[predecessor] = True
+                    pending.append(predecessor)
+    return live
+
+
+# Forward: which variables have a known type
+
+
+def _operand_type(token: GrinToken, types: dict[str, type]) -> type | None:
+    if token.kind() == GrinTokenKind.IDENTIFIER:
+        return types.get(token.text())
+    return _LITERAL_TYPES[token.kind()]
+
+
+def _cannot_fail(statement: ArithmeticStatement, types: dict[str, type]) -> bool:
+    left = types.get(statement.var_name())
+    right = _operand_type(statement.value_token(), types)
+    if isinstance(statement, AddStatement) and left is str and right is str:
+        return True
+    if isinstance(statement, (AddStatement, SubStatement, MultStatement)):
+        return left in _NUMBERS and right in _NUMBERS
+    return False
+
+
+def _result_type(statement: ArithmeticStatement, types: dict[str, type]) -> type | None:
+    """The type the arithmetic statement gives its variable if it doesn't
+    fail, or None if that isn't known"""
+    left = types.get(statement.var_name())
+    right = _operand_type(statement.value_token(), types)
+    if left in _NUMBERS and right in _NUMBERS:
+        return float if float in (left, right) else int
+    if isinstance(statement, AddStatement) and left is str:
+        return str
+    if isinstance(statement, MultStatement) and str in (left, right):
+        return str
+    return None
+
+
+def _types_after(
+    statement: Statement, types: dict[str, type]
+) -> dict[str, type] | None:
+    """The types known once the statement has run, given those known before,
+    or None if it could do anything"""
+    after = dict(types)
+    if isinstance(statement, FusedStatement):
+        first, second = statement.parts()
+        after = _types_after(first, after)
+        return None if after is None else _types_after(second, after)
+    if isinstance(statement, CountingLoopStatement):
+        # Either the original statement runs, or the loop runs all at once
+        after = _types_after(statement.original(), after)
+        if after is None:
+            return None
+        updated = statement.updated_names()
+        return {
+            name: value_type
+            for name, value_type in after.items()
+            if name not in updated and types.get(name) is value_type
+        }
+    if isinstance(statement, InlinedCallStatement):
+        for part in statement.body():
+            after = _types_after(part, after)
+            if after is None:
+                return None
+        return after
+    if isinstance(statement, ConstantLetsStatement):
+        after.update((name, type(value)) for name, value in statement.values().items())
+    elif isinstance(statement, LetStatement):
+        value_type = _operand_type(statement.value_token(), types)
+        after[statement.var_name()] = value_type
+    elif isinstance(statement, ArithmeticStatement):
+        after[statement.var_name()] = _result_type(statement, types)
+    elif isinstance(statement, InstrStatement):
+        after[statement.var_name()] = str
+    elif isinstance(statement, InnumStatement):
+        after[statement.var_name()] = None
+    elif not isinstance(
+        statement,
+        (
+            PrintStatement,
+            JumpStatement,
+            EndStatement,
+            ReturnStatement,
+            NopStatement,
+            UnreachableStatement,
+        ),
+    ):
+        return None
+
+    for name, value_type in list(after.items()):
+        if value_type is None:
+            del after[name]
+    return after
+
+
+def _variable_names(statements: list[Statement]) -> set[str]:
+    names = set()
+    for statement in statements:
+        while isinstance(statement, CountingLoopStatement):
+            statement = statement.original()
+        parts = [statement]
+        if isinstance(statement, FusedStatement):
+            parts = statement.parts()
+        elif isinstance(statement, InlinedCallStatement):
+            parts = statement.body()
+        for part in parts:
+            names |= _uses(part) | defined_names(part)
+        if isinstance(statement, ConstantLetsStatement):
+            names.update(statement.values())
+    return names
+
+
+def _types(statements: list[Statement]) -> list[dict[str, type] | None] | None:
+    """For each line, the variables sure to hold a value of a known type
+    whenever it runs, or None if it never runs; None altogether if a line
+    that might run could do anything"""
+    types: list[dict[str, type] | None] = [None] * len(statements)
+    if not statements:
+        return types
+    return_sites = _return_sites(statements)
+
+    types[0] = dict.fromkeys(_variable_names(statements), int)
+    pending = [0]
+    while pending:
+        index = pending.pop()
+        after = _types_after(statements[index], types[index])
+        successors = successor_lines(statements[index], index, return_sites)
+        if after is None or successors is None:
+            return None
+        for successor in successors:
+            if successor >= len(statements):
+                continue
+            before = types[successor]
+            if before is None:
+                types[successor] = after
+                pending.append(successor)
+                continue
+            joined = {
+                name: value_type
+                for name, value_type in before.items()
+                if after.get(name) is value_type
+            }
+            if len(joined) != len(before):
+                types[successor] = joined
+                pending.append(successor)
+    return types
+
+
+def _is_dead_store(
+    statement: Statement, live_after: set[str], types: dict[str, type] | None
+) -> bool:
+    if isinstance(statement, LetStatement):
+        return statement.var_name() not in live_after
+    return (
+        isinstance(statement, ArithmeticStatement)
+        and statement.var_name() not in live_after
+        and types is not None
+        and _cannot_fail(statement, types)
+    )
+
+
+def _eliminate(
+    statements: list[Statement],
+    live: list[set[str]],
+    types: list[dict[str, type] | None],
+    report: dict[str, int],
+) -> bool:
+    """Replaces the dead stores there are given what's live, returning
+    whether there were any"""
+    return_sites = _return_sites(statements)
+    nop = NopStatement()
+    changed = False
+    for index, statement in enumerate(statements):
+        if isinstance(statement, ConstantLetsStatement):
+            values = statement.values()
+            kept = {
+                name: value
+                for name, value in values.items()
+                if name in live[statement.exit()]
+            }
+            if len(kept) != len(values):
+                statements[index] = ConstantLetsStatement(
+                    statement.original(), kept, statement.exit()
+                )
+                report[DEAD_STORES] += len(values) - len(kept)
+                changed = True
+            continue
+
+        if isinstance(statement, FusedStatement):
+            # Once the first half is gone, the next line runs what's on it
+            # now in place of the second half
+            first, second = statement.parts()
+            live_after = live_before(second, index + 1, live, return_sites)
+            live_after |= live[index + 1]
+            statement = first
+        elif isinstance(statement, (LetStatement, ArithmeticStatement)):
+            live_after = set()
+            for line in successor_lines(statement, index, return_sites):
+                live_after |= live[line]
+        else:
+            continue
+        if _is_dead_store(statement, live_after, types[index]):
+            statements[index] = nop
+            report[DEAD_STORES] += 1
+            changed = True
+    return changed
+
+
+def eliminate_dead_stores(
+    statements: list[Statement],
+) -> tuple[list[Statement], dict[str, int]]:
+    """Returns the statements with every dead store removed, along with how
+    many there were"""
+    eliminated = list(statements)
+    report = {DEAD_STORES: 0}
+    types = _types(eliminated)
+    if types is None:
+        types = [None] * len(eliminated)
+
+    # Removing a store can leave the ones feeding it dead in turn
+    while True:
+        live = _liveness(eliminated)
+        if live is None or not _eliminate(eliminated, live, types, report):
+            return eliminated, report
+
+
+def unread_variables(statements: list[Statement]) -> list[str]:
+    """The names of the variables the statements change but never read, in
+    order.  A variable only read to change itself, as in ADD C 1, counts as
+    never read"""
+    read = set()
+    changed = set()
+    for statement in statements:
+        read |= _uses(statement) - defined_names(statement)
+        changed |= defined_names(statement)
+    return sorted(changed - read)
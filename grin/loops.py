@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+# A pass that finds counting loops and replaces them with a
+# CountingLoopStatement (see grin.statements), which works out how many times
+# the loop would go around and sets every variable to its final value at
+# once.  A loop qualifies when
+#
+# * it's a block of lines closed by a GOTO ... IF on its last line whose
+#   literal target is the block's first line,
+# * every other line is an ADD, SUB or MULT with an integer literal operand,
+# * the comparison tests a variable that the block only adds to or subtracts
+#   from, against an integer literal or a variable the block doesn't change.
+#
+# Only the loop's first line is replaced, so the other lines are still valid
+# entry points for jumps, and line indices don't change.
+
+from .statements import (
+    AddStatement,
+    CountingLoopStatement,
+    FusedStatement,
+    GoToStatement,
+    MultStatement,
+    Statement,
+    SubStatement,
+)
+from .token import GrinToken, GrinTokenKind
+
+CLOSED_FORM_LOOPS = 'closed-form loops'
+
+_FLIPPED_COMPARISONS = {
+    GrinTokenKind.EQUAL: GrinTokenKind.EQUAL,
+    GrinTokenKind.NOT_EQUAL: GrinTokenKind.NOT_EQUAL,
+    GrinTokenKind.LESS_THAN: GrinTokenKind.GREATER_THAN,
+    GrinTokenKind.LESS_THAN_OR_EQUAL: GrinTokenKind.GREATER_THAN_OR_EQUAL,
+    GrinTokenKind.GREATER_THAN: GrinTokenKind.LESS_THAN,
+    GrinTokenKind.GREATER_THAN_OR_EQUAL: GrinTokenKind.LESS_THAN_OR_EQUAL,
+}
+
+
+def _body_updates(body: list[Statement]) -> dict[str, tuple[int, int]] | None:
+    """Maps each variable the body changes to (a, b), such that one trip
+    through the body turns its value v into a * v + b, or None if the body
+    does anything else"""
+    updates: dict[str, tuple[int, int]] = {}
+    for statement in body:
+        # The second half of a superinstruction has its own line in the body
+        if isinstance(statement, FusedStatement):
+            statement = statement.parts()[0]
+        if not isinstance(statement, (AddStatement, SubStatement, MultStatement)):
+            return None
+        token = statement.value_token()
+        if token.kind() != GrinTokenKind.LITERAL_INTEGER:
+            return None
+
+        a, b = updates.get(statement.var_name(), (1, 0))
+        operand = token.value()
+        if isinstance(statement, AddStatement):
+            b += operand
+        elif isinstance(statement, SubStatement):
+            b -= operand
+        else:
+            a *= operand
+            b *= operand
+        updates[statement.var_name()] = (a, b)
+    return updates
+
+
+def _bound(token: GrinToken, updates: dict[str, tuple[int, int]]) -> int | str | None:
+    if token.kind() == GrinTokenKind.LITERAL_INTEGER:
+        return token.value()
+    if token.kind() == GrinTokenKind.IDENTIFIER and token.text() not in updates:
+        return token.text()
+    return None
+
+
+def _counting_loop(
+    statements: list[Statement], index: int
+) -> CountingLoopStatement | None:
+    """The CountingLoopStatement for a loop closed by the jump on line index,
+    if there is one"""
+    jump = statements[index]
+    if not isinstance(jump, GoToStatement) or jump.condition() is None:
+        return None
+    head = jump.static_destination()
+    if head is None or head >= index:
+        return None
+
+    updates = _body_updates(statements[head:index])
+    if updates is None:
+        return None
+
+    left, op_token, right = jump.condition()
+    comparison = op_token.kind()
+    if left.kind() != GrinTokenKind.IDENTIFIER or left.text() not in updates:
+        left, right = right, left
+        comparison = _FLIPPED_COMPARISONS[comparison]
+    if left.kind() != GrinTokenKind.IDENTIFIER or left.text() not in updates:
+        return None
+
+    counter = left.text()
+    bound = _bound(right, updates)
+    if updates[counter][0] != 1 or bound is None:
+        return None
+
+    return CountingLoopStatement(
+        statements[head], updates, counter, comparison, bound, index + 1
+    )
+
+
+def fold_counting_loops(
+    statements: list[Statement],
+) -> tuple[list[Statement], dict[str, int]]:
+    """Returns the statements with the first line of every counting loop
+    replaced by a CountingLoopStatement, along with how many were replaced"""
+    folded = list(statements)
+    report = {CLOSED_FORM_LOOPS: 0}
+    for index in range(len(statements)):
+        loop = _counting_loop(statements, index)
+        if loop is not None:
+            folded[statements[index].static_destination()] = loop
+            report[CLOSED_FORM_LOOPS] += 1
+    return folded, report
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+# Memoization of pure subroutines.  A subroutine is pure when every line a
+# call to it could run (following literal jumps, and the GOSUBs it makes in
+# turn) is free of PRINT, INNUM, INSTR, END and jumps on a variable, and
+# none of them runs off the end of the program.  What such a subroutine does
+# depends only on
+#
+# * the variables it might read before changing them, found by a liveness
+#   analysis over its lines that counts nothing as live once it returns, and
+# * the variables it might change but isn't sure to, found by a forward
+#   analysis of what's sure to be set by every RETURN, since those keep
+#   whatever values they had before the call,
+#
+# so a GOSUB with a literal target leading to one is given the subroutine's
+# SubroutineMemo (see grin.statements), shared by every call to it.  The
+# first call with a set of values for those variables runs the subroutine and
+# remembers what it left the variables it could change set to; later calls
+# with the same values just set them.  Calls that fail aren't remembered.
+
+from .liveness import defined_names, live_before, successor_lines
+from .statements import (
+    ConstantLetsStatement,
+    CountingLoopStatement,
+    EndStatement,
+    FusedStatement,
+    GoSubStatement,
+    InlinedCallStatement,
+    InnumStatement,
+    InstrStatement,
+    JumpStatement,
+    PrintStatement,
+    ReturnStatement,
+    Statement,
+    SubroutineMemo,
+)
+from .token import GrinTokenKind
+
+MEMOIZED_CALLS = 'memoized calls'
+
+_IMPURE = (PrintStatement, InnumStatement, InstrStatement, EndStatement)
+
+
+def _parts(statement: Statement) -> list[Statement]:
+    """The statements that running this one could run on its line"""
+    if isinstance(statement, (CountingLoopStatement, ConstantLetsStatement)):
+        return [statement.original()]
+    if isinstance(statement, FusedStatement):
+        return list(statement.parts())
+    if isinstance(statement, InlinedCallStatement):
+        return list(statement.body())
+    return [statement]
+
+
+def _is_pure(statement: Statement) -> bool:
+    """Whether the statement only changes variables and jumps to lines it
+    names itself.  A GOSUB only counts when it's on its own line, so that
+    whatever it calls is followed"""
+    parts = _parts(statement)
+    return not any(
+        isinstance(part, _IMPURE)
+        or (
+            isinstance(part, JumpStatement)
+            and part.target_token().kind() == GrinTokenKind.IDENTIFIER
+        )
+        or (isinstance(part, GoSubStatement) and part is not statement)
+        for part in parts
+    )
+
+
+def _writes(statement: Statement) -> set[str]:
+    writes = set().union(*map(defined_names, _parts(statement)))
+    if isinstance(statement, CountingLoopStatement):
+        writes.update(statement.updated_names())
+    elif isinstance(statement, ConstantLetsStatement):
+        writes.update(statement.values())
+    return writes
+
+
+def _sure_writes(statement: Statement) -> set[str]:
+    """The variables the statement is sure to set if it doesn't fail"""
+    if isinstance(statement, FusedStatement):
+        # The second half only runs if the first falls through
+        return defined_names(statement.parts()[0])
+    if isinstance(statement, CountingLoopStatement):
+        return defined_names(statement.original())
+    if isinstance(statement, ConstantLetsStatement):
+        return set(statement.values())
+    return set().union(*map(defined_names, _parts(statement)))
+
+
+def _region(
+    statements: list[Statement], start: int
+) -> tuple[list[int], list[int]] | None:
+    """The lines a call to the subroutine starting on line start could run,
+    and those its own calls return to, or None if it isn't pure"""
+    lines = set()
+    return_sites = set()
+    pending = [start]
+    while pending:
+        index = pending.pop()
+        if index in lines:
+            continue
+        if index >= len(statements) or not _is_pure(statements[index]):
+            return None
+        statement = statements[index]
+        successors = successor_lines(statement, index, [])
+        if successors is None:
+            return None
+        if isinstance(statement, GoSubStatement):
+            return_sites.add(index + 1)
+            successors = successors + [index + 1]
+        lines.add(index)
+        pending.extend(successors)
+    return sorted(lines), sorted(return_sites)
+
+
+def _live_at_start(
+    statements: list[Statement], start: int, lines: list[int], return_sites: list[int]
+) -> set[str]:
+    """The variables the subroutine might read before changing them"""
+    live: list[set[str]] = [set() for _ in range(len(statements) + 1)]
+    changed = True
+    while changed:
+        changed = False
+        for index in reversed(lines):
+            before = live_before(statements[index], index, live, return_sites)
+            if before != live[index]:
+                live[index] = before
+                changed = True
+    return live[start]
+
+
+def _set_by_every_return(
+    statements: list[Statement], start: int, lines: list[int], return_sites: list[int]
+) -> set[str] | None:
+    """The variables sure to have been set whenever the subroutine returns,
+    or None if it never does"""
+    sure: dict[int, frozenset[str]] = {start: frozenset()}
+    pending = [start]
+    while pending:
+        index = pending.pop()
+        statement = statements[index]
+        after = sure[index] | _sure_writes(statement)
+        for successor in successor_lines(statement, index, return_sites):
+            if successor == start:
+                continue
+            met = after if successor not in sure else sure[successor] & after
+            if met != sure.get(successor):
+                sure[successor] = met
+                pending.append(successor)
+
+    returns = [
+        sure[index]
+        for index in lines
+        if isinstance(statements[index], ReturnStatement) and index in sure
+    ]
+    if not returns:
+        return None
+    return set(frozenset.intersection(*returns))
+
+
+def _memo(statements: tuple[Statement, ...], start: int) -> SubroutineMemo | None:
+    """A memo for the subroutine starting on line start, or None if it can't
+    have one"""
+    region = _region(list(statements), start)
+    if region is None:
+        return None
+    lines, return_sites = region
+    set_on_return = _set_by_every_return(statements, start, lines, return_sites)
+    if set_on_return is None:
+        return None
+
+    writes = set().union(*(_writes(statements[index]) for index in lines))
+    reads = _live_at_start(statements, start, lines, return_sites)
+    inputs = reads | (writes - set_on_return)
+    return SubroutineMemo(statements, sorted(inputs), sorted(writes))
+
+
+def memoize_subroutines(
+    statements: list[Statement],
+) -> tuple[list[Statement], dict[str, int]]:
+    """Returns the statements with every GOSUB to a pure subroutine
+    memoized, along with how many were"""
+    program = tuple(statements)
+    report = {MEMOIZED_CALLS: 0}
+    memos: dict[int, SubroutineMemo | None] = {}
+    for statement in program:
+        if not isinstance(statement, GoSubStatement):
+            continue
+        start = statement.static_destination()
+        if start is None:
+            continue
+        if start not in memos:
+            memos[start] = _memo(program, start)
+        if memos[start] is not None:
+            statement.memoize(memos[start])
+            report[MEMOIZED_CALLS] += 1
+    return list(program), report
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+# A peephole pass that fuses common pairs of adjacent statements into
+# superinstructions (see FusedStatement in grin.statements):
+#
+# * ADD/SUB of a loop counter followed by the GOTO ... IF that tests it
+# * LET X ... followed by PRINT X
+#
+# Only the first line of a pair is replaced, so every line stays a valid
+# entry point for jumps, and line indices don't change.
+
+from .statements import (
+    AddStatement,
+    FusedStatement,
+    GoToStatement,
+    LetStatement,
+    PrintStatement,
+    Statement,
+    SubStatement,
+)
+from .token import GrinTokenKind
+
+COUNTER_THEN_BRANCH = 'ADD/SUB + GOTO IF'
+LET_THEN_PRINT = 'LET + PRINT'
+
+
+def _pattern(first: Statement, second: Statement) -> str | None:
+    """The name of the superinstruction these two statements form, if any"""
+    if (
+        isinstance(first, (AddStatement, SubStatement))
+        and isinstance(second, GoToStatement)
+        and second.condition() is not None
+    ):
+        counter = first.var_name()
+        if any(
+            token.kind() == GrinTokenKind.IDENTIFIER and token.text() == counter
+            for token in second.condition()
+        ):
+            return COUNTER_THEN_BRANCH
+
+    if isinstance(first, LetStatement) and isinstance(second, PrintStatement):
+        printed = second.value_token()
+        if (
+            printed.kind() == GrinTokenKind.IDENTIFIER
+            and printed.text() == first.var_name()
+        ):
+            return LET_THEN_PRINT
+
+    return None
+
+
+def fuse_superinstructions(
+    statements: list[Statement],
+) -> tuple[list[Statement], dict[str, int]]:
+    """Returns the statements with fusable pairs replaced by superinstructions,
+    along with how many of each kind of superinstruction were made"""
+    fused = list(statements)
+    report = {COUNTER_THEN_BRANCH: 0, LET_THEN_PRINT: 0}
+    index = 0
+    while index < len(statements) - 1:
+        pattern = _pattern(statements[index], statements[index + 1])
+        if pattern is None:
+            index += 1
+            continue
+        fused[index] = FusedStatement(statements[index], statements[index + 1], pattern)
+        report[pattern] += 1
+        # The second line keeps its plain statement and isn't fused again
+        index += 2
+    return fused, report
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+# Execution profiles that outlive a process.  run_profiled() runs a program on
+# the Statement interpreter while recording, for every line, how often it ran
+# and which operand types its arithmetic saw.  save_profile() writes that to a
+# small JSON file named after the program's hash, and load_profile() reads it
+# back so that a later process can compile the program with the profile (see
+# grin.execution.CompiledProgram) before running a single line.
+
+import json
+import os
+
+from .program_state import ProgramState
+from .statements import (
+    ArithmeticStatement,
+    FusedStatement,
+    Statement,
+    UnbuiltStatement,
+)
+from .token import GrinToken
+from .utility import program_hash
+
+# Part of every profile file; bump it whenever the format changes
+_FORMAT_VERSION = 2
+_PROFILE_SUFFIX = '.grinprof'
+
+_TYPES = {value_type.__name__: value_type for value_type in (int, float, str)}
+
+
+class Profile:
+    """
+    What running a program has shown about it, summed over every profiled run
+    - hits maps each line to how many times it ran
+    - operand_types maps each arithmetic line to how many times it saw each
+      (variable type, operand type) pair
+    """
+
+    def __init__(self):
+        self.hits: dict[int, int] = {}
+        self.operand_types: dict[int, dict[tuple[type, type], int]] = {}
+
+    def total_hits(self) -> int:
+        return sum(self.hits.values())
+
+    def hot_lines(self) -> list[int]:
+        """Every line that ran, most often run first"""
+        return sorted(self.hits, key=lambda index: (-self.hits[index], index))
+
+    def monomorphic_types(self, index: int) -> tuple[type, type] | None:
+        """The only operand types arithmetic line index has seen, if it's
+        only ever seen one pair"""
+        seen = self.operand_types.get(index, {})
+        return next(iter(seen)) if len(seen) == 1 else None
+
+    def to_json(self) -> dict:
+        return {
+            'version': _FORMAT_VERSION,
+            'hits': [[index, count] for index, count in self.hits.items()],
+            'operand_types': [
+                [index, left.__name__, right.__name__, count]
+                for index, seen in self.operand_types.items()
+                for (left, right), count in seen.items()
+            ],
+        }
+
+    @staticmethod
+    def from_json(data: dict) -> 'Profile':
+        if data['version'] != _FORMAT_VERSION:
+            raise ValueError(f'Unsupported Grin profile version: {data["version"]}')
+        profile = Profile()
+        for index, count in data['hits']:
+            profile.hits[index] = count
+        for index, left, right, count in data['operand_types']:
+            seen = profile.operand_types.setdefault(index, {})
+            seen[(_TYPES[left], _TYPES[right])] = count
+        return profile
+
+
+def _record(
+    statement: Statement, ip: int, state: ProgramState, profile: Profile
+) -> None:
+    """Records what the statement on line ip is about to do"""
+    profile.hits[ip] = profile.hits.get(ip, 0) + 1
+    if isinstance(statement, ArithmeticStatement):
+        types = (
+            type(state.vars.get(statement.var_name(), 0)),
+            type(statement.operand_value(state)),
+        )
+        seen = profile.operand_types.setdefault(ip, {})
+        seen[types] = seen.get(types, 0) + 1
+
+
+def run_profiled(
+    statements: tuple[Statement, ...], state: ProgramState, profile: Profile
+) -> None:
+    """Runs Statement objects from state.ip until the program ends, recording
+    what they do into profile"""
+    while 0 <= state.ip < len(statements):
+        ip = state.ip
+        statement = statements[ip]
+        if isinstance(statement, UnbuiltStatement):
+            statement = statement.build(ip)
+
+        if isinstance(statement, FusedStatement):
+            # Each half is recorded under its own line, as if it ran alone
+            first, second = statement.parts()
+            _record(first, ip, state, profile)
+            first.execute(state)
+            if state.ip == ip + 1:
+                _record(second, ip + 1, state, profile)
+                second.execute(state)
+        else:
+            _record(statement, ip, state, profile)
+            statement.execute(state)
+
+
+def _profile_path(profile_dir: str, token_lines: list[list[GrinToken]]) -> str:
+    return os.path.join(profile_dir, program_hash(token_lines) + _PROFILE_SUFFIX)
+
+
+def load_profile(
+    profile_dir: str, token_lines: list[list[GrinToken]]
+) -> Profile | None:
+    """The profile saved in profile_dir for this program, if there is one"""
+    try:
+        with open(_profile_path(profile_dir, token_lines)) as profile_file:
+            return Profile.from_json(json.load(profile_file))
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_profile(
+    profile: Profile, profile_dir: str, token_lines: list[list[GrinToken]]
+) -> None:
+    """Writes profile to profile_dir, replacing any profile saved there for
+    this program"""
+    os.makedirs(profile_dir, exist_ok=True)
+    path = _profile_path(profile_dir, token_lines)
+    # Write then rename, so a concurrent reader never sees half a file
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'w') as profile_file:
+        json.dump(profile.to_json(), profile_file, separators=(',', ':'))
+    os.replace(temporary, path)
@@ -14,6 +14,8 @@ class ProgramState:
     - return_stack is list designed like a stack to keep track of return values
     - output stores list of values being printed
     - input_func enables the ability to test INNUM and INSTR
+    - memo_depth counts the memoized calls running inside each other (see
+      grin.memoization)
     """
 
     def __init__(
@@ -30,3 +32,4 @@ class ProgramState:
         self.output = []
         self.input_func = input_func
         self.output_func = output_func
+        self.memo_depth = 0
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# Slot-indexed variable storage.  assign_slots() gives every variable named in
+# a program a fixed index when the program is built, so engines can keep
+# variables in a preallocated list instead of hashing a name on every access.
+
+from collections.abc import Iterator, Mapping, MutableMapping
+from typing import Any, Callable
+
+from .program_state import ProgramState
+from .token import GrinToken, GrinTokenKind
+from .utility import get_starter_index
+
+
+def assign_slots(token_lines: list[list[GrinToken]]) -> dict[str, int]:
+    """Maps every variable named in the program to its slot index, in the
+    order the variables first appear"""
+    slot_table: dict[str, int] = {}
+    for tokens in token_lines:
+        # Labels name lines, not variables
+        for token in tokens[get_starter_index(tokens) :]:
+            if token.kind() == GrinTokenKind.IDENTIFIER:
+                slot_table.setdefault(token.text(), len(slot_table))
+    return slot_table
+
+
+class SlotVariables(MutableMapping):
+    """
+    A dict-like view of a SlotProgramState's variables, for tests and
+    debugging.  Every variable in the slot table is always present, since
+    slots start out as 0 (the value of a variable that was never set);
+    names outside the table are kept in a separate dict.
+    """
+
+    def __init__(self, slot_table: Mapping[str, int], slots: list):
+        self._slot_table = slot_table
+        self._slots = slots
+        self._others: dict[str, Any] = {}
+
+    def __getitem__(self, name: str) -> Any:
+        if name in self._slot_table:
+            return self._slots[self._slot_table[name]]
+        return self._others[name]
+
+    def __setitem__(self, name: str, value: Any) -> None:
+        if name in self._slot_table:
+            self._slots[self._slot_table[name]] = value
+        else:
+            self._others[name] = value
+
+    def __delitem__(self, name: str) -> None:
+        if name in self._slot_table:
+            self._slots[self._slot_table[name]] = 0
+        else:
+            del self._others[name]
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._slot_table
+        yield from self._others
+
+    def __len__(self) -> int:
+        return len(self._slot_table) + len(self._others)
+
+    def __repr__(self) -> str:
+        return f'SlotVariables({dict(self)!r})'
+
+
+class SlotProgramState(ProgramState):
+    """
+    A ProgramState whose variables live in a preallocated list
+    - slot_table maps each variable name to its index in slots
+    - slots holds every variable's value, starting out as 0
+    - vars is a SlotVariables view of slots; assigning a mapping to it
+      copies that mapping's values into the slots
+    """
+
+    def __init__(
+        self,
+        token_lines: list[list[GrinToken]],
+        slot_table: Mapping[str, int],
+        input_func: Callable = input,
+        output_func: Callable | None = None,
+    ):
+        self.slot_table = slot_table
+        self.slots = [0] * len(slot_table)
+        self._vars = SlotVariables(slot_table, self.slots)
+        super().__init__(token_lines, input_func, output_func)
+
+    @property
+    def vars(self) -> SlotVariables:
+        return self._vars
+
+    @vars.setter
+    def vars(self, values: Mapping[str, Any]) -> None:
+        self.slots[:] = [0] * len(self.slot_table)
+        self._vars = SlotVariables(self.slot_table, self.slots)
+        self._vars.update(values)
@@ -1,12 +1,25 @@
 #!/usr/bin/env python3
 
-from .token import GrinToken
+import operator
+import threading
+from collections import OrderedDict
+from typing import Any, Callable
+
+from .token import GrinToken, GrinTokenKind
 from .program_state import ProgramState
 from .utility import (
+    COMPARISON_TABLE,
     GrinRuntimeError,
+    add_values,
     compare_values,
-    value_from_token,
+    div_values,
+    jump_destination,
+    mult_values,
+    number_from_input,
     resolve_jump_target,
+    sub_values,
+    truncating_div,
+    value_from_token,
 )
 
 
@@ -22,6 +35,15 @@ class LetStatement(Statement):
         self._var_token = var_token
         self._value_token = value_token
 
+    def var_token(self) -> GrinToken:
+        return self._var_token
+
+    def var_name(self) -> str:
+        return self._var_token.text()
+
+    def value_token(self) -> GrinToken:
+        return self._value_token
+
     def execute(self, state: ProgramState) -> None:
         state.vars[self._var_token.text()] = value_from_token(state, self._value_token)
         state.ip += 1
@@ -31,6 +53,9 @@ class PrintStatement(Statement):
     def __init__(self, value_token: GrinToken):
         self._value_token = value_token
 
+    def value_token(self) -> GrinToken:
+        return self._value_token
+
     def execute(self, state: ProgramState) -> None:
         value = value_from_token(state, self._value_token)
         text = str(value)
@@ -53,14 +78,48 @@ class VariableUpdateStatement(Statement):
         self._var_token = var_token
         self._value_token = value_token
 
+    def var_token(self) -> GrinToken:
+        return self._var_token
+
     def var_name(self) -> str:
         return self._var_token.text()
 
+    def value_token(self) -> GrinToken:
+        return self._value_token
+
     def operand_value(self, state):
         return value_from_token(state, self._value_token)
 
 
+# How many times a quickened arithmetic statement's guard may fail before it
+# gives up on specializing and stays generic
+QUICKEN_LIMIT = 3
+
+
 class ArithmeticStatement(VariableUpdateStatement):
+    """
+    Arithmetic statements quicken themselves: after running once, a statement
+    looks up a fast operation for the operand types it saw in its subclass's
+    SPECIALIZED table and, if there is one, replaces its own execute() with a
+    version that only checks those types before using it.  When a guard fails
+    the statement falls back to the generic path and may quicken again later.
+    """
+
+    # Maps (left type, right type) to a function applying the operation to
+    # values of exactly those types
+    SPECIALIZED: dict[tuple[type, type], Callable[[Any, Any], Any]] = {}
+
+    def __init__(self, var_token: GrinToken, value_token: GrinToken):
+        super().__init__(var_token, value_token)
+        self._name = var_token.text()
+        self._literal = value_token.kind() != GrinTokenKind.IDENTIFIER
+        self._operand = value_token.value() if self._literal else value_token.text()
+        # (left type, right type, fast operation) while quickened, set and
+        # read as one so that threads running the program at once always see
+        # a whole specialization or none
+        self._quickened = None
+        self._guard_failures = 0
+
     def execute(self, state):
         name = self.var_name()
         left = state.vars.get(name, 0)
@@ -70,64 +129,112 @@ class ArithmeticStatement(VariableUpdateStatement):
         state.vars[name] = result
         state.ip += 1
 
+        if self._guard_failures < QUICKEN_LIMIT:
+            self._quicken(type(left), type(right))
+
+    def _quicken(self, left_type: type, right_type: type) -> None:
+        fast = self.SPECIALIZED.get((left_type, right_type))
+        if fast is not None:
+            self._quickened = (left_type, right_type, fast)
+            self.execute = self._execute_quickened
+
+    def _execute_quickened(self, state):
+        quickened = self._quickened
+        if quickened is None:
+            # Unquickened by another thread since execute() was looked up
+            type(self).execute(self, state)
+            return
+
+        vars = state.vars
+        name = self._name
+        left = vars.get(name, 0)
+        right = self._operand if self._literal else vars.get(self._operand, 0)
+        left_type, right_type, fast = quickened
+
+        if type(left) is left_type and type(right) is right_type:
+            vars[name] = fast(left, right)
+            state.ip += 1
+        else:
+            self.unquicken()
+            self._guard_failures += 1
+            type(self).execute(self, state)
+
+    def specialize(self, left_type: type, right_type: type) -> bool:
+        """Quickens ahead of time for the given operand types, as if they'd
+        just been seen, returning whether there's a fast operation for them"""
+        self._quicken(left_type, right_type)
+        return self.specialization() == (left_type, right_type)
+
+    def unquicken(self) -> None:
+        """Drops any specialization, going back to the generic execute()"""
+        self.__dict__.pop('execute', None)
+        self._quickened = None
+
+    def specialization(self) -> tuple[type, type] | None:
+        """The operand types this statement is currently specialized for"""
+        quickened = self._quickened
+        return None if quickened is None else quickened[:2]
+
     def apply(self, left, right):
         raise NotImplementedError
 
 
-class AddStatement(ArithmeticStatement):
-    def apply(self, left, right):
-        if isinstance(left, str) and isinstance(right, str):
-            return left + right
-        if isinstance(left, (int, float)) and isinstance(right, (int, float)):
-            return left + right
-        raise GrinRuntimeError('Invalid types for ADD')
+def _divide_ints(left: int, right: int) -> int:
+    if right == 0:
+        raise GrinRuntimeError('Runtime error: division by zero')
+    return truncating_div(left, right)
 
 
-class SubStatement(ArithmeticStatement):
+def _divide_floats(left: float, right: float) -> float:
+    if right == 0.0:
+        raise GrinRuntimeError('Runtime error: division by zero')
+    return left / right
+
+
+class AddStatement(ArithmeticStatement):
+    SPECIALIZED = {
+        (int, int): operator.add,
+        (float, float): operator.add,
+        (str, str): operator.add,
+    }
+
     def apply(self, left, right):
-        # numeric - numeric only
-        if isinstance(left, (int, float)) and isinstance(right, (int, float)):
-            return left - right
+        return add_values(left, right)
 
-        raise GrinRuntimeError('Runtime error: invalid types for SUB')
 
+class SubStatement(ArithmeticStatement):
+    SPECIALIZED = {
+        (int, int): operator.sub,
+        (float, float): operator.sub,
+    }
 
-class MultStatement(ArithmeticStatement):
     def apply(self, left, right):
-        # numeric * numeric
-        if isinstance(left, (int, float)) and isinstance(right, (int, float)):
-            return left * right
+        return sub_values(left, right)
 
-        # string * int
-        if isinstance(left, str) and isinstance(right, int):
-            if right < 0:
-                raise GrinRuntimeError('Runtime error: negative string multiplication')
-            return left * right
 
-        # int * string
-        if isinstance(left, int) and isinstance(right, str):
-            if left < 0:
-                raise GrinRuntimeError('Runtime error: negative string multiplication')
-            return right * left
+class MultStatement(ArithmeticStatement):
+    SPECIALIZED = {
+        (int, int): operator.mul,
+        (float, float): operator.mul,
+    }
 
-        raise GrinRuntimeError('Runtime error: invalid types for MULT')
+    def apply(self, left, right):
+        return mult_values(left, right)
 
 
 class DivStatement(ArithmeticStatement):
-    def apply(self, left, right):
-        # numeric / numeric only
-        if not (isinstance(left, (int, float)) and isinstance(right, (int, float))):
-            raise GrinRuntimeError('Runtime error: invalid types for DIV')
+    SPECIALIZED = {
+        (int, int): _divide_ints,
+        (float, float): _divide_floats,
+    }
 
-        if right == 0 or right == 0.0:
-            raise GrinRuntimeError('Runtime error: division by zero')
+    def apply(self, left, right):
+        return div_values(left, right)
 
-        # int / int -> int (truncate toward 0)
-        if isinstance(left, int) and isinstance(right, int):
-            return int(left / right)
 
-        # otherwise float division
-        return left / right
+# How many (target value -> destination) pairs a jump with an identifier
+# target remembers before it forgets the oldest one
+INLINE_CACHE_SIZE = 4
 
 
 class JumpStatement(Statement):
@@ -137,6 +244,62 @@ class JumpStatement(Statement):
         self._target_token = target_token
         # Optional conditional
         self._condition = condition
+        # When both sides of the condition are literals, their types are known
+        # now, so the comparison function is looked up once
+        self._comparison = None
+        if condition is not None:
+            left_token, comp_op_token, right_token = condition
+            if (
+                left_token.kind() != GrinTokenKind.IDENTIFIER
+                and right_token.kind() != GrinTokenKind.IDENTIFIER
+            ):
+                self._comparison = COMPARISON_TABLE.get(
+                    (
+                        type(left_token.value()),
+                        comp_op_token.kind(),
+                        type(right_token.value()),
+                    )
+                )
+        # Set by resolve_static() when the target is a literal
+        self._static_destination = None
+        self._static_error = None
+        # Set by resolve_static() when the target is an identifier; maps the
+        # (type, value) of the target variable to the destination it resolved to
+        self._inline_cache = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def resolve_static(
+        self, index: int, goto_labels: dict[str, int], line_count: int
+    ) -> None:
+        """Resolve a literal target once, given this statement's line index.
+        An invalid target is remembered and only raised if the jump is taken.
+        An identifier target instead gets an inline cache, which is only valid
+        because this statement's index and the program's labels are now fixed"""
+        if self._target_token.kind() == GrinTokenKind.IDENTIFIER:
+            self._inline_cache = {}
+            return
+        try:
+            self._static_destination = jump_destination(
+                index, self._target_token.value(), goto_labels, line_count
+            )
+        except GrinRuntimeError as error:
+            self._static_error = str(error)
+
+    def target_token(self) -> GrinToken:
+        return self._target_token
+
+    def static_destination(self) -> int | None:
+        """The destination resolve_static() found for a literal target"""
+        return self._static_destination
+
+    def thread_to(self, destination: int) -> None:
+        """Points a literal jump straight at destination, which must be where
+        taking it would have led anyway, through lines that do nothing else"""
+        self._static_destination = destination
+
+    def condition(self) -> tuple[GrinToken, GrinToken, GrinToken] | None:
+        return self._condition
 
     def should_jump(self, state: ProgramState) -> bool:
         """Resolve optional conditional clause if it exists"""
@@ -146,10 +309,37 @@ class JumpStatement(Statement):
         left_token, comp_op_token, right_token = self._condition
         left_val = value_from_token(state, left_token)
         right_val = value_from_token(state, right_token)
+        if self._comparison is not None:
+            return self._comparison(left_val, right_val)
         return compare_values(left_val, comp_op_token.kind(), right_val)
 
     def destination(self, state) -> int:
-        return resolve_jump_target(state, self._target_token)
+        if self._static_destination is not None:
+            return self._static_destination
+        if self._static_error is not None:
+            raise GrinRuntimeError(self._static_error)
+        if self._inline_cache is None:
+            return resolve_jump_target(state, self._target_token)
+
+        target = state.vars.get(self._target_token.text(), 0)
+        # 1 and 1.0 are equal but only one of them is a valid target
+        key = (type(target), target)
+        destination = self._inline_cache.get(key)
+        if destination is not None:
+            self.cache_hits += 1
+            return destination
+
+        self.cache_misses += 1
+        destination = resolve_jump_target(state, self._target_token)
+        cache = self._inline_cache
+        if len(cache) >= INLINE_CACHE_SIZE:
+            try:
+                del cache[next(iter(cache))]
+            except (KeyError, RuntimeError):
+                # A run in another thread changed the cache first
+                pass
+        cache[key] = destination
+        return destination
 
 
 class GoToStatement(JumpStatement):
@@ -162,17 +352,356 @@ class GoToStatement(JumpStatement):
             state.ip += 1
 
 
+# How many calls a memoized subroutine remembers before it forgets the least
+# recently used one
+MEMO_CACHE_SIZE = 256
+
+# How many memoized calls can be running inside each other before any more
+# are just called, since each one runs its subroutine in a loop of its own
+MAX_MEMO_DEPTH = 64
+
+# Stands in for a variable that hasn't been set in a memo key
+_UNSET = object()
+
+
+class SubroutineMemo:
+    """
+    What a pure subroutine (see grin.memoization) leaves its variables set to,
+    for each set of values of the variables that decide what it does.
+    - statements are the program's, which run the subroutine when a call
+      isn't remembered
+    - inputs names the variables that decide what the subroutine does
+    - outputs names every variable the subroutine could change
+    """
+
+    def __init__(
+        self,
+        statements: tuple[Statement, ...],
+        inputs: list[str],
+        outputs: list[str],
+    ):
+        self._statements = statements
+        self._inputs = tuple(inputs)
+        self._outputs = tuple(outputs)
+        self._calls: OrderedDict[tuple, dict[str, Any]] = OrderedDict()
+        # Every run of the program shares the memo, from any thread
+        self._lock = threading.Lock()
+
+    def statements(self) -> tuple[Statement, ...]:
+        return self._statements
+
+    def inputs(self) -> tuple[str, ...]:
+        return self._inputs
+
+    def outputs(self) -> tuple[str, ...]:
+        return self._outputs
+
+    def key(self, vars: dict[str, Any]) -> tuple:
+        """The key of a call made with these variables"""
+        key = []
+        for name in self._inputs:
+            value = vars.get(name, _UNSET)
+            # 1 and 1.0 are equal but print differently, as do 0.0 and -0.0
+            key.append(type(value))
+            key.append(repr(value) if type(value) is float else value)
+        return tuple(key)
+
+    def lookup(self, key: tuple) -> dict[str, Any] | None:
+        """The variables a remembered call set, or None if it isn't"""
+        with self._lock:
+            outputs = self._calls.get(key)
+            if outputs is not None:
+                self._calls.move_to_end(key)
+            return outputs
+
+    def remember(self, key: tuple, vars: dict[str, Any]) -> None:
+        """Remembers the variables a call just set"""
+        outputs = {name: vars[name] for name in self._outputs if name in vars}
+        with self._lock:
+            self._calls[key] = outputs
+            self._calls.move_to_end(key)
+            if len(self._calls) > MEMO_CACHE_SIZE:
+                self._calls.popitem(last=False)
+
+
 class GoSubStatement(JumpStatement):
     """GoSub Execution Implementation"""
 
+    def __init__(self, target_token: GrinToken, condition=None):
+        super().__init__(target_token, condition)
+        # Set by memoize()
+        self._memo = None
+        self.memo_hits = 0
+        self.memo_misses = 0
+
+    def memoize(self, memo: SubroutineMemo) -> None:
+        """Looks each call up in memo, which must be for the subroutine this
+        GOSUB's literal target leads to, before running the subroutine"""
+        self._memo = memo
+
+    def memo(self) -> SubroutineMemo | None:
+        return self._memo
+
     def execute(self, state: ProgramState) -> None:
         if self.should_jump(state):
             destination = self.destination(state)
+            if self._memo is not None and state.memo_depth < MAX_MEMO_DEPTH:
+                self._call_memoized(state, destination)
+                return
             state.return_stack.append(state.ip + 1)
             state.ip = destination
         else:
             state.ip += 1
 
+    def _call_memoized(self, state: ProgramState, destination: int) -> None:
+        memo = self._memo
+        key = memo.key(state.vars)
+        outputs = memo.lookup(key)
+        if outputs is not None:
+            self.memo_hits += 1
+            state.vars.update(outputs)
+            state.ip += 1
+            return
+
+        # Run the subroutine until it returns here, so what it set can be
+        # remembered
+        self.memo_misses += 1
+        statements = memo.statements()
+        depth = len(state.return_stack)
+        state.return_stack.append(state.ip + 1)
+        state.ip = destination
+        state.memo_depth += 1
+        try:
+            while len(state.return_stack) > depth:
+                statements[state.ip].execute(state)
+        finally:
+            state.memo_depth -= 1
+        memo.remember(key, state.vars)
+
+
+class TailCallStatement(GoToStatement):
+    """A GOSUB whose next line is a RETURN (see grin.utility.is_tail_call),
+    run as the GOTO it amounts to, so that recursing through it doesn't grow
+    the return stack"""
+
+    pass
+
+
+class FusedStatement(Statement):
+    """A superinstruction: runs the statement on its own line and then, if
+    that fell through, the statement on the next line, saving a trip around
+    the main loop.  The next line keeps its own statement, so jumping straight
+    to it still works"""
+
+    def __init__(self, first: Statement, second: Statement, pattern: str):
+        self._first = first
+        self._second = second
+        self._pattern = pattern
+
+    def pattern(self) -> str:
+        return self._pattern
+
+    def parts(self) -> tuple[Statement, Statement]:
+        return self._first, self._second
+
+    def execute(self, state: ProgramState) -> None:
+        ip = state.ip
+        self._first.execute(state)
+        if state.ip == ip + 1:
+            self._second.execute(state)
+
+
+class InlinedCallStatement(Statement):
+    """
+    Runs a short subroutine's statements in place of the GOSUB that calls it,
+    then carries on at the next line, just as if the subroutine had been
+    called and had returned.
+    - original is the GOSUB, whose subroutine keeps its lines for any other
+      callers
+    - body holds copies of the subroutine's statements, none of which jump,
+      up to but not including its RETURN
+    """
+
+    def __init__(self, original: Statement, body: tuple[Statement, ...]):
+        self._original = original
+        self._body = body
+
+    def original(self) -> Statement:
+        return self._original
+
+    def body(self) -> tuple[Statement, ...]:
+        return self._body
+
+    def execute(self, state: ProgramState) -> None:
+        ip = state.ip
+        for statement in self._body:
+            statement.execute(state)
+        state.ip = ip + 1
+
+
+def _iteration_count(
+    start: int, step: int, op_kind: GrinTokenKind, bound: int
+) -> int | None:
+    """How many times a loop body adding step to a counter runs before
+    "counter op_kind bound" is false, testing only after each run of the
+    body, or None if the test never becomes false"""
+    if not COMPARISON_TABLE[(int, op_kind, int)](start + step, bound):
+        return 1
+    if op_kind == GrinTokenKind.LESS_THAN and step > 0:
+        return -((start - bound) // step)
+    if op_kind == GrinTokenKind.LESS_THAN_OR_EQUAL and step > 0:
+        return (bound - start) // step + 1
+    if op_kind == GrinTokenKind.GREATER_THAN and step < 0:
+        return -((bound - start) // -step)
+    if op_kind == GrinTokenKind.GREATER_THAN_OR_EQUAL and step < 0:
+        return (start - bound) // -step + 1
+    if op_kind == GrinTokenKind.NOT_EQUAL and step != 0:
+        count, remainder = divmod(bound - start, step)
+        return count if remainder == 0 and count > 1 else None
+    if op_kind == GrinTokenKind.EQUAL and step != 0:
+        return 2
+    return None
+
+
+class CountingLoopStatement(Statement):
+    """
+    Runs a whole counting loop at once: a block of ADD/SUB/MULT statements
+    with integer literal operands, closed by a GOTO ... IF back to its first
+    line that compares the loop's counter against a bound.
+    - original is the statement on the loop's first line, which still runs
+      (one line at a time) whenever the variables aren't all integers or the
+      loop would never end
+    - updates maps each variable the body changes to (a, b), meaning that one
+      trip through the body turns its value v into a * v + b
+    - counter is the compared variable, which the body only adds to
+    - comparison is the operator, as if the counter were on its left
+    - bound is the other side of the comparison: an int literal, or the name
+      of a variable the body doesn't change
+    - exit_index is the line after the loop
+    """
+
+    def __init__(
+        self,
+        original: Statement,
+        updates: dict[str, tuple[int, int]],
+        counter: str,
+        comparison: GrinTokenKind,
+        bound: int | str,
+        exit_index: int,
+    ):
+        self._original = original
+        self._updates = updates
+        self._counter = counter
+        self._comparison = comparison
+        self._bound = bound
+        self._exit = exit_index
+
+    def original(self) -> Statement:
+        return self._original
+
+    def updated_names(self) -> list[str]:
+        return list(self._updates)
+
+    def bound(self) -> int | str:
+        return self._bound
+
+    def exit(self) -> int:
+        return self._exit
+
+    def execute(self, state: ProgramState) -> None:
+        vars = state.vars
+        values = {name: vars.get(name, 0) for name in self._updates}
+        bound = self._bound
+        if isinstance(bound, str):
+            bound = vars.get(bound, 0)
+
+        count = None
+        if type(bound) is int and all(type(value) is int for value in values.values()):
+            count = _iteration_count(
+                values[self._counter],
+                self._updates[self._counter][1],
+                self._comparison,
+                bound,
+            )
+        if count is None:
+            self._original.execute(state)
+            return
+
+        for name, (a, b) in self._updates.items():
+            if a == 1:
+                vars[name] = values[name] + count * b
+            else:
+                # The geometric series b * (1 + a + ... + a ** (count - 1))
+                power = a**count
+                vars[name] = power * values[name] + b * (power - 1) // (a - 1)
+        state.ip = self._exit
+
+
+class ConstantLetsStatement(Statement):
+    """
+    Runs a stretch of lines that each LET a variable to a literal at once,
+    setting each variable to the last value the stretch gives it.
+    - original is the statement on the stretch's first line, which still
+      runs on its own whenever one line at a time is needed
+    - values maps each variable to its value at the end of the stretch
+    - exit_index is the line after the stretch
+    """
+
+    def __init__(self, original: Statement, values: dict[str, Any], exit_index: int):
+        self._original = original
+        self._values = values
+        self._exit = exit_index
+
+    def original(self) -> Statement:
+        return self._original
+
+    def values(self) -> dict[str, Any]:
+        return dict(self._values)
+
+    def exit(self) -> int:
+        return self._exit
+
+    def execute(self, state: ProgramState) -> None:
+        state.vars.update(self._values)
+        state.ip = self._exit
+
+
+class NopStatement(Statement):
+    """Stands in for a line that does nothing, such as a GOTO whose condition
+    is always false"""
+
+    def execute(self, state: ProgramState) -> None:
+        state.ip += 1
+
+
+class UnreachableStatement(Statement):
+    """Stands in for a line that no path through the program can reach, so
+    that the lines after it keep their indices"""
+
+    def execute(self, state: ProgramState) -> None:
+        raise RuntimeError(f'Line {state.ip + 1} was found unreachable but ran')
+
+
+class UnbuiltStatement(Statement):
+    """Stands in for every line of a program whose statements are built
+    lazily.  The first time one of its lines runs, it builds the line's
+    statement with build(index), puts that in the line's place in statements
+    and runs it, so each line is only built once.  Anything that needs to
+    look at a line's statement before running it can build it first"""
+
+    def __init__(self, statements: list[Statement], build: Callable[[int], Statement]):
+        self._statements = statements
+        self._build = build
+
+    def build(self, index: int) -> Statement:
+        """Builds line index's statement in this one's place"""
+        statement = self._build(index)
+        self._statements[index] = statement
+        return statement
+
+    def execute(self, state: ProgramState) -> None:
+        self.build(state.ip).execute(state)
+
 
 class ReturnStatement(Statement):
     def execute(self, state) -> None:
@@ -185,6 +714,9 @@ class InstrStatement(Statement):
     def __init__(self, var_token: GrinToken):
         self._var_token = var_token
 
+    def var_name(self) -> str:
+        return self._var_token.text()
+
     def execute(self, state: ProgramState) -> None:
         line = state.input_func()
         state.vars[self._var_token.text()] = line
@@ -195,19 +727,10 @@ class InnumStatement(Statement):
     def __init__(self, var_token: GrinToken):
         self._var_token = var_token
 
+    def var_name(self) -> str:
+        return self._var_token.text()
+
     def execute(self, state: ProgramState) -> None:
         line = state.input_func()
-
-        if not line:
-            raise GrinRuntimeError('Runtime error: INNUM empty')
-
-        try:
-            if '.' not in line:
-                val = int(line)
-            else:
-                val = float(line)
-        except ValueError:
-            raise GrinRuntimeError('Runtime error: INNUM not a number')
-        else:
-            state.vars[self._var_token.text()] = val
-            state.ip += 1
+        state.vars[self._var_token.text()] = number_from_input(line)
+        state.ip += 1
@@ -1,8 +1,14 @@
 #!/usr/bin/env python3
 
+import functools
+import unittest
+from types import ModuleType
+from typing import Callable
+from unittest import mock
+from . import execution
 from .program_state import ProgramState
 from .parsing import parse
-from .execution import _build_goto_labels
+from .execution import _build_goto_labels, execute as _execute
 
 
 def make_state(lines: list[str], ip: int = 0) -> ProgramState:
@@ -16,3 +22,62 @@ def make_state(lines: list[str], ip: int = 0) -> ProgramState:
     state.goto_labels = _build_goto_labels(token_lines)
     state.ip = ip
     return state
+
+
+def with_engine(
+    case: type[unittest.TestCase], engine: str, **options
+) -> type[unittest.TestCase]:
+    """
+    Returns a subclass of an execution test case whose tests run every
+    grin.execution.execute() call on the given engine instead of the default,
+    passing along any other execute() options given.
+    Used by tests that check an engine against the existing execution tests
+    """
+
+    class EngineCase(case):
+        def setUp(self):
+            super().setUp()
+            patcher = mock.patch.object(
+                execution,
+                'execute',
+                functools.partial(_execute, engine=engine, **options),
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    EngineCase.__name__ = EngineCase.__qualname__ = f'{case.__name__}_{engine}'
+    return EngineCase
+
+
+def rerun_cases(
+    namespace: dict[str, object],
+    module: ModuleType,
+    suffix: str,
+    wrap: Callable[[type[unittest.TestCase]], type[unittest.TestCase]],
+) -> None:
+    """
+    Adds to namespace, for every test case in the given module, the case
+    wrap() returns for it, named after the original with suffix appended.
+    Used by tests that run an existing module's tests again another way
+    """
+    for name, case in list(vars(module).items()):
+        if isinstance(case, type) and issubclass(case, unittest.TestCase):
+            namespace[f'{name}{suffix}'] = wrap(case)
+
+
+def rerun_with_engine(
+    namespace: dict[str, object],
+    module: ModuleType,
+    suffix: str,
+    engine: str,
+    **options,
+) -> None:
+    """
+    Adds to namespace a copy of every test case in the given module that runs
+    on the given engine with any other execute() options given (see
+    with_engine()), named after the original with suffix appended.
+    Used by tests that check an engine against the existing execution tests
+    """
+    rerun_cases(
+        namespace, module, suffix, lambda case: with_engine(case, engine, **options)
+    )
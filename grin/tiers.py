@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+# Tiered execution.  Every program starts out on the Statement interpreter,
+# which costs nothing to set up, while counting the lines it runs and the
+# jumps it takes backward.  Once either count shows the program is hot, the
+# program is promoted: its closures (see grin.closures) are built and the run
+# carries on with them from the same ip, variables and return stack.  The
+# counts are kept across runs, so once a program has been promoted every later
+# run starts straight away on the closures.
+#
+# Arithmetic lines that the interpreter has quickened are built as speculative
+# closures for the same operand types.  When one of their guards fails, the
+# run deoptimizes: it goes back to the interpreter at that line, the line is
+# never speculated on again, and the closures are rebuilt for the next run.
+
+from typing import Mapping
+
+from .closures import build_closures, run_closures
+from .deopt import Deoptimization, DeoptStats, from_program_state, to_program_state
+from .program_state import ProgramState
+from .slots import assign_slots
+from .statements import ArithmeticStatement, FusedStatement, Statement
+from .token import GrinToken
+
+# Lines the interpreter runs, over every run of a program, before promoting it
+PROMOTION_INSTRUCTIONS = 2000
+
+# Backward jumps the interpreter takes, over every run of a program, before
+# promoting it
+PROMOTION_BACKWARD_JUMPS = 100
+
+
+class TieredRunner:
+    """
+    Runs a program on the Statement interpreter until it proves hot, then on
+    closures.  promotion_instructions and promotion_backward_jumps default to
+    the module's PROMOTION_INSTRUCTIONS and PROMOTION_BACKWARD_JUMPS and can be
+    changed between runs.
+    - instructions and backward_jumps count what the interpreter has run
+    - promotions counts the runs that switched to closures partway through
+    - deopts counts the runs that went back to the interpreter, by reason
+    tail_calls must match how the statements were built, so that the return
+    stack looks the same on either tier
+    """
+
+    def __init__(
+        self,
+        token_lines: tuple[list[GrinToken], ...],
+        goto_labels: Mapping[str, int],
+        statements: tuple[Statement, ...],
+        promotion_instructions: int | None = None,
+        promotion_backward_jumps: int | None = None,
+        tail_calls: bool = True,
+    ):
+        self._token_lines = token_lines
+        self._goto_labels = goto_labels
+        self._statements = statements
+        self._tail_calls = tail_calls
+        self.promotion_instructions = (
+            PROMOTION_INSTRUCTIONS
+            if promotion_instructions is None
+            else promotion_instructions
+        )
+        self.promotion_backward_jumps = (
+            PROMOTION_BACKWARD_JUMPS
+            if promotion_backward_jumps is None
+            else promotion_backward_jumps
+        )
+        self.instructions = 0
+        self.backward_jumps = 0
+        self.promotions = 0
+        self.deopts = DeoptStats()
+        self._slot_table = assign_slots(token_lines)
+        self._unspeculated: set[int] = set()
+        self._closures = None
+
+    def promoted(self) -> bool:
+        """Whether the program has proved hot and has its closures built"""
+        return self._closures is not None
+
+    def _is_hot(self) -> bool:
+        return (
+            self.instructions >= self.promotion_instructions
+            or self.backward_jumps >= self.promotion_backward_jumps
+        )
+
+    def speculation(self) -> dict[int, tuple[type, type]]:
+        """Maps each arithmetic line to speculate on to the operand types
+        the interpreter has quickened it for"""
+        speculation = {}
+        for index, statement in enumerate(self._statements):
+            if isinstance(statement, FusedStatement):
+                statement = statement.parts()[0]
+            if (
+                isinstance(statement, ArithmeticStatement)
+                and statement.specialization() is not None
+                and index not in self._unspeculated
+            ):
+                speculation[index] = statement.specialization()
+        return speculation
+
+    def promote(self) -> None:
+        """Builds the closures now, so the next run starts on them"""
+        self._closures = build_closures(
+            self._token_lines,
+            self._goto_labels,
+            self._slot_table,
+            self.speculation(),
+            self._tail_calls,
+        )
+
+    def _run_closures(self, state: ProgramState) -> None:
+        """Carries on running state on the closures, deoptimizing back to the
+        interpreter if a speculative closure's guard fails"""
+        compiled = from_program_state(state, self._slot_table)
+        try:
+            run_closures(self._closures, compiled)
+        except Deoptimization as deoptimization:
+            self.deopts.record(deoptimization)
+            self._unspeculated.add(deoptimization.ip)
+            self.promote()
+        else:
+            return
+        finally:
+            to_program_state(compiled, state)
+
+        statements = self._statements
+        while 0 <= state.ip < len(statements):
+            statements[state.ip].execute(state)
+
+    def run(self, state: ProgramState) -> None:
+        """Runs the program from state.ip until it ends"""
+        statements = self._statements
+        line_count = len(statements)
+
+        if not self.promoted():
+            try:
+                while 0 <= state.ip < line_count:
+                    ip = state.ip
+                    statements[ip].execute(state)
+                    self.instructions += 1
+                    if state.ip <= ip:
+                        self.backward_jumps += 1
+                        if self._is_hot():
+                            break
+                    elif self.instructions >= self.promotion_instructions:
+                        break
+                else:
+                    return
+            finally:
+                # A run that ends or fails just as the program proves hot
+                # still leaves it promoted for the next run
+                if self._is_hot() and not self.promoted():
+                    self.promote()
+            self.promotions += 1
+
+        self._run_closures(state)
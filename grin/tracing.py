@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+
+# A trace-recording JIT tier on top of the Statement interpreter.
+#
+# The interpreter counts how often each backward jump lands on its target.
+# Once a target (a loop head) has been reached hot_loop_threshold times, the
+# next trip around the loop is recorded: the statements actually executed,
+# and which way each conditional jump went.  That trace is compiled into a
+# Python function that keeps the loop's variables in locals and loops on its
+# own, guarded by
+#
+# * type guards on entry, for every variable the trace reads before writing,
+# * branch guards, wherever a conditional jump goes the other way, and
+# * error guards, wherever the interpreter would raise (e.g. DIV by zero).
+#
+# When a guard fails, the trace writes its variables back to the ProgramState
+# and exits to the interpreter at the line it couldn't handle.
+
+from typing import Any, Callable
+
+from .program_state import ProgramState
+from .statements import (
+    AddStatement,
+    ArithmeticStatement,
+    ConstantLetsStatement,
+    CountingLoopStatement,
+    DivStatement,
+    FusedStatement,
+    GoToStatement,
+    InlinedCallStatement,
+    LetStatement,
+    MultStatement,
+    NopStatement,
+    PrintStatement,
+    Statement,
+    SubStatement,
+    UnbuiltStatement,
+)
+from .token import GrinToken, GrinTokenKind
+from .transpiler import SourceWriter
+from .utility import COMPARISON_TABLE, GrinRuntimeError, truncating_div
+
+# Backward jumps to a line before a loop starting there is recorded
+HOT_LOOP_THRESHOLD = 50
+
+# Statements a trace may hold before recording gives up
+MAX_TRACE_LENGTH = 200
+
+_SYMBOLS = {
+    AddStatement: '+',
+    SubStatement: '-',
+    MultStatement: '*',
+}
+
+_COMPARISON_SYMBOLS = {
+    GrinTokenKind.EQUAL: '==',
+    GrinTokenKind.NOT_EQUAL: '!=',
+    GrinTokenKind.LESS_THAN: '<',
+    GrinTokenKind.LESS_THAN_OR_EQUAL: '<=',
+    GrinTokenKind.GREATER_THAN: '>',
+    GrinTokenKind.GREATER_THAN_OR_EQUAL: '>=',
+}
+
+_NUMBERS = (int, float)
+
+# Statements of an inlined subroutine that a trace can run without a guard
+_INLINEABLE = (LetStatement, AddStatement, SubStatement, MultStatement, PrintStatement)
+
+
+class TraceAborted(Exception):
+    """Raised while recording or compiling a trace that can't be handled"""
+
+    pass
+
+
+class TraceStats:
+    """
+    Counters describing what the tracing tier has done
+    - recorded counts traces compiled, keyed by loop head
+    - aborted counts traces given up on, keyed by reason
+    - entries counts how often each trace was entered
+    - guard_failures counts how often a trace couldn't start because a
+      variable had the wrong type, keyed by loop head
+    - side_exits counts exits back to the interpreter, keyed by the line
+      the interpreter resumed at
+    """
+
+    def __init__(self):
+        self.recorded: dict[int, int] = {}
+        self.aborted: dict[str, int] = {}
+        self.entries: dict[int, int] = {}
+        self.guard_failures: dict[int, int] = {}
+        self.side_exits: dict[int, int] = {}
+
+    def as_dict(self) -> dict[str, dict]:
+        return {
+            'recorded': dict(self.recorded),
+            'aborted': dict(self.aborted),
+            'entries': dict(self.entries),
+            'guard_failures': dict(self.guard_failures),
+            'side_exits': dict(self.side_exits),
+        }
+
+
+def _count(counter: dict, key) -> None:
+    counter[key] = counter.get(key, 0) + 1
+
+
+class _TraceCompiler:
+    """Generates the Python function for one recorded trace"""
+
+    def __init__(self, head: int, entry_types: dict[str, type]):
+        self._head = head
+        self._entry_types = entry_types
+        self._types: dict[str, type] = {}
+        self._locals: dict[str, str] = {}
+        self._live_in: list[str] = []
+        self._written: list[str] = []
+        self._all_written: list[str] = []
+        self._writer = SourceWriter()
+
+    def _local(self, name: str) -> str:
+        if name not in self._locals:
+            self._locals[name] = f'v{len(self._locals)}'
+        return self._locals[name]
+
+    def _read(self, token: GrinToken) -> tuple[str, type]:
+        """The Python expression and type of an operand"""
+        if token.kind() != GrinTokenKind.IDENTIFIER:
+            return repr(token.value()), type(token.value())
+
+        return self._read_name(token.text())
+
+    def _read_name(self, name: str) -> tuple[str, type]:
+        if name not in self._types:
+            # Read before being written, so its type is guarded on entry
+            self._types[name] = self._entry_types.get(name, int)
+            self._live_in.append(name)
+        return self._local(name), self._types[name]
+
+    def _write(self, name: str, value_type: type) -> str:
+        self._types[name] = value_type
+        if name not in self._written:
+            self._written.append(name)
+        return self._local(name)
+
+    def _exit(self, ip: int) -> None:
+        for name in self._written:
+            self._writer.line(f'_vars[{name!r}] = {self._local(name)}')
+        # Variables written further along the trace only hold something to
+        # write back once it's been all the way around
+        later = [name for name in self._all_written if name not in self._written]
+        if later:
+            self._writer.line('if _looped:')
+            self._writer.indent()
+            for name in later:
+                self._writer.line(f'_vars[{name!r}] = {self._local(name)}')
+            self._writer.dedent()
+        self._writer.line(f'return {ip}')
+
+    def _guard(self, condition: str, ip: int) -> None:
+        self._writer.line(f'if {condition}:')
+        self._writer.indent()
+        self._exit(ip)
+        self._writer.dedent()
+
+    def _arithmetic(self, ip: int, statement: ArithmeticStatement) -> None:
+        name = statement.var_name()
+        left, left_type = self._read_name(name)
+        right, right_type = self._read(statement.value_token())
+
+        if left_type in _NUMBERS and right_type in _NUMBERS:
+            result_type = int if left_type is right_type is int else float
+            if isinstance(statement, DivStatement):
+                self._guard(f'{right} == 0', ip)
+                if result_type is int:
+                    expression = f'_truncating_div({left}, {right})'
+                else:
+                    expression = f'{left} / {right}'
+            else:
+                expression = f'{left} {_SYMBOLS[type(statement)]} {right}'
+        elif (
+            isinstance(statement, AddStatement)
+            and left_type is str
+            and right_type is str
+        ):
+            result_type = str
+            expression = f'{left} + {right}'
+        else:
+            raise TraceAborted('unsupported operand types')
+
+        target = self._write(name, result_type)
+        self._writer.line(f'{target} = {expression}')
+
+    def _jump(self, ip: int, statement: GoToStatement, taken: bool, dest: int):
+        condition = statement.condition()
+        if condition is None:
+            return
+
+        left_token, op_token, right_token = condition
+        left, left_type = self._read(left_token)
+        right, right_type = self._read(right_token)
+        if (left_type, op_token.kind(), right_type) not in COMPARISON_TABLE:
+            raise TraceAborted('unsupported comparison')
+
+        comparison = f'{left} {_COMPARISON_SYMBOLS[op_token.kind()]} {right}'
+        if taken:
+            self._guard(f'not ({comparison})', ip + 1)
+        else:
+            self._guard(comparison, dest)
+
+    def compile(self, trace: list[tuple[int, Statement, bool, int]]) -> Callable:
+        body = SourceWriter()
+        self._writer = body
+        body.indent()
+        body.indent()
+        for _, statement, _, _ in trace:
+            if isinstance(statement, (LetStatement, ArithmeticStatement)):
+                if statement.var_name() not in self._all_written:
+                    self._all_written.append(statement.var_name())
+
+        for ip, statement, taken, dest in trace:
+            if isinstance(statement, LetStatement):
+                value, value_type = self._read(statement.value_token())
+                target = self._write(statement.var_name(), value_type)
+                body.line(f'{target} = {value}')
+            elif isinstance(statement, ArithmeticStatement):
+                self._arithmetic(ip, statement)
+            elif isinstance(statement, PrintStatement):
+                value, _ = self._read(statement.value_token())
+                body.line(f'_emit(str({value}))')
+            elif isinstance(statement, GoToStatement):
+                self._jump(ip, statement, taken, dest)
+            elif not isinstance(statement, NopStatement):
+                raise TraceAborted(f'untraceable {type(statement).__name__}')
+        body.line('_looped = True')
+
+        # Going around again is only valid if every guarded type still holds
+        for name in self._live_in:
+            if self._types[name] is not self._entry_types.get(name, int):
+                raise TraceAborted('unstable types')
+
+        header = SourceWriter()
+        header.line('def _trace(state):')
+        header.indent()
+        header.line('_vars = state.vars')
+        for name, local in self._locals.items():
+            header.line(f'{local} = _vars.get({name!r}, 0)')
+        for name in self._live_in:
+            expected = self._entry_types.get(name, int).__name__
+            header.line(f'if type({self._local(name)}) is not {expected}:')
+            header.indent()
+            header.line('return None')
+            header.dedent()
+        header.line('_looped = False')
+        header.line('_output = state.output')
+        header.line('_output_func = state.output_func')
+        header.line('def _emit(text):')
+        header.indent()
+        header.line('_output.append(text)')
+        header.line('if _output_func is not None:')
+        header.indent()
+        header.line('_output_func(text)')
+        header.dedent()
+        header.dedent()
+        header.line('while True:')
+
+        source = header.source() + body.source()
+        namespace = {'_truncating_div': truncating_div}
+        exec(compile(source, f'<grin trace {self._head}>', 'exec'), namespace)
+        return namespace['_trace']
+
+
+class TracingJIT:
+    """
+    Runs Statement objects, recording and compiling traces through hot loops.
+    hot_loop_threshold and max_trace_length default to the module's
+    HOT_LOOP_THRESHOLD and MAX_TRACE_LENGTH and can be changed between runs;
+    compiled traces and stats are kept across runs of the same program.
+    """
+
+    def __init__(
+        self,
+        statements: tuple[Statement, ...],
+        hot_loop_threshold: int | None = None,
+        max_trace_length: int | None = None,
+    ):
+        self._statements = statements
+        self.hot_loop_threshold = (
+            HOT_LOOP_THRESHOLD if hot_loop_threshold is None else hot_loop_threshold
+        )
+        self.max_trace_length = (
+            MAX_TRACE_LENGTH if max_trace_length is None else max_trace_length
+        )
+        self._backward_jumps: dict[int, int] = {}
+        self._traces: dict[int, Callable[[ProgramState], Any]] = {}
+        self._blacklist: set[int] = set()
+        self._stats = TraceStats()
+
+    def stats(self) -> TraceStats:
+        return self._stats
+
+    def traces(self) -> dict[int, Callable[[ProgramState], Any]]:
+        """Compiled traces, keyed by the loop head they start at"""
+        return dict(self._traces)
+
+    def _statement(self, ip: int) -> Statement:
+        statement = self._statements[ip]
+        if isinstance(statement, UnbuiltStatement):
+            statement = statement.build(ip)
+        # Superinstructions, folded loops and combined LETs are recorded one
+        # line at a time
+        if isinstance(statement, (CountingLoopStatement, ConstantLetsStatement)):
+            statement = statement.original()
+        if isinstance(statement, FusedStatement):
+            return statement.parts()[0]
+        return statement
+
+    def _record(self, state: ProgramState, head: int) -> None:
+        """Runs one trip around the loop at head, recording it as it goes,
+        and compiles the result into a trace"""
+        entry_types = {name: type(value) for name, value in state.vars.items()}
+        trace = []
+
+        while True:
+            ip = state.ip
+            if not 0 <= ip < len(self._statements):
+                raise TraceAborted('left the program')
+            if len(trace) >= self.max_trace_length:
+                raise TraceAborted('trace too long')
+
+            statement = self._statement(ip)
+            taken = False
+            dest = ip + 1
+            if isinstance(statement, InlinedCallStatement):
+                # Recorded one statement at a time, as long as none of them
+                # needs a guard that would have to exit partway through
+                for part in statement.body():
+                    if not isinstance(part, _INLINEABLE):
+                        raise TraceAborted(f'untraceable {type(part).__name__}')
+                    trace.append((ip, part, False, dest))
+                statement.execute(state)
+                if state.ip == head:
+                    break
+                continue
+            if isinstance(statement, GoToStatement):
+                if statement.target_token().kind() == GrinTokenKind.IDENTIFIER:
+                    raise TraceAborted('dynamic jump target')
+                taken = statement.should_jump(state)
+                try:
+                    dest = statement.destination(state)
+                except GrinRuntimeError:
+                    raise TraceAborted('invalid jump target')
+            elif not isinstance(
+                statement,
+                (LetStatement, ArithmeticStatement, PrintStatement, NopStatement),
+            ):
+                raise TraceAborted(f'untraceable {type(statement).__name__}')
+
+            trace.append((ip, statement, taken, dest))
+            statement.execute(state)
+            if state.ip == head:
+                break
+
+        self._traces[head] = _TraceCompiler(head, entry_types).compile(trace)
+        _count(self._stats.recorded, head)
+
+    def _start_recording(self, state: ProgramState, head: int) -> None:
+        try:
+            self._record(state, head)
+        except (TraceAborted, GrinRuntimeError) as error:
+            self._blacklist.add(head)
+            if isinstance(error, TraceAborted):
+                _count(self._stats.aborted, str(error))
+            else:
+                raise
+
+    def _enter(self, state: ProgramState, trace: Callable) -> bool:
+        head = state.ip
+        exit_ip = trace(state)
+        if exit_ip is None:
+            _count(self._stats.guard_failures, head)
+            return False
+        _count(self._stats.entries, head)
+        _count(self._stats.side_exits, exit_ip)
+        state.ip = exit_ip
+        if exit_ip == head:
+            # The trace couldn't run its own first line (say, a DIV by zero),
+            # so the interpreter runs it once rather than entering again
+            self._statements[head].execute(state)
+        return True
+
+    def run(self, state: ProgramState) -> None:
+        """Runs the program from state.ip until it ends"""
+        statements = self._statements
+        traces = self._traces
+        backward_jumps = self._backward_jumps
+
+        while 0 <= state.ip < len(statements):
+            ip = state.ip
+            trace = traces.get(ip)
+            if trace is not None and self._enter(state, trace):
+                continue
+
+            statements[ip].execute(state)
+
+            head = state.ip
+            if head < ip and head not in traces and head not in self._blacklist:
+                hits = backward_jumps.get(head, 0) + 1
+                backward_jumps[head] = hits
+                if hits >= self.hot_loop_threshold:
+                    self._start_recording(state, head)
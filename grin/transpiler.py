@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+
+# Translates a whole Grin program into the source of a single Python function
+# and compiles it.  Lines are grouped into basic blocks that become straight-
+# line Python; GOTO, GOSUB and RETURN store the index of the next block in _ip
+# and go back around a dispatch loop, which finds that block by bisecting the
+# block start indices.  Grin variables become Python locals.
+#
+# Generating and compiling the source is the expensive part, so the resulting
+# code objects are cached in memory and, optionally, marshalled to a cache
+# directory, both keyed by a hash of the Grin program.
+#
+# Given the program's hottest lines from a profile (see grin.profiles), the
+# blocks starting at them are also checked for directly, hottest first, ahead
+# of the bisection.
+
+import importlib.util
+import marshal
+import os
+from collections import OrderedDict
+from typing import Any, Callable, Mapping, Sequence
+
+from .program_state import ProgramState
+from .token import GrinToken, GrinTokenKind
+from .utility import (
+    GrinRuntimeError,
+    add_values,
+    compare_values,
+    div_values,
+    get_starter_index,
+    is_tail_call,
+    jump_destination,
+    mult_values,
+    number_from_input,
+    program_hash,
+    sub_values,
+)
+
+_FUNCTION_NAME = '_grin_program'
+# Part of every cache key; bump it whenever the generated code changes
+_GENERATOR_VERSION = 3
+_CACHE_SIZE = 64
+_CACHE_SUFFIX = '.grinc'
+# How many of a program's hottest blocks are dispatched to ahead of the
+# bisection
+HOT_DISPATCH_BLOCKS = 4
+_code_cache: OrderedDict[str, Any] = OrderedDict()
+
+_ARITHMETIC_HELPERS = {
+    GrinTokenKind.ADD: '_add',
+    GrinTokenKind.SUB: '_sub',
+    GrinTokenKind.MULT: '_mult',
+    GrinTokenKind.DIV: '_div',
+}
+
+_ARITHMETIC_OPERATORS = {
+    GrinTokenKind.ADD: '+',
+    GrinTokenKind.SUB: '-',
+    GrinTokenKind.MULT: '*',
+}
+
+_COMPARISON_OPERATORS = {
+    GrinTokenKind.EQUAL: '==',
+    GrinTokenKind.NOT_EQUAL: '!=',
+    GrinTokenKind.LESS_THAN: '<',
+    GrinTokenKind.LESS_THAN_OR_EQUAL: '<=',
+    GrinTokenKind.GREATER_THAN: '>',
+    GrinTokenKind.GREATER_THAN_OR_EQUAL: '>=',
+}
+
+# Names the generated code expects to find in its globals
+_HELPERS = {
+    'GrinRuntimeError': GrinRuntimeError,
+    'GrinTokenKind': GrinTokenKind,
+    '_add': add_values,
+    '_sub': sub_values,
+    '_mult': mult_values,
+    '_div': div_values,
+    '_compare': compare_values,
+    '_number': number_from_input,
+}
+
+
+class SourceWriter:
+    """Builds Python source one indented line at a time"""
+
+    def __init__(self):
+        self._lines = []
+        self._depth = 0
+
+    def line(self, text: str) -> None:
+        self._lines.append('    ' * self._depth + text)
+
+    def indent(self) -> None:
+        self._depth += 1
+
+    def dedent(self) -> None:
+        self._depth -= 1
+
+    def source(self) -> str:
+        return '\n'.join(self._lines) + '\n'
+
+
+class _Translator:
+    """Generates the Python function for one program"""
+
+    def __init__(
+        self,
+        token_lines: list[list[GrinToken]],
+        goto_labels: Mapping[str, int],
+        hot_lines: Sequence[int] = (),
+        tail_calls: bool = True,
+    ):
+        self._token_lines = token_lines
+        self._goto_labels = goto_labels
+        self._hot_lines = hot_lines
+        self._tail_calls = tail_calls
+        self._line_count = len(token_lines)
+        self._locals: dict[str, str] = {}
+        self._writer = SourceWriter()
+
+    def _local(self, name: str) -> str:
+        # Grin identifiers can contain characters that aren't allowed in
+        # Python identifiers, so every variable gets a numbered local
+        if name not in self._locals:
+            self._locals[name] = f'v{len(self._locals)}'
+        return self._locals[name]
+
+    def _operand(self, token: GrinToken) -> str:
+        if token.kind() == GrinTokenKind.IDENTIFIER:
+            return self._local(token.text())
+        return repr(token.value())
+
+    def _body(self, tokens: list[GrinToken]) -> list[GrinToken]:
+        return tokens[get_starter_index(tokens) :]
+
+    def _block_starts(self) -> list[int]:
+        """Indices of the lines that begin a basic block"""
+        starts = {0}
+        for index, tokens in enumerate(self._token_lines):
+            body = self._body(tokens)
+            keyword = body[0].kind()
+            if keyword in (GrinTokenKind.GOTO, GrinTokenKind.GOSUB):
+                target = body[1]
+                if target.kind() == GrinTokenKind.IDENTIFIER:
+                    # A variable can send us to any line at all
+                    return list(range(self._line_count))
+                try:
+                    starts.add(
+                        jump_destination(
+                            index, target.value(), self._goto_labels, self._line_count
+                        )
+                    )
+                except GrinRuntimeError:
+                    pass
+                starts.add(index + 1)
+            elif keyword in (GrinTokenKind.RETURN, GrinTokenKind.END):
+                starts.add(index + 1)
+        return sorted(start for start in starts if start < self._line_count)
+
+    def _write_dispatch(self, starts: list[int], low: int, high: int) -> None:
+        if high - low == 1:
+            self._write_block(starts[low], starts[high] if high < len(starts) else None)
+            return
+
+        middle = (low + high) // 2
+        self._writer.line(f'if _ip < {starts[middle]}:')
+        self._writer.indent()
+        self._write_dispatch(starts, low, middle)
+        self._writer.dedent()
+        self._writer.line('else:')
+        self._writer.indent()
+        self._write_dispatch(starts, middle, high)
+        self._writer.dedent()
+
+    def hot_starts(self) -> list[int]:
+        """The hot lines that begin a basic block, hottest first, up to
+        HOT_DISPATCH_BLOCKS of them"""
+        if not self._hot_lines:
+            return []
+        starts = set(self._block_starts())
+        hot = [line for line in self._hot_lines if line in starts]
+        return hot[:HOT_DISPATCH_BLOCKS]
+
+    def _write_hot_dispatch(self, starts: list[int]) -> None:
+        ends = dict(zip(starts, starts[1:]))
+        for start in self.hot_starts():
+            self._writer.line(f'if _ip == {start}:')
+            self._writer.indent()
+            self._write_block(start, ends.get(start))
+            self._writer.dedent()
+
+    def _write_block(self, start: int, end: int | None) -> None:
+        end = self._line_count if end is None else end
+        for index in range(start, end):
+            if self._write_statement(index):
+                return
+        self._writer.line(f'_ip = {end}')
+        self._writer.line('continue')
+
+    def _write_raise(self, message: str) -> None:
+        self._writer.line(f'raise GrinRuntimeError({message!r})')
+
+    def _write_statement(self, index: int) -> bool:
+        """Writes one line, returning True if it always leaves the block"""
+        body = self._body(self._token_lines[index])
+        keyword = body[0].kind()
+        write = self._writer.line
+
+        if keyword == GrinTokenKind.LET:
+            write(f'{self._local(body[1].text())} = {self._operand(body[2])}')
+        elif keyword == GrinTokenKind.PRINT:
+            value_token = body[1]
+            if value_token.kind() == GrinTokenKind.IDENTIFIER:
+                write(f'_emit(str({self._operand(value_token)}))')
+            else:
+                write(f'_emit({str(value_token.value())!r})')
+        elif keyword == GrinTokenKind.END:
+            write(f'_ip = {self._line_count}')
+            write('break')
+            return True
+        elif keyword in _ARITHMETIC_HELPERS:
+            self._write_arithmetic(keyword, body)
+        elif keyword in (GrinTokenKind.GOTO, GrinTokenKind.GOSUB):
+            self._write_jump(index, keyword, body)
+            return len(body) == 2
+        elif keyword == GrinTokenKind.RETURN:
+            write('if not _stack:')
+            self._writer.indent()
+            self._write_raise('Runtime error: RETURN without GOSUB')
+            self._writer.dedent()
+            write('_ip = _stack.pop()')
+            write('continue')
+            return True
+        elif keyword == GrinTokenKind.INSTR:
+            write(f'{self._local(body[1].text())} = _input()')
+        elif keyword == GrinTokenKind.INNUM:
+            write(f'{self._local(body[1].text())} = _number(_input())')
+        else:
+            self._write_raise('Not implemented')
+            return True
+        return False
+
+    def _write_arithmetic(self, keyword: GrinTokenKind, body: list[GrinToken]) -> None:
+        target = self._local(body[1].text())
+        operand = self._operand(body[2])
+        generic = f'{_ARITHMETIC_HELPERS[keyword]}({target}, {operand})'
+        symbol = _ARITHMETIC_OPERATORS.get(keyword)
+        value_token = body[2]
+
+        if symbol is None:
+            self._writer.line(f'{target} = {generic}')
+        elif value_token.kind() == GrinTokenKind.LITERAL_INTEGER:
+            self._writer.line(
+                f'{target} = {target} {symbol} {operand}'
+                f' if type({target}) is int else {generic}'
+            )
+        elif value_token.kind() == GrinTokenKind.IDENTIFIER:
+            self._writer.line(
+                f'{target} = {target} {symbol} {operand}'
+                f' if type({target}) is int and type({operand}) is int'
+                f' else {generic}'
+            )
+        else:
+            self._writer.line(f'{target} = {generic}')
+
+    def _condition(self, left: GrinToken, op: GrinToken, right: GrinToken) -> str:
+        """A Python expression for an IF clause"""
+        generic = (
+            f'_compare({self._operand(left)}, GrinTokenKind.{op.kind().name},'
+            f' {self._operand(right)})'
+        )
+        identifier = GrinTokenKind.IDENTIFIER
+        if left.kind() == identifier and right.kind() in (
+            GrinTokenKind.LITERAL_INTEGER,
+            GrinTokenKind.LITERAL_FLOAT,
+        ):
+            name = self._local(left.text())
+            symbol = _COMPARISON_OPERATORS[op.kind()]
+            return (
+                f'({name} {symbol} {right.value()!r}'
+                f' if type({name}) is int or type({name}) is float'
+                f' else {generic})'
+            )
+        return generic
+
+    def _write_jump(
+        self, index: int, keyword: GrinTokenKind, body: list[GrinToken]
+    ) -> None:
+        write = self._writer.line
+        if len(body) > 2:
+            write(f'if {self._condition(*body[3:6])}:')
+            self._writer.indent()
+
+        target = body[1]
+        if target.kind() == GrinTokenKind.IDENTIFIER:
+            write(f'_ip = _jump({index}, {self._local(target.text())})')
+        else:
+            try:
+                dest = jump_destination(
+                    index, target.value(), self._goto_labels, self._line_count
+                )
+            except GrinRuntimeError as error:
+                self._write_raise(str(error))
+                dest = None
+            if dest is not None:
+                write(f'_ip = {dest}')
+
+        if keyword == GrinTokenKind.GOSUB and not (
+            self._tail_calls and is_tail_call(self._token_lines, index)
+        ):
+            write(f'_stack.append({index + 1})')
+        write('continue')
+
+        if len(body) > 2:
+            self._writer.dedent()
+
+    def source(self) -> str:
+        """Python source defining the program's function"""
+        starts = self._block_starts()
+
+        # The body is generated first so that every variable has a local
+        body = SourceWriter()
+        self._writer = body
+        self._writer.indent()
+        self._writer.indent()
+        self._writer.indent()
+        if starts:
+            self._write_hot_dispatch(starts)
+            self._write_dispatch(starts, 0, len(starts))
+        else:
+            self._writer.line('pass')
+
+        names = list(self._locals.items())
+        header = SourceWriter()
+        header.line(f'def {_FUNCTION_NAME}(state, _jump):')
+        header.indent()
+        header.line('_stack = state.return_stack')
+        header.line('_input = state.input_func')
+        header.line('_output = state.output')
+        header.line('_output_func = state.output_func')
+        header.line('def _emit(text):')
+        header.indent()
+        header.line('_output.append(text)')
+        header.line('if _output_func is not None:')
+        header.indent()
+        header.line('_output_func(text)')
+        header.dedent()
+        header.dedent()
+        header.line('_vars = state.vars')
+        for name, local in names:
+            header.line(f'{local} = _vars.get({name!r}, 0)')
+        header.line('_ip = state.ip')
+        header.line('try:')
+        header.indent()
+        header.line(f'while _ip < {self._line_count}:')
+
+        footer = SourceWriter()
+        footer.indent()
+        footer.line('finally:')
+        footer.indent()
+        footer.line('state.ip = _ip')
+        for name, local in names:
+            footer.line(f'_vars[{name!r}] = {local}')
+
+        return header.source() + body.source() + footer.source()
+
+
+def generate_source(
+    token_lines: list[list[GrinToken]],
+    goto_labels: Mapping[str, int],
+    hot_lines: Sequence[int] = (),
+    tail_calls: bool = True,
+) -> str:
+    """Returns the Python source that the transpiler generates for a program,
+    dispatching first to the blocks starting at hot_lines (hottest first)"""
+    return _Translator(token_lines, goto_labels, hot_lines, tail_calls).source()
+
+
+def _cache_key(
+    token_lines: list[list[GrinToken]], hot_lines: Sequence[int], tail_calls: bool
+) -> str:
+    # Marshalled code objects are only readable by the Python that wrote them
+    magic = importlib.util.MAGIC_NUMBER.hex()
+    key = f'{program_hash(token_lines)}-{_GENERATOR_VERSION}-{magic}'
+    if hot_lines:
+        key += '-hot' + '.'.join(str(line) for line in hot_lines)
+    if not tail_calls:
+        key += '-calls'
+    return key
+
+
+def _load_cached(key: str, cache_dir: str | None):
+    if key in _code_cache:
+        _code_cache.move_to_end(key)
+        return _code_cache[key]
+
+    if cache_dir is None:
+        return None
+
+    try:
+        with open(os.path.join(cache_dir, key + _CACHE_SUFFIX), 'rb') as cache_file:
+            return marshal.load(cache_file)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+
+def _remember(key: str, code) -> None:
+    _code_cache[key] = code
+    while len(_code_cache) > _CACHE_SIZE:
+        _code_cache.popitem(last=False)
+
+
+def _store_cached(key: str, code, cache_dir: str | None) -> None:
+    _remember(key, code)
+    if cache_dir is None:
+        return
+
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, key + _CACHE_SUFFIX)
+    # Write then rename, so a concurrent reader never sees half a file
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as cache_file:
+        marshal.dump(code, cache_file)
+    os.replace(temporary, path)
+
+
+def transpile(
+    token_lines: list[list[GrinToken]],
+    goto_labels: Mapping[str, int],
+    cache_dir: str | None = None,
+    hot_lines: Sequence[int] = (),
+    tail_calls: bool = True,
+) -> Callable[[ProgramState], None]:
+    """
+    Returns a function that runs the program against a ProgramState.
+    The compiled code is looked up in memory, then in cache_dir (if given),
+    before being generated from scratch.  hot_lines are the program's most
+    often run lines, hottest first; blocks starting at them are dispatched
+    to first.  tail_calls runs each GOSUB followed by a RETURN as a jump
+    (see grin.utility.is_tail_call)
+    """
+    translator = _Translator(token_lines, goto_labels, hot_lines, tail_calls)
+    key = _cache_key(token_lines, translator.hot_starts(), tail_calls)
+    code = _load_cached(key, cache_dir)
+    if code is None:
+        source = translator.source()
+        code = compile(source, f'<grin {key[:12]}>', 'exec')
+        _store_cached(key, code, cache_dir)
+    else:
+        _remember(key, code)
+
+    namespace = dict(_HELPERS)
+    exec(code, namespace)
+    function = namespace[_FUNCTION_NAME]
+    line_count = len(token_lines)
+
+    def jump(ip: int, destination_relative: Any) -> int:
+        return jump_destination(ip, destination_relative, goto_labels, line_count)
+
+    def run(state: ProgramState) -> None:
+        function(state, jump)
+
+    return run
+
+
+def clear_code_cache() -> None:
+    """Forgets every code object cached in memory"""
+    _code_cache.clear()
@@ -4,6 +4,8 @@ from .token import GrinToken
 from .program_state import ProgramState
 from .token import GrinTokenKind
 from typing import Any
+import hashlib
+import operator
 
 
 class GrinRuntimeError(Exception):
@@ -12,6 +14,56 @@ class GrinRuntimeError(Exception):
     pass
 
 
+def get_starter_index(tokens: list[GrinToken]):
+    """A function that gets the token considering the possiblity of labels"""
+    if (
+        len(tokens) >= 2
+        and tokens[0].kind() == GrinTokenKind.IDENTIFIER
+        and tokens[1].kind() == GrinTokenKind.COLON
+    ):
+        return 2
+    else:
+        return 0
+
+
+def build_goto_labels(token_lines: list[list[GrinToken]]) -> dict[str, int]:
+    """Maps each label in a program to the index of the line it's attached to"""
+    labels = {}
+    for index, tokens in enumerate(token_lines):
+        if (
+            len(tokens) >= 2
+            and tokens[0].kind() == GrinTokenKind.IDENTIFIER
+            and tokens[1].kind() == GrinTokenKind.COLON
+        ):
+            labels[tokens[0].text()] = index
+    return labels
+
+
+def is_tail_call(token_lines: list[list[GrinToken]], index: int) -> bool:
+    """Whether line index is a GOSUB followed by a RETURN.  The RETURN would
+    pop the address the GOSUB pushes as soon as the subroutine came back to
+    it, so the GOSUB can jump like a GOTO instead, leaving the subroutine to
+    return straight to its caller's caller"""
+    if index + 1 >= len(token_lines):
+        return False
+    tokens = token_lines[index]
+    following = token_lines[index + 1]
+    return (
+        tokens[get_starter_index(tokens)].kind() == GrinTokenKind.GOSUB
+        and following[get_starter_index(following)].kind() == GrinTokenKind.RETURN
+    )
+
+
+def program_hash(token_lines: list[list[GrinToken]]) -> str:
+    """A hash of a program's tokens, identifying it across runs and processes"""
+    digest = hashlib.sha256()
+    for tokens in token_lines:
+        line = [(token.kind().index(), token.text()) for token in tokens]
+        digest.update(repr(line).encode())
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
 def value_from_token(state: ProgramState, value_token: GrinToken):
     kind = value_token.kind()
     assert kind in (
@@ -26,77 +78,159 @@ def value_from_token(state: ProgramState, value_token: GrinToken):
         return value_token.value()
 
 
-def _apply_comp_operator(a: Any, op_kind: GrinTokenKind, b: Any):
-    if op_kind == GrinTokenKind.EQUAL:
-        return a == b
-    if op_kind == GrinTokenKind.NOT_EQUAL:
-        return a != b
-    if op_kind == GrinTokenKind.LESS_THAN:
-        return a < b
-    if op_kind == GrinTokenKind.LESS_THAN_OR_EQUAL:
-        return a <= b
-    if op_kind == GrinTokenKind.GREATER_THAN:
-        return a > b
-    if op_kind == GrinTokenKind.GREATER_THAN_OR_EQUAL:
-        return a >= b
-    raise GrinRuntimeError('Unknown comparison operator')
+_COMPARISON_OPERATORS = {
+    GrinTokenKind.EQUAL: operator.eq,
+    GrinTokenKind.NOT_EQUAL: operator.ne,
+    GrinTokenKind.LESS_THAN: operator.lt,
+    GrinTokenKind.LESS_THAN_OR_EQUAL: operator.le,
+    GrinTokenKind.GREATER_THAN: operator.gt,
+    GrinTokenKind.GREATER_THAN_OR_EQUAL: operator.ge,
+}
+
+# Numbers compare with numbers and strings with strings.  Python compares ints
+# with ints and floats exactly, so nothing is converted to float first.
+_COMPARABLE_TYPES = ((int, int), (int, float), (float, int), (float, float), (str, str))
+
+# Maps (left type, comparison operator kind, right type) to the function that
+# compares two such values
+COMPARISON_TABLE = {
+    (left_type, op_kind, right_type): op
+    for left_type, right_type in _COMPARABLE_TYPES
+    for op_kind, op in _COMPARISON_OPERATORS.items()
+}
 
 
 def compare_values(left: Any, op_kind: GrinTokenKind, right: Any):
     """Interpret grin comparison expressions"""
-    # Numeric
-    if isinstance(left, (int, float)) and isinstance(right, (int, float)):
-        a = float(left) if isinstance(left, int) and isinstance(right, float) else left
-        b = (
-            float(right)
-            if isinstance(right, int) and isinstance(left, float)
-            else right
-        )
-        # simpler: a = float(left); b = float(right) works too
-        a = float(left)
-        b = float(right)
-        return _apply_comp_operator(a, op_kind, b)
-
-    # string comparisons
-    if isinstance(left, str) and isinstance(right, str):
-        return _apply_comp_operator(left, op_kind, right)
+    compare = COMPARISON_TABLE.get((type(left), op_kind, type(right)))
+    if compare is not None:
+        return compare(left, right)
 
+    if (type(left), type(right)) in _COMPARABLE_TYPES:
+        raise GrinRuntimeError('Unknown comparison operator')
     raise GrinRuntimeError('Runtime error: invalid types for comparison')
 
 
-def resolve_jump_target(state: ProgramState, target_token: GrinToken):
-    destination_relative = None
-    target_token_kind = target_token.kind()
+def add_values(left: Any, right: Any):
+    """Interpret grin ADD on two values"""
+    if isinstance(left, str) and isinstance(right, str):
+        return left + right
+    if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+        return left + right
+    raise GrinRuntimeError('Invalid types for ADD')
 
-    if target_token_kind == GrinTokenKind.LITERAL_INTEGER:
-        destination_relative = target_token.value()
-    elif target_token_kind == GrinTokenKind.LITERAL_STRING:
-        destination_relative = target_token.value()
-    elif target_token_kind == GrinTokenKind.IDENTIFIER:
-        destination_relative = state.vars.get(target_token.text(), 0)
-    else:
-        raise AssertionError('Parser should prevent this')
 
+def sub_values(left: Any, right: Any):
+    """Interpret grin SUB on two values"""
+    # numeric - numeric only
+    if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+        return left - right
+
+    raise GrinRuntimeError('Runtime error: invalid types for SUB')
+
+
+def mult_values(left: Any, right: Any):
+    """Interpret grin MULT on two values"""
+    # numeric * numeric
+    if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+        return left * right
+
+    # string * int
+    if isinstance(left, str) and isinstance(right, int):
+        if right < 0:
+            raise GrinRuntimeError('Runtime error: negative string multiplication')
+        return left * right
+
+    # int * string
+    if isinstance(left, int) and isinstance(right, str):
+        if left < 0:
+            raise GrinRuntimeError('Runtime error: negative string multiplication')
+        return right * left
+
+    raise GrinRuntimeError('Runtime error: invalid types for MULT')
+
+
+def truncating_div(left: int, right: int) -> int:
+    """Divides two ints exactly, truncating toward 0 the way int(left / right)
+    would if it didn't go through a float"""
+    quotient = abs(left) // abs(right)
+    return quotient if (left < 0) == (right < 0) else -quotient
+
+
+def div_values(left: Any, right: Any):
+    """Interpret grin DIV on two values"""
+    # numeric / numeric only
+    if not (isinstance(left, (int, float)) and isinstance(right, (int, float))):
+        raise GrinRuntimeError('Runtime error: invalid types for DIV')
+
+    if right == 0 or right == 0.0:
+        raise GrinRuntimeError('Runtime error: division by zero')
+
+    # int / int -> int (truncate toward 0)
+    if isinstance(left, int) and isinstance(right, int):
+        return truncating_div(left, right)
+
+    # otherwise float division
+    return left / right
+
+
+def number_from_input(line: str):
+    """Interpret a line read by INNUM as an int or a float"""
+    if not line:
+        raise GrinRuntimeError('Runtime error: INNUM empty')
+
+    try:
+        if '.' not in line:
+            return int(line)
+        else:
+            return float(line)
+    except ValueError:
+        raise GrinRuntimeError('Runtime error: INNUM not a number')
+
+
+def jump_destination(
+    ip: int, destination_relative: Any, goto_labels: dict[str, int], line_count: int
+) -> int:
+    """Validates a GOTO/GOSUB target value taken from line ip and returns the
+    absolute index of the line it lands on"""
     if isinstance(destination_relative, int):
         if destination_relative == 0:
             raise GrinRuntimeError('Runtime error: GOTO 0 is not permitted')
 
-        dest = state.ip + destination_relative
+        dest = ip + destination_relative
         # Validate destination (0-based)
         if dest < 0:
             raise GrinRuntimeError('Runtime error: jump to non-positive line')
-        if dest > len(state.token_lines):
+        if dest > line_count:
             raise GrinRuntimeError('Runtime error: jump beyond program end')
-        if dest == state.ip:
+        if dest == ip:
             raise GrinRuntimeError('Runtime error: jump to same line not permitted')
         return dest
 
     if isinstance(destination_relative, str):
-        if destination_relative not in state.goto_labels:
+        if destination_relative not in goto_labels:
             raise GrinRuntimeError('Runtime error: unknown label')
-        dest = state.goto_labels[destination_relative]
-        if dest == state.ip:
+        dest = goto_labels[destination_relative]
+        if dest == ip:
             raise GrinRuntimeError('Runtime error: jump to same line not permitted')
         return dest
 
     raise GrinRuntimeError('Runtime error: invalid GOTO/GOSUB target type')
+
+
+def resolve_jump_target(state: ProgramState, target_token: GrinToken):
+    destination_relative = None
+    target_token_kind = target_token.kind()
+
+    if target_token_kind == GrinTokenKind.LITERAL_INTEGER:
+        destination_relative = target_token.value()
+    elif target_token_kind == GrinTokenKind.LITERAL_STRING:
+        destination_relative = target_token.value()
+    elif target_token_kind == GrinTokenKind.IDENTIFIER:
+        destination_relative = state.vars.get(target_token.text(), 0)
+    else:
+        raise AssertionError('Parser should prevent this')
+
+    return jump_destination(
+        state.ip, destination_relative, state.goto_labels, len(state.token_lines)
+    )
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from grin.utility import GrinRuntimeError, div_values, truncating_div
+
+
+class TestTruncatingDiv(unittest.TestCase):
+    def test_signs_truncate_toward_zero(self):
+        cases = [(7, 2, 3), (-7, 2, -3), (7, -2, -3), (-7, -2, 3), (6, 3, 2)]
+        for left, right, expected in cases:
+            with self.subTest(left=left, right=right):
+                self.assertEqual(truncating_div(left, right), expected)
+
+    def test_large_ints_are_exact(self):
+        left = 10**40 + 7
+        self.assertEqual(truncating_div(left, 1), left)
+        self.assertEqual(truncating_div(-left, 10), -(10**39))
+
+    def test_div_values_uses_exact_int_division(self):
+        self.assertEqual(div_values(2**60 + 1, 1), 2**60 + 1)
+
+    def test_div_values_by_zero(self):
+        with self.assertRaises(GrinRuntimeError):
+            div_values(2**60, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
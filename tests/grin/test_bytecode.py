@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import test_execution
+
+import grin.bytecode as bytecode
+from grin.execution import _build_goto_labels
+from grin.parsing import parse
+from grin.test_utilities import rerun_with_engine
+from grin.utility import GrinRuntimeError
+
+# Every test in test_execution.py, run again on the bytecode VM
+rerun_with_engine(globals(), test_execution, 'Bytecode', 'bytecode')
+
+
+def _assemble(lines: list[str]) -> bytecode.Bytecode:
+    token_lines = list(parse(lines + ['.']))
+    return bytecode.assemble(token_lines, _build_goto_labels(token_lines))
+
+
+class TestAssemble(unittest.TestCase):
+    def test_one_instruction_per_line(self):
+        assembled = _assemble(['LET A 1', 'PRINT A', 'END'])
+        self.assertEqual(len(assembled.code), 3 * bytecode.WIDTH)
+        self.assertEqual(assembled.line_count(), 3)
+
+    def test_constants_are_deduplicated(self):
+        assembled = _assemble(['LET A 1', 'LET B 1', 'LET C "1"', 'LET D 1.0'])
+        self.assertEqual(assembled.constants, (1, '1', 1.0))
+
+    def test_negative_zero_keeps_its_own_constant(self):
+        assembled = _assemble(['LET A 0.0', 'LET B -0.0', 'PRINT B'])
+        self.assertEqual(assembled.run(), ['-0.0'])
+
+    def test_names_are_interned(self):
+        assembled = _assemble(['LET A 1', 'ADD A B', 'PRINT A', 'INNUM B'])
+        self.assertEqual(assembled.names, ('A', 'B'))
+
+    def test_static_targets_become_absolute(self):
+        assembled = _assemble(['L: PRINT 1', 'GOTO "L"'])
+        self.assertEqual(assembled.code[bytecode.WIDTH], bytecode.JUMP)
+        self.assertEqual(assembled.code[bytecode.WIDTH + 1], 0)
+
+    def test_bad_static_target_only_raises_when_taken(self):
+        assembled = _assemble(['GOTO 0 IF 1 > 2', 'PRINT "OK"', 'GOTO 0'])
+        with self.assertRaises(GrinRuntimeError):
+            assembled.run()
+
+
+class TestSerialization(unittest.TestCase):
+    def test_round_trip_runs_the_same(self):
+        assembled = _assemble(
+            [
+                'LET I 0',
+                'LOOP: ADD I 1',
+                'GOSUB "SHOW" IF I < 3',
+                'GOTO "LOOP" IF I < 3',
+                'END',
+                'SHOW: PRINT I',
+                'RETURN',
+            ]
+        )
+        loaded = bytecode.loads(bytecode.dumps(assembled))
+        self.assertEqual(loaded.code, assembled.code)
+        self.assertEqual(loaded.constants, assembled.constants)
+        self.assertEqual(loaded.names, assembled.names)
+        self.assertEqual(loaded.goto_labels, assembled.goto_labels)
+        self.assertEqual(loaded.run(), ['1', '2'])
+
+    def test_loads_rejects_other_data(self):
+        with self.assertRaises(ValueError):
+            bytecode.loads(b'not bytecode')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+import unittest
+from unittest import mock
+
+import test_execution
+
+import grin.execution as execution
+from grin.cfg import (
+    BRANCH,
+    CALL,
+    DYNAMIC,
+    EXIT,
+    FALLTHROUGH,
+    JUMP,
+    RETURN,
+    ControlFlowGraph,
+    Edge,
+    build_cfg,
+)
+from grin.parsing import parse
+from grin.program_state import ProgramState
+from grin.test_utilities import rerun_cases
+
+
+def _cfg(lines: list[str]) -> ControlFlowGraph:
+    return build_cfg(list(parse(lines + ['.'])))
+
+
+def _spans(cfg: ControlFlowGraph) -> list[tuple[int, int]]:
+    return [(block.start(), block.end()) for block in cfg.blocks()]
+
+
+def _check_transition(cfg: ControlFlowGraph, ip: int, next_ip: int) -> None:
+    block = cfg.block_of(ip)
+    if ip != block.last_line():
+        assert next_ip == ip + 1, f'line {ip} left its block for line {next_ip}'
+        return
+
+    for edge in block.successors():
+        target = edge.target()
+        if edge.kind() in (DYNAMIC, RETURN):
+            return
+        if target is None and not 0 <= next_ip < cfg.line_count():
+            return
+        if target is not None and cfg.block(target).start() == next_ip:
+            return
+    raise AssertionError(f'no edge for line {ip} going to line {next_ip}')
+
+
+def _checked_execute(token_lines, input_func=input, output_func=None, **options):
+    """Runs a program on the Statement interpreter, checking that every line
+    it goes from and to is connected in the program's CFG"""
+    cfg = build_cfg(token_lines)
+    program = execution.compile(token_lines)
+    statements = program.statements()
+    state = ProgramState(token_lines, input_func, output_func)
+    state.goto_labels = program.goto_labels()
+    while 0 <= state.ip < len(statements):
+        ip = state.ip
+        statements[ip].execute(state)
+        _check_transition(cfg, ip, state.ip)
+    return state.output
+
+
+def _with_cfg_checks(case: type[unittest.TestCase]) -> type[unittest.TestCase]:
+    class CheckedCase(case):
+        def setUp(self):
+            super().setUp()
+            patcher = mock.patch.object(execution, 'execute', _checked_execute)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    CheckedCase.__name__ = CheckedCase.__qualname__ = f'{case.__name__}_cfg'
+    return CheckedCase
+
+
+# Every program in test_execution.py, run again checking that the CFG has an
+# edge for every jump the program actually takes
+rerun_cases(globals(), test_execution, 'CfgChecked', _with_cfg_checks)
+
+
+class TestBasicBlocks(unittest.TestCase):
+    def test_straight_line_is_one_block(self):
+        cfg = _cfg(['LET X 1', 'PRINT X', 'ADD X 2'])
+        self.assertEqual(_spans(cfg), [(0, 3)])
+        self.assertEqual(cfg.edges(), [Edge(0, None, EXIT)])
+
+    def test_empty_program(self):
+        cfg = build_cfg([])
+        self.assertEqual(cfg.blocks(), [])
+        self.assertEqual(cfg.loops(), [])
+
+    def test_conditional_jump(self):
+        cfg = _cfg(['LET X 1', 'GOTO 2 IF X < 3', 'PRINT X', 'PRINT 2'])
+        self.assertEqual(_spans(cfg), [(0, 2), (2, 3), (3, 4)])
+        self.assertEqual(
+            cfg.block(0).successors(), [Edge(0, 2, BRANCH), Edge(0, 1, FALLTHROUGH)]
+        )
+        self.assertEqual(
+            cfg.block(2).predecessors(), [Edge(0, 2, BRANCH), Edge(1, 2, FALLTHROUGH)]
+        )
+
+    def test_unconditional_jump_and_label(self):
+        cfg = _cfg(['GOTO "DONE"', 'PRINT 1', 'DONE: PRINT 2'])
+        self.assertEqual(cfg.block(0).successors(), [Edge(0, 2, JUMP)])
+        self.assertEqual(cfg.block(1).predecessors(), [])
+
+    def test_gosub_and_return(self):
+        cfg = _cfg(['GOSUB 3', 'PRINT 1', 'END', 'PRINT 2', 'RETURN'])
+        self.assertEqual(_spans(cfg), [(0, 1), (1, 3), (3, 5)])
+        self.assertEqual(
+            cfg.block(0).successors(), [Edge(0, 2, CALL), Edge(0, 1, FALLTHROUGH)]
+        )
+        self.assertEqual(cfg.block(1).successors(), [Edge(1, None, EXIT)])
+        self.assertEqual(cfg.block(2).successors(), [Edge(2, None, RETURN)])
+
+    def test_jump_past_last_line_exits(self):
+        cfg = _cfg(['GOTO 2 IF X = 0', 'PRINT 1'])
+        self.assertEqual(
+            cfg.block(0).successors(), [Edge(0, None, EXIT), Edge(0, 1, FALLTHROUGH)]
+        )
+
+    def test_dynamic_target(self):
+        cfg = _cfg(['LET T 2', 'GOTO T', 'PRINT 1'])
+        self.assertTrue(cfg.has_dynamic_edges())
+        self.assertEqual(cfg.block(0).successors(), [Edge(0, None, DYNAMIC)])
+        self.assertFalse(_cfg(['GOTO 2', 'PRINT 1', 'END']).has_dynamic_edges())
+
+    def test_invalid_target_has_no_edge(self):
+        cfg = _cfg(['GOTO "NOWHERE"', 'PRINT 1'])
+        self.assertEqual(cfg.block(0).successors(), [])
+
+    def test_block_of(self):
+        cfg = _cfg(['LET X 1', 'GOTO 2', 'PRINT X', 'PRINT 2', 'END'])
+        self.assertEqual(cfg.block_of(0).index(), 0)
+        self.assertEqual(cfg.block_of(1).index(), 0)
+        self.assertEqual(cfg.block_of(4).index(), 2)
+        with self.assertRaises(IndexError):
+            cfg.block_of(5)
+
+
+class TestDominatorsAndLoops(unittest.TestCase):
+    _NESTED = [
+        'LET I 0',  # block 0
+        'OUTER: ADD I 1',  # block 1
+        'LET J 0',
+        'INNER: ADD J 1',  # block 2
+        'GOTO "INNER" IF J < 3',
+        'GOTO "OUTER" IF I < 3',  # block 3
+        'PRINT I',  # block 4
+    ]
+
+    def test_immediate_dominators(self):
+        cfg = _cfg(self._NESTED)
+        self.assertEqual(cfg.immediate_dominators(), [0, 0, 1, 2, 3])
+
+    def test_dominates(self):
+        cfg = _cfg(self._NESTED)
+        self.assertTrue(cfg.dominates(1, 4))
+        self.assertTrue(cfg.dominates(2, 2))
+        self.assertFalse(cfg.dominates(3, 2))
+
+    def test_diamond(self):
+        cfg = _cfg(['GOTO 2 IF X < 1', 'PRINT 1', 'PRINT 2'])
+        # Both the jump and the fallthrough reach the join point
+        self.assertEqual(cfg.immediate_dominators(), [0, 0, 0])
+
+    def test_unreachable_block(self):
+        cfg = _cfg(['GOTO 2', 'PRINT 1', 'END'])
+        self.assertEqual(cfg.immediate_dominators(), [0, None, 0])
+        self.assertFalse(cfg.dominates(0, 1))
+
+    def test_nested_loops(self):
+        loops = _cfg(self._NESTED).loops()
+        self.assertEqual([loop.header() for loop in loops], [1, 2])
+        self.assertEqual(loops[0].blocks(), {1, 2, 3})
+        self.assertEqual(loops[1].blocks(), {2})
+        self.assertEqual(loops[1].back_edges(), [Edge(2, 2, BRANCH)])
+
+    def test_loop_through_subroutine_call(self):
+        loops = _cfg(
+            ['TOP: GOSUB "S"', 'GOTO "TOP" IF X < 3', 'END', 'S: ADD X 1', 'RETURN']
+        ).loops()
+        self.assertEqual(
+            [(loop.header(), loop.blocks()) for loop in loops], [(0, {0, 1})]
+        )
+
+    def test_irreducible_cycle_is_not_a_natural_loop(self):
+        # Lines 2 and 3 form a cycle that can be entered at either of them
+        cfg = _cfg(['GOTO 2 IF X = 1', 'GOTO 2', 'ADD X 1', 'GOTO -1 IF X < 5'])
+        self.assertEqual(cfg.loops(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
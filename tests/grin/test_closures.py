@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import test_execution
+
+import grin.execution as execution
+from grin.closures import build_closures
+from grin.parsing import parse
+from grin.test_utilities import rerun_with_engine
+from grin.utility import GrinRuntimeError
+
+# Every test in test_execution.py, run again on the closure engine
+rerun_with_engine(globals(), test_execution, 'Closures', 'closures')
+
+
+def _run(lines: list[str]) -> list[str]:
+    token_lines = list(parse(lines + ['.']))
+    return execution.execute(token_lines, input_func=str, engine='closures')
+
+
+class TestBuildClosures(unittest.TestCase):
+    def test_one_closure_per_line(self):
+        token_lines = list(parse(['L: PRINT 1', 'PRINT 2', 'GOTO "L"', '.']))
+        closures = build_closures(
+            token_lines, execution._build_goto_labels(token_lines), {}
+        )
+        self.assertEqual(len(closures), 3)
+
+    def test_bad_static_target_only_raises_when_taken(self):
+        out = _run(['GOTO 0 IF 1 > 2', 'GOTO "MISSING" IF 1 > 2', 'PRINT "OK"'])
+        self.assertEqual(out, ['OK'])
+
+    def test_bad_static_target_raises_when_taken(self):
+        with self.assertRaises(GrinRuntimeError):
+            _run(['GOTO "MISSING" IF 1 < 2'])
+
+    def test_constant_comparison_error_raises_when_reached(self):
+        with self.assertRaises(GrinRuntimeError):
+            _run(['GOTO 2 IF 1 < "A"', 'PRINT 1'])
+
+    def test_loop_with_mixed_operand_kinds(self):
+        out = _run(
+            [
+                'LET I 0',
+                'LET S ""',
+                'LET F 0.5',
+                'ADD I 1',
+                'ADD S "x"',
+                'MULT F 2',
+                'GOTO -3 IF I < 3',
+                'PRINT I',
+                'PRINT S',
+                'PRINT F',
+            ]
+        )
+        self.assertEqual(out, ['3', 'xxx', '4.0'])
+
+    def test_unknown_engine_is_rejected(self):
+        with self.assertRaises(ValueError):
+            execution.compile(list(parse(['PRINT 1', '.'])), engine='nope')
+
+
+if __name__ == '__main__':
+    unittest.main()
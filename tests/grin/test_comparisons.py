@@ -2,7 +2,14 @@
 
 import unittest
 
-from grin.utility import compare_values, GrinRuntimeError, value_from_token
+import operator
+
+from grin.utility import (
+    COMPARISON_TABLE,
+    GrinRuntimeError,
+    compare_values,
+    value_from_token,
+)
 from grin.token import GrinToken, GrinTokenKind
 from grin.program_state import ProgramState
 from grin.test_utilities import make_state
@@ -60,8 +67,23 @@ class TestCompareValues(unittest.TestCase):
         with self.assertRaises(GrinRuntimeError):
             compare_values('Boo', GrinTokenKind.LESS_THAN, 3.0)
 
+    # Exact comparisons
+    def test_huge_ints_compare_exactly(self):
+        self.assertTrue(compare_values(2**53 + 1, GrinTokenKind.GREATER_THAN, 2**53))
+        self.assertFalse(compare_values(2**53 + 1, GrinTokenKind.EQUAL, 2**53))
+
+    def test_int_too_big_for_float_compares_with_float(self):
+        self.assertTrue(compare_values(10**400, GrinTokenKind.GREATER_THAN, 1.5))
+
+    def test_table_maps_types_and_operator_to_function(self):
+        self.assertIs(
+            COMPARISON_TABLE[(int, GrinTokenKind.LESS_THAN, float)], operator.lt
+        )
+        self.assertNotIn((int, GrinTokenKind.LESS_THAN, str), COMPARISON_TABLE)
+
     def test_invalid_operator(self):
-        # If your helper assumes only relational ops, this might be AssertionError instead.
+        # If your helper assumes only relational ops, this might be
+        # AssertionError instead.
         with self.assertRaises(GrinRuntimeError):
             compare_values(3, None, 4)
 
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import grin.execution as execution
+from grin.constants import (
+    COMBINED_LETS,
+    CONSTANT_ARITHMETIC,
+    CONSTANT_CONDITIONS,
+    PROPAGATED_CONSTANTS,
+    propagate_constants,
+)
+from grin.parsing import parse
+from grin.statements import (
+    AddStatement,
+    ConstantLetsStatement,
+    DivStatement,
+    GoSubStatement,
+    GoToStatement,
+    LetStatement,
+    NopStatement,
+    PrintStatement,
+)
+from grin.token import GrinTokenKind
+from grin.utility import GrinRuntimeError
+
+
+def _statements(lines: list[str]):
+    token_lines = list(parse(lines + ['.']))
+    statements = execution._build_statements(token_lines)
+    execution._resolve_static_targets(
+        statements, execution._build_goto_labels(token_lines)
+    )
+    return statements
+
+
+def _run(lines: list[str], optimize: bool, inputs=()):
+    program = execution.compile(list(parse(lines + ['.'])), optimize=optimize)
+    feed = iter(inputs)
+    return program.run(lambda: next(feed)), program.optimization_report()
+
+
+class TestPropagateConstants(unittest.TestCase):
+    def test_initialization_is_folded_into_one_stretch(self):
+        statements = _statements(['LET A 5', 'MULT A 3', 'ADD A 2', 'PRINT A'])
+        propagated, report = propagate_constants(statements)
+        self.assertIsInstance(propagated[0], ConstantLetsStatement)
+        self.assertEqual(propagated[0].values(), {'A': 17})
+        self.assertEqual(propagated[1].value_token().value(), 15)
+        self.assertEqual(propagated[2].value_token().value(), 17)
+        self.assertIsInstance(propagated[3], PrintStatement)
+        self.assertEqual(propagated[3].value_token().value(), 17)
+        self.assertEqual(report[CONSTANT_ARITHMETIC], 2)
+        self.assertEqual(report[PROPAGATED_CONSTANTS], 1)
+        self.assertEqual(report[COMBINED_LETS], 3)
+
+    def test_variables_start_as_zero(self):
+        propagated, _ = propagate_constants(_statements(['ADD A 4', 'PRINT A']))
+        self.assertIsInstance(propagated[0], LetStatement)
+        self.assertEqual(propagated[1].value_token().value(), 4)
+
+    def test_types_are_kept(self):
+        propagated, _ = propagate_constants(
+            _statements(['LET A 1.5', 'ADD A 1', 'LET S "ab"', 'MULT S 2'])
+        )
+        values = propagated[0].values()
+        self.assertEqual(values, {'A': 2.5, 'S': 'abab'})
+        self.assertIs(type(values['A']), float)
+        self.assertEqual(
+            propagated[3].value_token().kind(), GrinTokenKind.LITERAL_STRING
+        )
+
+    def test_zeroes_of_either_sign_are_told_apart(self):
+        propagated, _ = propagate_constants(
+            _statements(
+                ['INNUM X', 'LET A 0.0', 'GOTO 2 IF X > 0', 'LET A -0.0', 'PRINT A']
+            )
+        )
+        self.assertEqual(propagated[4].value_token().kind(), GrinTokenKind.IDENTIFIER)
+
+    def test_constant_conditions(self):
+        statements = _statements(
+            [
+                'GOTO 2 IF 4 < 3',
+                'GOSUB 2 IF "a" < "b"',
+                'END',
+                'LET X 1',
+                'GOTO -1 IF X = 1',
+            ]
+        )
+        propagated, report = propagate_constants(statements)
+        self.assertIsInstance(propagated[0], NopStatement)
+        self.assertIsInstance(propagated[1], GoSubStatement)
+        self.assertIsNone(propagated[1].condition())
+        self.assertEqual(propagated[1].static_destination(), 3)
+        self.assertIsInstance(propagated[4], GoToStatement)
+        self.assertIsNone(propagated[4].condition())
+        self.assertEqual(propagated[4].static_destination(), 3)
+        self.assertEqual(report[CONSTANT_CONDITIONS], 3)
+
+    def test_failing_operations_are_left_in_place(self):
+        statements = _statements(
+            ['LET A 1', 'DIV A 0', 'LET S "a"', 'SUB S 1', 'GOTO 1 IF S < 1', 'END']
+        )
+        propagated, report = propagate_constants(statements)
+        self.assertIsInstance(propagated[1], DivStatement)
+        self.assertIs(propagated[3], statements[3])
+        self.assertIs(propagated[4], statements[4])
+        self.assertEqual(report[CONSTANT_ARITHMETIC], 0)
+
+    def test_values_that_differ_by_path_are_not_constant(self):
+        statements = _statements(
+            ['INNUM N', 'LET A 1', 'GOTO 2 IF N > 0', 'LET A 2', 'ADD A 1', 'PRINT A']
+        )
+        propagated, report = propagate_constants(statements)
+        self.assertIsInstance(propagated[4], AddStatement)
+        self.assertIs(propagated[5], statements[5])
+        self.assertEqual(report[CONSTANT_ARITHMETIC], 0)
+
+    def test_loop_variables_are_not_constant(self):
+        statements = _statements(['LET I 0', 'ADD I 1', 'GOTO -1 IF I < 5', 'PRINT I'])
+        propagated, report = propagate_constants(statements)
+        self.assertIs(propagated[1], statements[1])
+        self.assertIs(propagated[2], statements[2])
+        self.assertEqual(report[CONSTANT_CONDITIONS], 0)
+
+    def test_returns_join_every_call_site(self):
+        statements = _statements(
+            ['LET A 1', 'GOSUB 5', 'PRINT A', 'LET A 2', 'GOSUB 2', 'END', 'RETURN']
+        )
+        propagated, _ = propagate_constants(statements)
+        self.assertIs(propagated[2], statements[2])
+
+    def test_dynamic_jumps_only_allow_literal_conditions(self):
+        statements = _statements(
+            ['LET A 1', 'LET T 2', 'GOTO T', 'PRINT A', 'GOTO 1 IF 1 = 2', 'ADD A 1']
+        )
+        propagated, report = propagate_constants(statements)
+        self.assertIsInstance(propagated[4], NopStatement)
+        self.assertIs(propagated[5], statements[5])
+        self.assertEqual(report[CONSTANT_ARITHMETIC], 0)
+        self.assertEqual(report[PROPAGATED_CONSTANTS], 0)
+
+    def test_huge_values_are_not_folded(self):
+        statements = _statements(['LET S "abc"', 'MULT S 1000000', 'PRINT S'])
+        propagated, _ = propagate_constants(statements)
+        self.assertIs(propagated[1], statements[1])
+
+
+class TestConstantPropagationResults(unittest.TestCase):
+    def assertSameAsInterpreter(self, lines: list[str], inputs=()):
+        expected, _ = _run(lines, optimize=False, inputs=inputs)
+        actual, report = _run(lines, optimize=True, inputs=inputs)
+        self.assertEqual(actual, expected)
+        return report
+
+    def test_initialization_before_a_loop(self):
+        report = self.assertSameAsInterpreter(
+            [
+                'LET A 5',
+                'MULT A 3',
+                'ADD A 2',
+                'LET B A',
+                'DIV B 4',
+                'LOOP: ADD B A',
+                'SUB A 1',
+                'GOTO "LOOP" IF A > 0',
+                'PRINT B',
+            ]
+        )
+        self.assertEqual(report[COMBINED_LETS], 5)
+
+    def test_jumping_into_a_folded_stretch(self):
+        self.assertSameAsInterpreter(
+            ['GOTO 2 IF 1 < 2', 'LET A 5', 'ADD A 3', 'MULT A 2', 'PRINT A']
+        )
+
+    def test_runtime_errors_still_happen(self):
+        for lines in (
+            ['LET A 1', 'DIV A 0'],
+            ['LET A "x"', 'ADD A 1'],
+            ['LET A "x"', 'GOTO 1 IF A < 3', 'END'],
+            ['GOSUB 5 IF 1 = 1'],
+        ):
+            with self.subTest(lines=lines):
+                with self.assertRaises(GrinRuntimeError):
+                    _run(lines, optimize=True)
+
+    def test_input_is_never_constant(self):
+        self.assertSameAsInterpreter(
+            ['LET A 2', 'INNUM A', 'MULT A 3', 'PRINT A'], inputs=['7']
+        )
+
+    def test_gosub_with_constant_condition(self):
+        self.assertSameAsInterpreter(
+            ['LET X 3', 'GOSUB 3 IF X = 3', 'PRINT X', 'END', 'ADD X 1', 'RETURN']
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
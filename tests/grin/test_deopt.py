@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import grin.execution as execution
+from grin.closures import build_closures, run_closures
+from grin.deopt import Deoptimization, DeoptStats, from_program_state, to_program_state
+from grin.parsing import parse
+from grin.program_state import ProgramState
+from grin.slots import assign_slots
+
+
+def _token_lines(lines: list[str]):
+    return list(parse(lines + ['.']))
+
+
+class TestDeoptStats(unittest.TestCase):
+    def test_counts_reasons_and_sites(self):
+        stats = DeoptStats()
+        stats.record(Deoptimization('ADD on int and int', 3))
+        stats.record(Deoptimization('ADD on int and int', 3))
+        stats.record(Deoptimization('SUB on float and int', 7))
+        self.assertEqual(stats.total(), 3)
+        self.assertEqual(
+            stats.as_dict(),
+            {
+                'reasons': {'ADD on int and int': 2, 'SUB on float and int': 1},
+                'sites': {3: 2, 7: 1},
+            },
+        )
+
+
+class TestStateTransfer(unittest.TestCase):
+    def test_round_trip(self):
+        state = ProgramState([])
+        state.ip = 4
+        state.vars = {'X': 1, 'Y': 'a'}
+        state.return_stack = [2]
+        state.output = ['1']
+
+        compiled = from_program_state(state, {'X': 0, 'Y': 1, 'Z': 2})
+        self.assertEqual(compiled.slots, [1, 'a', 0])
+        self.assertEqual(compiled.ip, 4)
+        self.assertIs(compiled.return_stack, state.return_stack)
+
+        compiled.slots[2] = 2.5
+        compiled.ip = 9
+        compiled.output.append('2')
+        to_program_state(compiled, state)
+        self.assertEqual(state.vars, {'X': 1, 'Y': 'a', 'Z': 2.5})
+        self.assertEqual(state.ip, 9)
+        self.assertEqual(state.output, ['1', '2'])
+
+
+class TestSpeculativeClosures(unittest.TestCase):
+    def _run(self, lines: list[str], speculation, values: dict):
+        token_lines = _token_lines(lines)
+        slot_table = assign_slots(token_lines)
+        closures = build_closures(token_lines, {}, slot_table, speculation)
+        state = from_program_state(ProgramState(token_lines), slot_table)
+        state.vars = values
+        run_closures(closures, state)
+        return state
+
+    def test_guard_holds(self):
+        state = self._run(['ADD X Y', 'SUB X 1'], {0: (int, int), 1: (int, int)}, {})
+        self.assertEqual(state.vars['X'], -1)
+
+    def test_guard_fails_before_changing_anything(self):
+        for values in ({'X': 1.5}, {'Y': 'a'}):
+            with self.subTest(values=values):
+                with self.assertRaises(Deoptimization) as raised:
+                    self._run(['LET Z 1', 'ADD X Y'], {1: (int, int)}, values)
+                self.assertEqual(raised.exception.ip, 1)
+                self.assertEqual(raised.exception.reason, 'ADD on int and int')
+
+    def test_literal_operand_only_guards_variable(self):
+        with self.assertRaises(Deoptimization):
+            self._run(['MULT X 2'], {0: (int, int)}, {'X': 'a'})
+
+
+class TestTieredDeoptimization(unittest.TestCase):
+    _LINES = [
+        'LET T 1',
+        'LOOP: ADD S T',
+        'ADD I 1',
+        'GOTO "LOOP" IF I < 5',
+        'GOTO 5 IF J = 1',
+        'LET J 1',
+        'INSTR S',
+        'INSTR T',
+        'GOTO "LOOP"',
+        'PRINT S',
+    ]
+
+    def test_guard_failure_resumes_on_interpreter(self):
+        program = execution.compile(_token_lines(self._LINES), 'tiered')
+        runner = program.tiers()
+        runner.promotion_instructions = 5
+
+        self.assertEqual(program.run(iter(['a', 'b']).__next__), ['ab'])
+        self.assertEqual(runner.deopts.reasons, {'ADD on int and int': 1})
+        self.assertEqual(runner.deopts.sites, {1: 1})
+        self.assertNotIn(1, runner.speculation())
+
+        # The line that deoptimized isn't speculated on again
+        self.assertEqual(program.run(iter(['c', 'd']).__next__), ['cd'])
+        self.assertEqual(runner.deopts.total(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
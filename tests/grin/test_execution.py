@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 
+import sys
+import threading
 import unittest
 import grin.execution as execution
+import grin.statements as statements
+from grin.program_state import ProgramState
 from grin.parsing import parse
 from grin.utility import GrinRuntimeError
-from typing import Iterator
+from typing import Callable, Iterator
+from unittest import mock
 
 
 class TestExecutionStarterIndex(unittest.TestCase):
@@ -30,6 +35,21 @@ def _iter(iterator: Iterator):
     return closure
 
 
+def _in_threads(target: Callable, arguments: list[tuple]) -> None:
+    """Calls target with each of the arguments at once, one thread each"""
+    threads = [threading.Thread(target=target, args=args) for args in arguments]
+    # Switching threads often makes them interleave mid-statement
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+
 def _run_grin(program_text: str, inputs: list[str] | None = None) -> list[str]:
     raw_lines = program_text.splitlines()
     token_lines = list(parse(raw_lines))
@@ -225,6 +245,16 @@ class TestGoto(unittest.TestCase):
         out = _run_grin('LET A 5\nGOTO 2 IF A < 4\nPRINT "NO"\nPRINT "YES"\n.\n')
         self.assertEqual(out, ['NO', 'YES'])
 
+    def test_goto_if_compares_huge_ints_exactly(self):
+        out = _run_grin(
+            'LET A 9007199254740993\nGOTO 2 IF A = 9007199254740992\nPRINT "NE"\n.\n'
+        )
+        self.assertEqual(out, ['NE'])
+
+    def test_goto_if_literal_operands(self):
+        out = _run_grin('GOTO 2 IF 2 > 1.5\nPRINT "NO"\nPRINT "YES"\n.\n')
+        self.assertEqual(out, ['YES'])
+
     # Runtime errors
     def test_goto_zero_is_error(self):
         with self.assertRaises(GrinRuntimeError):
@@ -346,5 +376,311 @@ class TestInnumStatement(unittest.TestCase):
             _run_grin('INNUM X\nPRINT X\n.\n', inputs=['3.4.5'])
 
 
+class TestCompiledProgram(unittest.TestCase):
+    def test_run_returns_output(self):
+        program = execution.compile(list(parse(['LET A 5', 'PRINT A', '.'])))
+        self.assertEqual(program.run(_empty_str), ['5'])
+
+    def test_runs_are_independent(self):
+        program = execution.compile(list(parse(['INNUM A', 'ADD B A', 'PRINT B', '.'])))
+        self.assertEqual(program.run(_iter(iter(['3']))), ['3'])
+        self.assertEqual(program.run(_iter(iter(['4']))), ['4'])
+
+    def test_output_func_called_per_run(self):
+        program = execution.compile(list(parse(['PRINT "HI"', '.'])))
+        output: list[str] = []
+        program.run(_empty_str, output.append)
+        program.run(_empty_str, output.append)
+        self.assertEqual(output, ['HI', 'HI'])
+
+    def test_statements_and_labels_are_built_once(self):
+        program = execution.compile(list(parse(['L: PRINT 1', 'GOTO "L"', '.'])))
+        self.assertEqual(len(program.statements()), 2)
+        self.assertEqual(program.line_count(), 2)
+        self.assertEqual(dict(program.goto_labels()), {'L': 0})
+
+    def test_goto_labels_are_read_only(self):
+        program = execution.compile(list(parse(['L: PRINT 1', '.'])))
+        with self.assertRaises(TypeError):
+            program.goto_labels()['M'] = 1
+
+    def test_runtime_error_leaves_program_reusable(self):
+        program = execution.compile(list(parse(['INNUM A', 'DIV B A', '.'])))
+        with self.assertRaises(GrinRuntimeError):
+            program.run(_iter(iter(['0'])))
+        self.assertEqual(program.run(_iter(iter(['2']))), [])
+
+
+class TestStaticJumpTargets(unittest.TestCase):
+    def _statements(self, lines: list[str]):
+        return execution.compile(list(parse(lines + ['.']))).statements()
+
+    def _run(self, lines: list[str]) -> list[str]:
+        return execution.compile(list(parse(lines + ['.']))).run(_empty_str)
+
+    def test_literal_targets_resolved_at_load(self):
+        statements = self._statements(['L: PRINT 1', 'GOTO "L"', 'GOSUB -1', 'GOTO 1'])
+        state = ProgramState([])
+        self.assertEqual(statements[1].destination(state), 0)
+        self.assertEqual(statements[2].destination(state), 1)
+        self.assertEqual(statements[3].destination(state), 4)
+
+    def test_literal_targets_skip_runtime_resolution(self):
+        with mock.patch.object(statements, 'resolve_jump_target') as resolve:
+            out = self._run(['LET A 3', 'SUB A 1', 'GOTO -1 IF A > 0', 'PRINT A'])
+        resolve.assert_not_called()
+        self.assertEqual(out, ['0'])
+
+    def test_identifier_targets_resolved_at_runtime(self):
+        with mock.patch.object(
+            statements, 'resolve_jump_target', wraps=statements.resolve_jump_target
+        ) as resolve:
+            out = self._run(['LET T 2', 'GOTO T', 'PRINT "NO"', 'PRINT "YES"'])
+        resolve.assert_called_once()
+        self.assertEqual(out, ['YES'])
+
+    def test_invalid_literal_target_only_raises_when_taken(self):
+        out = _run_grin('GOTO 0 IF 1 > 2\nGOTO "NOWHERE" IF 1 > 2\nPRINT "OK"\n.\n')
+        self.assertEqual(out, ['OK'])
+
+    def test_invalid_literal_target_raises_every_time_taken(self):
+        program = execution.compile(list(parse(['GOTO 5', '.'])))
+        for _ in range(2):
+            with self.assertRaises(GrinRuntimeError):
+                program.run(_empty_str)
+
+
+class TestJumpInlineCache(unittest.TestCase):
+    def test_repeated_target_hits_cache(self):
+        program = execution.compile(
+            list(
+                parse(
+                    [
+                        'LET T "BODY"',
+                        'LET I 0',
+                        'LOOP: GOTO T',
+                        'PRINT "NO"',
+                        'BODY: ADD I 1',
+                        'GOTO "LOOP" IF I < 4',
+                        '.',
+                    ]
+                )
+            )
+        )
+        with mock.patch.object(
+            statements, 'resolve_jump_target', wraps=statements.resolve_jump_target
+        ) as resolve:
+            program.run(_empty_str)
+        self.assertEqual(resolve.call_count, 1)
+        self.assertEqual(program.inline_cache_stats(), {2: (3, 1)})
+
+    def test_polymorphic_targets(self):
+        program = execution.compile(
+            list(
+                parse(
+                    [
+                        'LET I 0',
+                        'LOOP: ADD I 1',
+                        'LET T "A"',
+                        'GOTO 2 IF I > 2',
+                        'LET T 3',
+                        'GOTO T',
+                        'PRINT "NO"',
+                        'END',
+                        'A: PRINT I',
+                        'GOTO "LOOP" IF I < 5',
+                        '.',
+                    ]
+                )
+            )
+        )
+        self.assertEqual(program.run(_empty_str), ['1', '2', '3', '4', '5'])
+        self.assertEqual(program.inline_cache_stats(), {5: (3, 2)})
+
+    def test_cache_distinguishes_int_and_float_targets(self):
+        program = execution.compile(
+            list(
+                parse(
+                    [
+                        'INNUM T',
+                        'GOTO T',
+                        'PRINT "NO"',
+                        'PRINT "YES"',
+                        '.',
+                    ]
+                )
+            )
+        )
+        self.assertEqual(program.run(_iter(iter(['2']))), ['YES'])
+        with self.assertRaises(GrinRuntimeError):
+            program.run(_iter(iter(['2.0'])))
+
+    def test_cache_forgets_oldest_target(self):
+        program = execution.compile(
+            list(
+                parse(
+                    [
+                        'LET I 0',
+                        'LOOP: ADD I 1',
+                        'LET T I',
+                        'ADD T 1',
+                        'GOTO T',
+                        'GOTO "LOOP" IF I < 6',
+                        'GOTO "LOOP" IF I < 6',
+                        'GOTO "LOOP" IF I < 6',
+                        'GOTO "LOOP" IF I < 6',
+                        'GOTO "LOOP" IF I < 6',
+                        'GOTO "LOOP" IF I < 6',
+                        'GOTO "LOOP" IF I < 6',
+                        '.',
+                    ]
+                )
+            )
+        )
+        program.run(_empty_str)
+        jump = program.statements()[4]
+        self.assertEqual((jump.cache_hits, jump.cache_misses), (0, 6))
+        self.assertEqual(len(jump._inline_cache), statements.INLINE_CACHE_SIZE)
+
+    def test_runs_from_many_threads(self):
+        lines = ['INNUM T', 'GOTO T'] + [f'PRINT {k}' for k in range(10)]
+        program = execution.compile(list(parse(lines + ['.'])))
+        failures = []
+
+        def run(offset: int):
+            for trip in range(300):
+                k = (trip + offset) % 10
+                try:
+                    out = program.run(lambda: str(k + 1))
+                except Exception as error:
+                    failures.append(error)
+                    return
+                if out != [str(j) for j in range(k, 10)]:
+                    failures.append(out)
+
+        _in_threads(run, [(offset,) for offset in range(6)])
+        self.assertEqual(failures, [])
+
+
+class TestSharedStatements(unittest.TestCase):
+    def _statements(self, lines: list[str], **kwargs):
+        return execution._build_statements(list(parse(lines + ['.'])), **kwargs)
+
+    def test_lines_written_the_same_way_share_a_statement(self):
+        built = self._statements(
+            ['ADD A 1', 'PRINT A', 'L: ADD A 1', 'PRINT A', 'RETURN', 'RETURN']
+        )
+        self.assertIs(built[0], built[2])
+        self.assertIs(built[1], built[3])
+        self.assertIs(built[4], built[5])
+        self.assertEqual(len(set(map(id, built))), 3)
+
+    def test_lines_written_differently_do_not(self):
+        built = self._statements(
+            ['ADD A 1', 'ADD A 1.0', 'ADD B 1', 'SUB A 1', 'PRINT "A"', 'PRINT A']
+        )
+        self.assertEqual(len(set(map(id, built))), 6)
+
+    def test_jumps_are_never_shared(self):
+        built = self._statements(['GOTO 2', 'GOTO 2', 'GOSUB 1', 'GOSUB 1', 'END'])
+        self.assertEqual(len(set(map(id, built))), 5)
+
+    def test_not_shared_unless_asked(self):
+        built = self._statements(['PRINT 1', 'PRINT 1'], share=False)
+        self.assertIsNot(built[0], built[1])
+
+    def test_shared_lines_seeing_different_types(self):
+        lines = ['LET A 1', 'ADD A 1', 'PRINT A', 'LET A 1.5', 'ADD A 1', 'PRINT A']
+        for engine in execution.ENGINES:
+            with self.subTest(engine=engine):
+                program = execution.compile(list(parse(lines + ['.'])), engine)
+                self.assertEqual(program.run(_empty_str), ['2', '2.5'])
+
+    def test_lazily_built_lines_are_shared(self):
+        program = execution.compile(list(parse(['PRINT 1', 'PRINT 1', '.'])), lazy=True)
+        program.run(_empty_str)
+        built = program.statements()
+        self.assertIsInstance(built[0], statements.PrintStatement)
+        self.assertIs(built[0], built[1])
+
+
+class TestQuickenedArithmetic(unittest.TestCase):
+    def _compile(self, lines: list[str]):
+        return execution.compile(list(parse(lines + ['.'])))
+
+    def test_statement_specializes_to_observed_types(self):
+        program = self._compile(['LET A 1', 'ADD A 2', 'LET S "a"', 'ADD S "b"'])
+        program.run(_empty_str)
+        self.assertEqual(program.statements()[1].specialization(), (int, int))
+        self.assertEqual(program.statements()[3].specialization(), (str, str))
+
+    def test_mixed_types_stay_generic(self):
+        program = self._compile(['LET A 1', 'ADD A 2.5'])
+        program.run(_empty_str)
+        self.assertIsNone(program.statements()[1].specialization())
+
+    def test_guard_failure_falls_back_to_generic(self):
+        program = self._compile(['INNUM A', 'MULT A 2', 'PRINT A'])
+        self.assertEqual(program.run(_iter(iter(['3']))), ['6'])
+        self.assertEqual(program.run(_iter(iter(['1.5']))), ['3.0'])
+        self.assertIsNone(program.statements()[1].specialization())
+
+    def test_guard_failure_still_raises_runtime_errors(self):
+        program = self._compile(['INSTR A', 'SUB A 1', 'PRINT A'])
+        with self.assertRaises(GrinRuntimeError):
+            program.run(_iter(iter(['x'])))
+
+    def test_quickened_int_division(self):
+        program = self._compile(['INNUM A', 'DIV A 2', 'PRINT A'])
+        self.assertEqual(program.run(_iter(iter(['-7']))), ['-3'])
+        self.assertEqual(program.statements()[1].specialization(), (int, int))
+        self.assertEqual(program.run(_iter(iter(['-9']))), ['-4'])
+
+    def test_quickened_division_by_zero(self):
+        program = self._compile(['INNUM A', 'INNUM B', 'DIV A B'])
+        program.run(_iter(iter(['4', '2'])))
+        with self.assertRaises(GrinRuntimeError):
+            program.run(_iter(iter(['4', '0'])))
+
+    def test_large_int_division_is_exact(self):
+        out = _run_grin('LET A 100000000000000000000000000001\nDIV A 1\nPRINT A\n.\n')
+        self.assertEqual(out, ['100000000000000000000000000001'])
+
+    def test_unquickened_by_another_run_partway(self):
+        program = self._compile(['LET A 1', 'ADD A 2'])
+        program.run(_empty_str)
+        statement = program.statements()[1]
+        quickened = statement.execute
+        statement.unquicken()
+        state = ProgramState([])
+        state.vars['A'] = 1.5
+        quickened(state)
+        self.assertEqual(state.vars['A'], 3.5)
+
+    def test_runs_from_many_threads(self):
+        program = self._compile(['INNUM A', 'MULT A 2', 'ADD A 1', 'PRINT A'])
+        failures = []
+
+        def run(value: str, expected: str):
+            for _ in range(300):
+                try:
+                    out = program.run(lambda: value)
+                except Exception as error:
+                    failures.append(error)
+                    return
+                if out != [expected]:
+                    failures.append(out)
+
+        _in_threads(run, [('3', '7'), ('1.5', '4.0')] * 3)
+        self.assertEqual(failures, [])
+
+    def test_stops_quickening_after_repeated_guard_failures(self):
+        program = self._compile(['INNUM A', 'ADD A 1'])
+        for value in ['1', '1.5'] * statements.QUICKEN_LIMIT:
+            program.run(_iter(iter([value])))
+        program.run(_iter(iter(['1'])))
+        self.assertIsNone(program.statements()[1].specialization())
+
+
 if __name__ == '__main__':
     unittest.main()
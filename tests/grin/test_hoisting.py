@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import grin.execution as execution
+from grin.cfg import build_cfg
+from grin.hoisting import HOISTED_STATEMENTS, hoist_loop_invariants
+from grin.loops import CLOSED_FORM_LOOPS
+from grin.parsing import parse
+from grin.utility import GrinRuntimeError
+
+
+def _hoist(lines: list[str]):
+    token_lines = list(parse(lines + ['.']))
+    goto_labels = execution._build_goto_labels(token_lines)
+    statements = execution._build_statements(token_lines)
+    execution._resolve_static_targets(statements, goto_labels)
+    hoisted, report = hoist_loop_invariants(
+        statements, build_cfg(token_lines, goto_labels)
+    )
+    return statements, hoisted, report[HOISTED_STATEMENTS]
+
+
+def _run(lines: list[str], optimize: bool, engine: str = 'statements'):
+    program = execution.compile(list(parse(lines + ['.'])), engine, optimize=optimize)
+    return program.run(), program.optimization_report()
+
+
+class TestHoistLoopInvariants(unittest.TestCase):
+    def test_invariant_computation_is_hoisted(self):
+        statements, hoisted, count = _hoist(
+            [
+                'LET N 5',
+                'LOOP: LET LIMIT N',
+                'MULT LIMIT 2',
+                'ADD I 1',
+                'GOTO "LOOP" IF I < LIMIT',
+                'PRINT I',
+            ]
+        )
+        self.assertEqual(count, 2)
+        self.assertEqual(hoisted, statements)
+        self.assertEqual(hoisted[4].static_destination(), 3)
+
+    def test_invariants_are_moved_ahead_of_other_lines(self):
+        statements, hoisted, count = _hoist(
+            ['LOOP: ADD I 1', 'LET K 7', 'PRINT I', 'LET M K', 'GOTO "LOOP" IF I < 3']
+        )
+        self.assertEqual(count, 2)
+        self.assertEqual(
+            hoisted,
+            [statements[1], statements[3], statements[0], statements[2]]
+            + [statements[4]],
+        )
+        self.assertEqual(hoisted[4].static_destination(), 2)
+
+    def test_variants_are_not_hoisted(self):
+        for body in (
+            ['ADD C 1'],
+            ['LET A I'],
+            ['LET A B', 'LET B 1'],
+            ['LET A 1', 'GOTO 1 IF I > 1', 'ADD A 1'],
+            ['LET A 1', 'INNUM A'],
+        ):
+            with self.subTest(body=body):
+                _, _, count = _hoist(
+                    ['TOP: ADD I 1'] + body + ['GOTO "TOP" IF I < 3', 'PRINT A']
+                )
+                self.assertEqual(count, 0)
+
+    def test_arithmetic_is_not_moved_ahead_of_what_could_fail_or_print(self):
+        for first in ('PRINT I', 'DIV I 1', 'INNUM J'):
+            with self.subTest(first=first):
+                _, _, count = _hoist(
+                    [f'TOP: {first}', 'LET L 3', 'MULT L 2', 'ADD I 1']
+                    + ['GOTO "TOP" IF I < L']
+                )
+                self.assertEqual(count, 0)
+
+    def test_loops_with_subroutines_are_left_alone(self):
+        _, _, count = _hoist(
+            [
+                'TOP: LET A 1',
+                'GOSUB 3',
+                'GOTO "TOP" IF I < 3',
+                'END',
+                'ADD I 1',
+                'RETURN',
+            ]
+        )
+        self.assertEqual(count, 0)
+
+    def test_dynamic_jumps_leave_every_loop_alone(self):
+        _, _, count = _hoist(
+            ['LET T 1', 'TOP: LET A 1', 'ADD I 1', 'GOTO "TOP" IF I < 3', 'GOTO T']
+        )
+        self.assertEqual(count, 0)
+
+
+class TestHoistedResults(unittest.TestCase):
+    def assertSameAsInterpreter(self, lines: list[str]):
+        expected, _ = _run(lines, optimize=False)
+        actual, report = _run(lines, optimize=True)
+        self.assertEqual(actual, expected)
+        return report
+
+    def test_hoisting_lets_the_loop_run_in_closed_form(self):
+        report = self.assertSameAsInterpreter(
+            [
+                'LET N 500',
+                'LOOP: LET LIMIT N',
+                'MULT LIMIT 2',
+                'ADD I 1',
+                'GOTO "LOOP" IF I < LIMIT',
+                'PRINT I',
+                'PRINT LIMIT',
+            ]
+        )
+        self.assertEqual(report[HOISTED_STATEMENTS], 2)
+        self.assertEqual(report[CLOSED_FORM_LOOPS], 1)
+
+    def test_inner_loop_invariants_run_on_every_entry(self):
+        report = self.assertSameAsInterpreter(
+            [
+                'OUTER: ADD J 1',
+                'LET I 0',
+                'INNER: LET STEP J',
+                'MULT STEP 3',
+                'ADD S STEP',
+                'ADD I 1',
+                'GOTO "INNER" IF I < 4',
+                'GOTO "OUTER" IF J < 5',
+                'PRINT S',
+            ]
+        )
+        self.assertEqual(report[HOISTED_STATEMENTS], 2)
+
+    def test_failing_invariant_fails_on_the_first_trip(self):
+        lines = ['LET Z 0', 'TOP: LET A 1', 'DIV A Z', 'ADD I 1', 'GOTO "TOP" IF I < 3']
+        with self.assertRaises(GrinRuntimeError):
+            _run(lines, optimize=True)
+
+    def test_loop_left_through_its_header_block(self):
+        self.assertSameAsInterpreter(
+            [
+                'TOP: LET A 2',
+                'MULT A 5',
+                'ADD I A',
+                'GOTO 2 IF I > 30',
+                'GOTO "TOP"',
+                'PRINT I',
+                'PRINT A',
+            ]
+        )
+
+    def test_tiered_engine_keeps_loops_as_written(self):
+        # It can switch to closures of the program as written just after the
+        # loop's back edge, which would skip line 0 if it had been hoisted
+        # past
+        lines = ['LOOP: ADD I 1', 'LET K 7', 'PRINT I', 'LET M K']
+        lines += ['GOTO "LOOP" IF I < 300']
+        expected, _ = _run(lines, optimize=False)
+        actual, report = _run(lines, optimize=True, engine='tiered')
+        self.assertEqual(actual, expected)
+        self.assertEqual(report[HOISTED_STATEMENTS], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import grin.execution as execution
+from grin.hoisting import HOISTED_STATEMENTS
+from grin.inlining import INLINED_CALLS, MAX_INLINED_STATEMENTS, inline_subroutines
+from grin.parsing import parse
+from grin.statements import GoSubStatement, InlinedCallStatement
+from grin.utility import GrinRuntimeError
+
+
+def _inline(lines: list[str]):
+    token_lines = list(parse(lines + ['.']))
+    statements = execution._build_statements(token_lines)
+    execution._resolve_static_targets(
+        statements, execution._build_goto_labels(token_lines)
+    )
+    inlined, report = inline_subroutines(statements)
+    return statements, inlined, report[INLINED_CALLS]
+
+
+def _run(lines: list[str], optimize: bool, engine: str = 'statements'):
+    program = execution.compile(list(parse(lines + ['.'])), engine, optimize=optimize)
+    return program.run(), program
+
+
+class TestInlineSubroutines(unittest.TestCase):
+    def test_short_subroutine_is_inlined_at_every_call(self):
+        statements, inlined, count = _inline(
+            [
+                'GOSUB "DOUBLE"',
+                'GOSUB "DOUBLE"',
+                'END',
+                'DOUBLE: MULT A 2',
+                'ADD A 1',
+                'RETURN',
+            ]
+        )
+        self.assertEqual(count, 2)
+        for call in inlined[:2]:
+            self.assertIsInstance(call, InlinedCallStatement)
+            self.assertEqual(len(call.body()), 2)
+        # Each call has its own copies, and the subroutine keeps its lines
+        self.assertIsNot(inlined[0].body()[0], inlined[1].body()[0])
+        self.assertIsNot(inlined[0].body()[0], statements[3])
+        self.assertEqual(inlined[2:], statements[2:])
+
+    def test_subroutines_that_are_not_inlined(self):
+        for subroutine in (
+            ['GOTO 2', 'LET A 1', 'RETURN'],
+            ['GOSUB -2', 'RETURN'],
+            ['LET A 1', 'END'],
+            ['LET A 1'],
+            ['ADD A 1'] * (MAX_INLINED_STATEMENTS + 1) + ['RETURN'],
+        ):
+            with self.subTest(subroutine=subroutine):
+                _, _, count = _inline(['GOSUB 2', 'END'] + subroutine)
+                self.assertEqual(count, 0)
+
+    def test_only_unconditional_static_calls_are_inlined(self):
+        statements, inlined, count = _inline(
+            ['LET T 4', 'GOSUB T', 'GOSUB 2 IF T > 1', 'END', 'PRINT T', 'RETURN']
+        )
+        self.assertEqual(count, 0)
+        self.assertEqual(inlined, statements)
+
+    def test_longest_subroutine_that_is_inlined(self):
+        _, inlined, count = _inline(
+            ['GOSUB 2', 'END'] + ['ADD A 1'] * MAX_INLINED_STATEMENTS + ['RETURN']
+        )
+        self.assertEqual(count, 1)
+        self.assertEqual(len(inlined[0].body()), MAX_INLINED_STATEMENTS)
+
+    def test_call_to_a_bare_return(self):
+        _, inlined, count = _inline(['GOSUB 2', 'PRINT 1', 'RETURN'])
+        self.assertEqual(count, 1)
+        self.assertEqual(inlined[0].body(), ())
+
+
+class TestInlinedResults(unittest.TestCase):
+    def assertSameAsInterpreter(self, lines: list[str], engine: str = 'statements'):
+        expected, _ = _run(lines, optimize=False)
+        actual, program = _run(lines, optimize=True, engine=engine)
+        self.assertEqual(actual, expected)
+        return program
+
+    def test_helper_called_in_a_loop(self):
+        lines = [
+            'TOP: GOSUB "SQUARE"',
+            'ADD S Q',
+            'ADD I 1',
+            'GOTO "TOP" IF I < 200',
+            'PRINT S',
+            'END',
+            'SQUARE: LET Q I',
+            'MULT Q I',
+            'RETURN',
+        ]
+        program = self.assertSameAsInterpreter(lines)
+        self.assertEqual(program.optimization_report()[INLINED_CALLS], 1)
+
+        program = self.assertSameAsInterpreter(lines, 'tracing')
+        self.assertEqual(program.tracer().stats().aborted, {})
+        self.assertEqual(len(program.tracer().traces()), 1)
+
+    def test_dynamic_callers_still_reach_the_subroutine(self):
+        program = self.assertSameAsInterpreter(
+            [
+                'LET T "HELPER"',
+                'GOSUB "HELPER"',
+                'GOSUB T',
+                'PRINT A',
+                'END',
+                'HELPER: ADD A 3',
+                'RETURN',
+            ]
+        )
+        self.assertEqual(program.optimization_report()[INLINED_CALLS], 1)
+
+    def test_subroutine_entered_from_its_own_caller(self):
+        # The call falls into the subroutine once it comes back, which then
+        # returns with nothing to return to
+        with self.assertRaises(GrinRuntimeError):
+            _run(['GOSUB 1', 'ADD A 1', 'RETURN'], optimize=True)
+
+    def test_calls_no_longer_stop_loop_invariants_from_being_hoisted(self):
+        program = self.assertSameAsInterpreter(
+            [
+                'TOP: LET K 10',
+                'GOSUB "BUMP"',
+                'ADD I 1',
+                'GOTO "TOP" IF I < K',
+                'PRINT S',
+                'END',
+                'BUMP: ADD S I',
+                'RETURN',
+            ]
+        )
+        self.assertEqual(program.optimization_report()[HOISTED_STATEMENTS], 1)
+
+    def test_failing_subroutine_fails_the_call(self):
+        with self.assertRaises(GrinRuntimeError):
+            _run(['GOSUB 2', 'END', 'DIV A 0', 'RETURN'], optimize=True)
+
+    def test_tiered_engine_keeps_calls(self):
+        _, program = _run(['GOSUB 2', 'END', 'PRINT 1', 'RETURN'], True, 'tiered')
+        self.assertIsInstance(program.statements()[0], GoSubStatement)
+        self.assertEqual(program.optimization_report()[INLINED_CALLS], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import grin.execution as execution
+from grin.jumps import SKIPPED_GOTOS, UNREACHABLE_LINES, drop_unreachable, thread_jumps
+from grin.parsing import parse
+from grin.statements import UnreachableStatement
+
+
+def _statements(lines: list[str]):
+    token_lines = list(parse(lines + ['.']))
+    statements = execution._build_statements(token_lines)
+    execution._resolve_static_targets(
+        statements, execution._build_goto_labels(token_lines)
+    )
+    return statements
+
+
+def _run(lines: list[str], optimize: bool):
+    program = execution.compile(list(parse(lines + ['.'])), optimize=optimize)
+    return program.run(), program.optimization_report()
+
+
+class TestThreadJumps(unittest.TestCase):
+    def test_chain_of_gotos_is_threaded(self):
+        statements = _statements(
+            ['GOTO 2', 'END', 'GOTO "A"', 'END', 'A: GOTO 2', 'END', 'PRINT 1']
+        )
+        threaded, report = thread_jumps(statements)
+        self.assertEqual(threaded[0].static_destination(), 6)
+        self.assertEqual(threaded[2].static_destination(), 6)
+        self.assertEqual(report, {SKIPPED_GOTOS: 3})
+
+    def test_conditional_gotos_and_gosubs_are_threaded_but_not_through(self):
+        statements = _statements(
+            ['GOSUB 2 IF X = 0', 'END', 'GOTO 1', 'GOTO 1 IF X = 1', 'RETURN']
+        )
+        threaded, report = thread_jumps(statements)
+        self.assertEqual(threaded[0].static_destination(), 3)
+        self.assertEqual(threaded[3].static_destination(), 4)
+        self.assertEqual(report[SKIPPED_GOTOS], 1)
+
+    def test_chain_ending_in_a_bad_target_is_left_to_fail(self):
+        statements = _statements(['GOTO 1', 'GOTO 5', 'END'])
+        threaded, report = thread_jumps(statements)
+        self.assertEqual(threaded[0].static_destination(), 1)
+        self.assertEqual(report[SKIPPED_GOTOS], 0)
+
+    def test_endless_chain_is_left_alone(self):
+        statements = _statements(['GOTO 1', 'GOTO 1', 'GOTO -1'])
+        threaded, report = thread_jumps(statements)
+        self.assertEqual(threaded[0].static_destination(), 1)
+        self.assertEqual(report[SKIPPED_GOTOS], 0)
+
+
+class TestDropUnreachable(unittest.TestCase):
+    def test_unreachable_lines_are_replaced(self):
+        statements = _statements(
+            ['GOTO 3', 'PRINT 1', 'PRINT 2', 'GOSUB 3', 'END', 'PRINT 3', 'RETURN']
+        )
+        dropped, report = drop_unreachable(statements)
+        self.assertIsInstance(dropped[1], UnreachableStatement)
+        self.assertIsInstance(dropped[2], UnreachableStatement)
+        self.assertIsInstance(dropped[5], UnreachableStatement)
+        self.assertIs(dropped[4], statements[4])
+        self.assertIs(dropped[6], statements[6])
+        self.assertEqual(report, {UNREACHABLE_LINES: 3})
+
+    def test_lines_after_end_and_failed_jumps(self):
+        statements = _statements(['GOTO 5 IF X < 1', 'END', 'PRINT 1'])
+        dropped, report = drop_unreachable(statements)
+        self.assertIsInstance(dropped[2], UnreachableStatement)
+        self.assertEqual(report[UNREACHABLE_LINES], 1)
+
+    def test_reachable_dynamic_jump_keeps_every_line(self):
+        statements = _statements(['GOTO T', 'END', 'PRINT 1'])
+        dropped, report = drop_unreachable(statements)
+        self.assertEqual(dropped, statements)
+        self.assertEqual(report[UNREACHABLE_LINES], 0)
+
+    def test_unreachable_dynamic_jump_is_dropped_too(self):
+        statements = _statements(['END', 'GOTO T', 'PRINT 1'])
+        _, report = drop_unreachable(statements)
+        self.assertEqual(report[UNREACHABLE_LINES], 2)
+
+
+class TestOptimizedControlFlow(unittest.TestCase):
+    def assertSameAsInterpreter(self, lines: list[str]):
+        expected, _ = _run(lines, optimize=False)
+        actual, report = _run(lines, optimize=True)
+        self.assertEqual(actual, expected)
+        return report
+
+    def test_threaded_loop_runs_the_same(self):
+        report = self.assertSameAsInterpreter(
+            [
+                'LET I 0',
+                'TOP: ADD I 1',
+                'GOTO "NEXT" IF I < 5',
+                'GOTO "DONE"',
+                'NEXT: GOTO "BACK"',
+                'BACK: GOTO "TOP"',
+                'DONE: PRINT I',
+            ]
+        )
+        self.assertEqual(report[SKIPPED_GOTOS], 3)
+
+    def test_dynamic_jump_keeps_every_line_in_place(self):
+        report = self.assertSameAsInterpreter(
+            ['LET J 3', 'GOTO 3', 'PRINT "never"', 'PRINT "nor"', 'GOTO J', 'END']
+            + ['PRINT 1', 'PRINT 2']
+        )
+        self.assertEqual(report[UNREACHABLE_LINES], 0)
+
+    def test_subroutine_reached_through_a_goto(self):
+        report = self.assertSameAsInterpreter(
+            ['GOSUB 3', 'PRINT X', 'END', 'GOTO 2', 'PRINT "no"', 'LET X 7', 'RETURN']
+        )
+        self.assertEqual(report[SKIPPED_GOTOS], 1)
+        self.assertEqual(report[UNREACHABLE_LINES], 2)
+
+    def test_jump_fused_into_the_line_before_keeps_its_target(self):
+        # Line 0 fuses the ADD with the GOTO on line 1, which is then folded
+        # and threaded on its own line, so only line 0 still jumps to line 2
+        self.assertSameAsInterpreter(
+            ['ADD B 1', 'GOTO 1 IF B > 0', 'GOTO 2 IF B > 0', 'PRINT B', 'PRINT "x"']
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import grin.execution as execution
+from grin.parsing import parse
+from grin.profiles import Profile
+from grin.statements import (
+    AddStatement,
+    GoToStatement,
+    PrintStatement,
+    UnbuiltStatement,
+)
+from grin.utility import GrinRuntimeError
+
+
+def _compile(lines: list[str], engine: str = 'statements', **kwargs):
+    return execution.compile(list(parse(lines + ['.'])), engine, **kwargs)
+
+
+_PROGRAM = [
+    'LET T "SKIP"',
+    'GOTO T',
+    'PRINT "never"',
+    'SKIP: GOSUB "TWICE"',
+    'PRINT A',
+    'END',
+    'TWICE: ADD A 2',
+    'MULT A 2',
+    'RETURN',
+    'PRINT "never either"',
+]
+
+
+class TestLazyStatements(unittest.TestCase):
+    def test_only_lines_that_run_are_built(self):
+        program = _compile(_PROGRAM, lazy=True)
+        self.assertTrue(
+            all(isinstance(s, UnbuiltStatement) for s in program.statements())
+        )
+        self.assertEqual(program.run(), ['4'])
+
+        statements = program.statements()
+        for line in (2, 9):
+            self.assertIsInstance(statements[line], UnbuiltStatement)
+        self.assertIsInstance(statements[1], GoToStatement)
+        self.assertIsInstance(statements[4], PrintStatement)
+        self.assertIsInstance(statements[6], AddStatement)
+
+    def test_lines_are_built_once(self):
+        program = _compile(_PROGRAM, lazy=True)
+        program.run()
+        built = program.statements()
+        self.assertEqual(program.run(), ['4'])
+        for before, after in zip(built, program.statements()):
+            self.assertIs(before, after)
+
+    def test_same_output_as_eager(self):
+        lines = [
+            'LET N 0',
+            'TOP: ADD N 1',
+            'GOSUB "CHECK" IF N > 95',
+            'GOTO "TOP" IF N < 100',
+            'PRINT N',
+            'END',
+            'CHECK: PRINT N',
+            'GOSUB 2',
+            'RETURN',
+            'RETURN',
+        ]
+        for engine in execution.ENGINES:
+            with self.subTest(engine=engine):
+                expected = _compile(lines, engine).run()
+                self.assertEqual(_compile(lines, engine, lazy=True).run(), expected)
+
+    def test_lines_first_run_while_recording_a_trace(self):
+        program = _compile(
+            [
+                'TOP: ADD I 1',
+                'GOTO "SKIP" IF I < 60',
+                'ADD S I',
+                'SKIP: GOTO "TOP" IF I < 100',
+                'PRINT S',
+            ],
+            'tracing',
+            lazy=True,
+        )
+        self.assertEqual(program.run(), ['3280'])
+        self.assertEqual(program.tracer().stats().aborted, {})
+
+    def test_errors_wait_for_the_line_to_run(self):
+        program = _compile(['GOTO 3', 'GOTO "NOWHERE"', 'END'], lazy=True)
+        self.assertEqual(program.run(), [])
+        program = _compile(['GOTO "NOWHERE"', 'END'], lazy=True)
+        with self.assertRaises(GrinRuntimeError):
+            program.run()
+
+    def test_profiled_run_sees_built_lines(self):
+        program = _compile(['LET A 1.5', 'ADD A 2', 'PRINT A'], lazy=True)
+        profile = Profile()
+        self.assertEqual(program.run(profile=profile), ['3.5'])
+        self.assertEqual(profile.monomorphic_types(1), (float, int))
+
+    def test_cannot_be_optimized_memoized_or_profiled(self):
+        for kwargs in ({'optimize': True}, {'memoize': True}, {'profile': Profile()}):
+            with self.subTest(kwargs=kwargs):
+                with self.assertRaises(ValueError):
+                    _compile(['PRINT 1'], lazy=True, **kwargs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import grin.execution as execution
+from grin.constants import propagate_constants
+from grin.liveness import DEAD_STORES, eliminate_dead_stores, unread_variables
+from grin.parsing import parse
+from grin.statements import ConstantLetsStatement, NopStatement
+from grin.utility import GrinRuntimeError
+
+
+def _statements(lines: list[str]):
+    token_lines = list(parse(lines + ['.']))
+    statements = execution._build_statements(token_lines)
+    execution._resolve_static_targets(
+        statements, execution._build_goto_labels(token_lines)
+    )
+    return statements
+
+
+def _eliminate(lines: list[str]):
+    statements = _statements(lines)
+    eliminated, report = eliminate_dead_stores(statements)
+    return statements, eliminated, report[DEAD_STORES]
+
+
+def _run(lines: list[str], optimize: bool, engine: str = 'statements'):
+    program = execution.compile(list(parse(lines + ['.'])), engine, optimize=optimize)
+    return program.run(), program.optimization_report()
+
+
+class TestEliminateDeadStores(unittest.TestCase):
+    def test_overwritten_stores_are_removed(self):
+        statements, eliminated, count = _eliminate(
+            ['LET A 1', 'LET A 2', 'ADD B 3', 'LET B A', 'PRINT B']
+        )
+        self.assertEqual(count, 2)
+        self.assertIsInstance(eliminated[0], NopStatement)
+        self.assertIs(eliminated[1], statements[1])
+        self.assertIsInstance(eliminated[2], NopStatement)
+        self.assertIs(eliminated[3], statements[3])
+
+    def test_nothing_is_live_once_the_program_ends(self):
+        _, eliminated, count = _eliminate(['LET A 1', 'PRINT A', 'ADD A 1', 'END'])
+        self.assertEqual(count, 1)
+        self.assertIsInstance(eliminated[2], NopStatement)
+
+    def test_stores_feeding_dead_stores_are_dead_too(self):
+        _, eliminated, count = _eliminate(['LET A 4', 'LET B A', 'MULT B 2'])
+        self.assertEqual(count, 3)
+        self.assertTrue(all(isinstance(s, NopStatement) for s in eliminated))
+
+    def test_stores_read_around_a_loop_are_kept(self):
+        statements, eliminated, count = _eliminate(
+            ['LET S 0', 'ADD S I', 'LET T S', 'ADD I 1', 'GOTO -3 IF I < 5']
+        )
+        self.assertEqual(count, 1)
+        self.assertIsInstance(eliminated[2], NopStatement)
+        self.assertEqual(eliminated[:2], statements[:2])
+
+    def test_arithmetic_that_could_fail_is_kept(self):
+        for lines in (
+            ['LET A "x"', 'ADD A 1'],
+            ['LET A "x"', 'SUB A "y"'],
+            ['LET A "x"', 'MULT A 2'],
+            ['INNUM A', 'ADD A 1'],
+            ['INSTR B', 'ADD A B'],
+            ['DIV A 2'],
+        ):
+            with self.subTest(lines=lines):
+                statements, eliminated, _ = _eliminate(lines)
+                self.assertIs(eliminated[-1], statements[-1])
+
+    def test_arithmetic_on_known_types_is_removed(self):
+        for lines in (
+            ['LET A "x"', 'ADD A "y"'],
+            ['LET A 1.5', 'SUB A 1'],
+            ['INSTR B', 'ADD B "!"'],
+            ['LET B 2', 'MULT A B'],
+        ):
+            with self.subTest(lines=lines):
+                _, eliminated, _ = _eliminate(lines)
+                self.assertIsInstance(eliminated[-1], NopStatement)
+
+    def test_subroutines_see_what_their_callers_read(self):
+        statements, eliminated, count = _eliminate(
+            ['LET A 1', 'GOSUB 3', 'PRINT B', 'END', 'LET B A', 'LET A 2', 'RETURN']
+        )
+        self.assertEqual(count, 1)
+        self.assertIs(eliminated[0], statements[0])
+        self.assertIs(eliminated[4], statements[4])
+        self.assertIsInstance(eliminated[5], NopStatement)
+
+    def test_dynamic_jumps_keep_every_store(self):
+        _, _, count = _eliminate(['LET T 3', 'LET A 1', 'GOTO T', 'LET A 2'])
+        self.assertEqual(count, 0)
+
+    def test_constant_lets_drop_dead_variables(self):
+        statements = _statements(['LET A 1', 'LET B 2', 'LET C 3', 'PRINT B'])
+        propagated, _ = propagate_constants(statements)
+        eliminated, report = eliminate_dead_stores(propagated)
+        self.assertIsInstance(eliminated[0], ConstantLetsStatement)
+        self.assertEqual(eliminated[0].values(), {})
+        self.assertEqual(report[DEAD_STORES], 5)
+
+
+class TestUnreadVariables(unittest.TestCase):
+    def test_unread_variables(self):
+        statements = _statements(
+            ['LET A 1', 'INNUM B', 'ADD C A', 'LET T 4', 'GOTO T IF D < 1', 'LET E 1']
+        )
+        self.assertEqual(unread_variables(statements), ['B', 'C', 'E'])
+
+    def test_compiled_program_lists_them_as_written(self):
+        program = execution.compile(
+            list(parse(['LET A 1', 'LET B A', 'PRINT 2', '.'])), optimize=True
+        )
+        self.assertEqual(program.unread_variables(), ['B'])
+
+
+class TestDeadStoreResults(unittest.TestCase):
+    def assertSameAsInterpreter(self, lines: list[str]):
+        expected, _ = _run(lines, optimize=False)
+        actual, report = _run(lines, optimize=True)
+        self.assertEqual(actual, expected)
+        return report
+
+    def test_stores_made_dead_by_constant_propagation(self):
+        report = self.assertSameAsInterpreter(
+            ['LET A 6', 'LET B A', 'MULT B 7', 'PRINT B']
+        )
+        # Line 0 sets A and B at once, and neither they nor lines 1 and 2 are
+        # needed once the PRINT prints a literal
+        self.assertEqual(report[DEAD_STORES], 4)
+
+    def test_loop_with_a_scratch_variable(self):
+        report = self.assertSameAsInterpreter(
+            [
+                'TOP: LET T I',
+                'MULT T T',
+                'ADD S T',
+                'LET T 0',
+                'ADD I 1',
+                'GOTO "TOP" IF I < 10',
+                'PRINT S',
+            ]
+        )
+        self.assertEqual(report[DEAD_STORES], 1)
+
+    def test_failing_store_still_fails(self):
+        for lines in (['LET A "x"', 'ADD A 1'], ['DIV A 0']):
+            with self.subTest(lines=lines):
+                with self.assertRaises(GrinRuntimeError):
+                    _run(lines, optimize=True)
+
+    def test_tiered_engine_keeps_every_store(self):
+        lines = ['LET A 6', 'LET B A', 'MULT B 7', 'PRINT B']
+        expected, _ = _run(lines, optimize=False)
+        actual, report = _run(lines, optimize=True, engine='tiered')
+        self.assertEqual(actual, expected)
+        self.assertEqual(report[DEAD_STORES], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
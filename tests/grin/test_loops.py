@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+import itertools
+import unittest
+
+import grin.execution as execution
+from grin.loops import CLOSED_FORM_LOOPS, fold_counting_loops
+from grin.parsing import parse
+from grin.statements import CountingLoopStatement
+
+
+def _statements(lines: list[str]):
+    statements = execution._build_statements(list(parse(lines + ['.'])))
+    execution._resolve_static_targets(statements, {})
+    return statements
+
+
+def _run(lines: list[str], optimize: bool):
+    program = execution.compile(list(parse(lines + ['.'])), optimize=optimize)
+    return program.run(), program.optimization_report()
+
+
+class TestFoldCountingLoops(unittest.TestCase):
+    def test_counting_loop_is_folded(self):
+        statements = _statements(['LET I 0', 'ADD I 1', 'MULT X 2', 'GOTO -2 IF I < 9'])
+        folded, report = fold_counting_loops(statements)
+        self.assertIsInstance(folded[1], CountingLoopStatement)
+        self.assertIs(folded[1].original(), statements[1])
+        self.assertIs(folded[2], statements[2])
+        self.assertEqual(report, {CLOSED_FORM_LOOPS: 1})
+
+    def test_loops_that_do_more_are_not_folded(self):
+        for body in (
+            ['PRINT I'],
+            ['INNUM X'],
+            ['GOSUB 3'],
+            ['ADD X 1.5'],
+            ['ADD X "a"'],
+            ['ADD X Y'],
+            ['DIV X 2'],
+            ['LET X 1'],
+        ):
+            with self.subTest(body=body):
+                statements = _statements(
+                    ['ADD I 1'] + body + [f'GOTO -{len(body) + 1} IF I < 9']
+                )
+                _, report = fold_counting_loops(statements)
+                self.assertEqual(report[CLOSED_FORM_LOOPS], 0)
+
+    def test_counter_must_only_be_added_to(self):
+        statements = _statements(['ADD I 1', 'MULT I 2', 'GOTO -2 IF I < 9'])
+        _, report = fold_counting_loops(statements)
+        self.assertEqual(report[CLOSED_FORM_LOOPS], 0)
+
+    def test_bound_changed_by_body_is_not_folded(self):
+        statements = _statements(['ADD I 1', 'ADD N 1', 'GOTO -2 IF I < N'])
+        _, report = fold_counting_loops(statements)
+        self.assertEqual(report[CLOSED_FORM_LOOPS], 0)
+
+    def test_forward_and_dynamic_jumps_are_not_folded(self):
+        for jump in ('GOTO 1 IF I < 9', 'GOTO T IF I < 9', 'GOTO -1'):
+            with self.subTest(jump=jump):
+                _, report = fold_counting_loops(_statements(['ADD I 1', jump, 'END']))
+                self.assertEqual(report[CLOSED_FORM_LOOPS], 0)
+
+
+class TestCountingLoopResults(unittest.TestCase):
+    def assertSameAsInterpreter(self, lines: list[str], folds: int = 1):
+        expected, _ = _run(lines, optimize=False)
+        actual, report = _run(lines, optimize=True)
+        self.assertEqual(actual, expected)
+        self.assertEqual(report[CLOSED_FORM_LOOPS], folds)
+
+    def test_every_comparison_and_direction(self):
+        operators = ('<', '<=', '>', '>=', '=', '<>')
+        for op, start, step, bound in itertools.product(
+            operators, (-7, 0, 5), (-3, -1, 1, 2), (-10, 0, 5, 12)
+        ):
+            # Loops that would never end are left to the interpreter
+            if op in ('<', '<=') and step < 0 and start + step < bound + 1:
+                continue
+            if op in ('>', '>=') and step > 0 and start + step > bound - 1:
+                continue
+            if op == '<>' and (bound - start) % step != 0:
+                continue
+            if op == '<>' and (bound - start) // step < 1:
+                continue
+            with self.subTest(op=op, start=start, step=step, bound=bound):
+                self.assertSameAsInterpreter(
+                    [
+                        f'LET I {start}',
+                        'LET X 3',
+                        'LET Y -2',
+                        f'ADD I {step}',
+                        'MULT X -1',
+                        'ADD X 4',
+                        'MULT Y 3',
+                        'SUB Y 1',
+                        f'GOTO -5 IF I {op} {bound}',
+                        'PRINT I',
+                        'PRINT X',
+                        'PRINT Y',
+                    ]
+                )
+
+    def test_bound_on_the_left(self):
+        self.assertSameAsInterpreter(
+            ['LET N 10', 'ADD I 3', 'ADD S 2', 'GOTO -2 IF N > I', 'PRINT I', 'PRINT S']
+        )
+
+    def test_loop_runs_in_closed_form_at_scale(self):
+        output, _ = _run(
+            ['ADD I 1', 'ADD S 5', 'GOTO -2 IF I < 1000000000', 'PRINT S'], True
+        )
+        self.assertEqual(output, ['5000000000'])
+
+    def test_non_integer_values_fall_back(self):
+        self.assertSameAsInterpreter(
+            ['LET I 0.5', 'ADD I 1', 'MULT X 2', 'GOTO -2 IF I < 10', 'PRINT I']
+        )
+        self.assertSameAsInterpreter(
+            ['LET N 9.5', 'ADD I 1', 'GOTO -1 IF I < N', 'PRINT I']
+        )
+
+    def test_jump_into_middle_of_loop(self):
+        self.assertSameAsInterpreter(
+            ['GOTO 2', 'ADD X 1', 'ADD I 1', 'GOTO -2 IF I < 5', 'PRINT X', 'PRINT I']
+        )
+
+    def test_labelled_loop(self):
+        self.assertSameAsInterpreter(
+            ['TOP: ADD I 2', 'MULT X 1', 'GOTO "TOP" IF I <= 40', 'PRINT I']
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+
+import sys
+import threading
+import unittest
+from unittest import mock
+
+import grin.execution as execution
+import grin.statements as statements
+from grin.memoization import MEMOIZED_CALLS, memoize_subroutines
+from grin.parsing import parse
+from grin.utility import GrinRuntimeError
+
+
+def _memoize(lines: list[str]):
+    token_lines = list(parse(lines + ['.']))
+    built = execution._build_statements(token_lines)
+    execution._resolve_static_targets(built, execution._build_goto_labels(token_lines))
+    memoized, report = memoize_subroutines(built)
+    return memoized, report[MEMOIZED_CALLS]
+
+
+def _run(lines: list[str], memoize: bool, engine: str = 'statements', **kwargs):
+    program = execution.compile(
+        list(parse(lines + ['.'])), engine, memoize=memoize, **kwargs
+    )
+    return program.run(), program
+
+
+# Squares each of 0 to 4 four times over, the slow way
+_SQUARES = [
+    'TOP: LET N I',
+    'DIV N 5',
+    'MULT N 5',
+    'LET K I',
+    'SUB K N',
+    'GOSUB "SQUARE"',
+    'ADD S Q',
+    'ADD I 1',
+    'GOTO "TOP" IF I < 20',
+    'PRINT S',
+    'END',
+    'SQUARE: LET Q 0',
+    'LET J 0',
+    'LOOP: ADD Q K',
+    'ADD J 1',
+    'GOTO "LOOP" IF J < K',
+    'RETURN',
+]
+
+
+class TestMemoizeSubroutines(unittest.TestCase):
+    def test_inputs_and_outputs(self):
+        memoized, count = _memoize(_SQUARES)
+        self.assertEqual(count, 1)
+        memo = memoized[5].memo()
+        # Q and J are set before they're read, and by every RETURN
+        self.assertEqual(memo.inputs(), ('K',))
+        self.assertEqual(memo.outputs(), ('J', 'Q'))
+
+    def test_variables_not_always_set_are_inputs(self):
+        memoized, _ = _memoize(
+            ['GOSUB 2', 'END', 'GOTO 2 IF A < 1', 'LET B 1', 'LET C 2', 'RETURN']
+        )
+        memo = memoized[0].memo()
+        self.assertEqual(memo.inputs(), ('A', 'B'))
+        self.assertEqual(memo.outputs(), ('B', 'C'))
+
+    def test_calls_made_by_the_subroutine_are_followed(self):
+        memoized, count = _memoize(
+            ['GOSUB 2', 'END', 'GOSUB 3', 'ADD A B', 'RETURN', 'LET B 2', 'RETURN']
+        )
+        self.assertEqual(count, 2)
+        self.assertEqual(memoized[0].memo().inputs(), ('A',))
+        self.assertEqual(memoized[0].memo().outputs(), ('A', 'B'))
+        self.assertEqual(memoized[2].memo().inputs(), ())
+
+    def test_impure_subroutines_are_not_memoized(self):
+        for subroutine in (
+            ['PRINT A', 'RETURN'],
+            ['INNUM A', 'RETURN'],
+            ['INSTR A', 'RETURN'],
+            ['LET A 1', 'END'],
+            ['GOTO T', 'RETURN'],
+            ['GOSUB T', 'RETURN'],
+            ['GOSUB 2', 'RETURN', 'PRINT 1', 'RETURN'],
+            ['ADD A 1', 'GOTO -1'],
+            ['ADD A 1'],
+        ):
+            with self.subTest(subroutine=subroutine):
+                _, count = _memoize(['GOSUB 2', 'END'] + subroutine)
+                self.assertEqual(count, 0)
+
+    def test_calls_to_the_same_subroutine_share_a_memo(self):
+        memoized, count = _memoize(
+            ['GOSUB "F"', 'GOSUB "F" IF A < 1', 'END', 'F: ADD A 1', 'RETURN']
+        )
+        self.assertEqual(count, 2)
+        self.assertIs(memoized[0].memo(), memoized[1].memo())
+
+
+class TestMemoizedResults(unittest.TestCase):
+    def assertSameAsUnmemoized(self, lines: list[str], engine: str = 'statements'):
+        expected, _ = _run(lines, memoize=False)
+        actual, program = _run(lines, memoize=True, engine=engine)
+        self.assertEqual(actual, expected)
+        return program
+
+    def test_repeat_calls_are_remembered(self):
+        for engine in ('statements', 'tracing', 'tiered'):
+            with self.subTest(engine=engine):
+                program = self.assertSameAsUnmemoized(_SQUARES, engine)
+                self.assertEqual(program.memo_stats(), {5: (15, 5)})
+                self.assertEqual(program.optimization_report(), {MEMOIZED_CALLS: 1})
+
+    def test_memoized_after_optimizing(self):
+        expected, _ = _run(_SQUARES, memoize=False)
+        actual, program = _run(_SQUARES, memoize=True, optimize=True)
+        self.assertEqual(actual, expected)
+        self.assertEqual(program.memo_stats(), {5: (15, 5)})
+
+    def test_values_that_look_alike_are_told_apart(self):
+        program = self.assertSameAsUnmemoized(
+            [
+                'LET A 1',
+                'GOSUB "F"',
+                'LET A 1.0',
+                'GOSUB "F"',
+                'LET A 0.0',
+                'GOSUB "F"',
+                'LET A -0.0',
+                'GOSUB "F"',
+                'LET A 1',
+                'GOSUB "F"',
+                'END',
+                'F: LET B A',
+                'PRINT B',
+                'RETURN',
+            ]
+        )
+        self.assertEqual(program.optimization_report(), {MEMOIZED_CALLS: 0})
+
+        program = self.assertSameAsUnmemoized(
+            [
+                'LET A 1',
+                'GOSUB "F"',
+                'PRINT B',
+                'LET A 1.0',
+                'GOSUB "F"',
+                'PRINT B',
+                'LET A -0.0',
+                'GOSUB "F"',
+                'PRINT B',
+                'LET A 0.0',
+                'GOSUB "F"',
+                'PRINT B',
+                'LET A 1',
+                'GOSUB "F"',
+                'PRINT B',
+                'END',
+                'F: LET B A',
+                'RETURN',
+            ]
+        )
+        self.assertEqual(
+            program.memo_stats(),
+            {1: (0, 1), 4: (0, 1), 7: (0, 1), 10: (0, 1), 13: (1, 0)},
+        )
+
+    def test_recursive_subroutine(self):
+        # Adds up 1 to N, with every level calling the next
+        lines = [
+            'LET N 200',
+            'GOSUB "SUM"',
+            'PRINT T',
+            'LET N 150',
+            'GOSUB "SUM"',
+            'PRINT T',
+            'END',
+            'SUM: LET T 0',
+            'GOTO "DONE" IF N < 1',
+            'SUB N 1',
+            'GOSUB "SUM"',
+            'ADD N 1',
+            'ADD T N',
+            'DONE: RETURN',
+        ]
+        program = self.assertSameAsUnmemoized(lines)
+        hits = sum(hits for hits, _ in program.memo_stats().values())
+        self.assertEqual(hits, 1)
+
+        # Deeper than MAX_MEMO_DEPTH, the calls just run
+        with mock.patch.object(statements, 'MAX_MEMO_DEPTH', 10):
+            self.assertSameAsUnmemoized(lines)
+
+    def test_memo_forgets_the_least_recently_used_calls(self):
+        with mock.patch.object(statements, 'MEMO_CACHE_SIZE', 2):
+            _, program = _run(
+                [
+                    'LET A 1',
+                    'GOSUB "F"',
+                    'LET A 2',
+                    'GOSUB "F"',
+                    'LET A 1',
+                    'GOSUB "F"',
+                    'LET A 3',
+                    'GOSUB "F"',
+                    'LET A 1',
+                    'GOSUB "F"',
+                    'LET A 2',
+                    'GOSUB "F"',
+                    'END',
+                    'F: ADD A 1',
+                    'RETURN',
+                ],
+                memoize=True,
+            )
+        hits = [program.memo_stats()[line][0] for line in range(1, 12, 2)]
+        self.assertEqual(hits, [0, 0, 1, 0, 1, 0])
+
+    def test_runs_from_many_threads(self):
+        program = execution.compile(
+            list(
+                parse(
+                    ['INNUM A', 'GOSUB 3', 'PRINT A', 'END', 'MULT A 2', 'RETURN', '.']
+                )
+            ),
+            memoize=True,
+        )
+        failures = []
+
+        def run(start: int):
+            for value in range(start, start + 200):
+                try:
+                    out = program.run(lambda: str(value % 7))
+                except Exception as error:
+                    failures.append(error)
+                    return
+                if out != [str(value % 7 * 2)]:
+                    failures.append(out)
+
+        threads = [threading.Thread(target=run, args=(start,)) for start in range(6)]
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            with mock.patch.object(statements, 'MEMO_CACHE_SIZE', 2):
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual(failures, [])
+
+    def test_failing_calls_are_not_remembered(self):
+        program = execution.compile(
+            list(parse(['GOSUB 2', 'END', 'DIV A B', 'RETURN', '.'])), memoize=True
+        )
+        for _ in range(2):
+            with self.assertRaises(GrinRuntimeError):
+                program.run()
+        self.assertEqual(program.memo_stats(), {0: (0, 2)})
+
+    def test_not_memoized_unless_asked(self):
+        _, program = _run(_SQUARES, memoize=False)
+        self.assertEqual(program.memo_stats(), {})
+        self.assertNotIn(MEMOIZED_CALLS, program.optimization_report())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import test_execution
+
+import grin.execution as execution
+from grin.parsing import parse
+from grin.peephole import COUNTER_THEN_BRANCH, LET_THEN_PRINT, fuse_superinstructions
+from grin.statements import FusedStatement
+from grin.test_utilities import rerun_with_engine
+
+# Every test in test_execution.py, run again with the optimization passes on
+rerun_with_engine(globals(), test_execution, 'Optimized', 'statements', optimize=True)
+
+
+def _statements(lines: list[str]):
+    return list(execution._build_statements(list(parse(lines + ['.']))))
+
+
+class TestFuseSuperinstructions(unittest.TestCase):
+    def test_counter_then_branch(self):
+        statements = _statements(['LET I 0', 'ADD I 1', 'GOTO -1 IF I < 5'])
+        fused, report = fuse_superinstructions(statements)
+        self.assertIsInstance(fused[1], FusedStatement)
+        self.assertEqual(fused[1].pattern(), COUNTER_THEN_BRANCH)
+        self.assertIs(fused[2], statements[2])
+        self.assertEqual(report, {COUNTER_THEN_BRANCH: 1, LET_THEN_PRINT: 0})
+
+    def test_let_then_print(self):
+        statements = _statements(['LET X "hi"', 'PRINT X', 'LET Y 1', 'PRINT X'])
+        fused, report = fuse_superinstructions(statements)
+        self.assertEqual(fused[0].pattern(), LET_THEN_PRINT)
+        self.assertIs(fused[2], statements[2])
+        self.assertEqual(report[LET_THEN_PRINT], 1)
+
+    def test_branch_on_other_variable_is_not_fused(self):
+        statements = _statements(['ADD I 1', 'GOTO -1 IF J < 5', 'ADD I 1', 'GOTO 1'])
+        _, report = fuse_superinstructions(statements)
+        self.assertEqual(report[COUNTER_THEN_BRANCH], 0)
+
+
+class TestOptimizedPrograms(unittest.TestCase):
+    def _compile(self, lines: list[str]):
+        return execution.compile(list(parse(lines + ['.'])), optimize=True)
+
+    def test_fused_loop_runs_and_reports(self):
+        program = self._compile(
+            ['LET I 0', 'LOOP: ADD I 1', 'GOTO "LOOP" IF I < 3', 'LET X I', 'PRINT X']
+        )
+        self.assertEqual(program.run(), ['3'])
+        report = program.optimization_report()
+        self.assertEqual(report[COUNTER_THEN_BRANCH], 1)
+        self.assertEqual(report[LET_THEN_PRINT], 1)
+
+    def test_jump_into_middle_of_superinstruction(self):
+        program = self._compile(['GOTO 2', 'LET X 1', 'PRINT X'])
+        self.assertEqual(program.run(), ['0'])
+
+    def test_unoptimized_programs_have_empty_report(self):
+        program = execution.compile(list(parse(['LET X 1', 'PRINT X', '.'])))
+        self.assertEqual(program.optimization_report(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+
+import test_execution
+
+import grin.execution as execution
+from grin.parsing import parse
+from grin.peephole import fuse_superinstructions
+from grin.profiles import Profile, load_profile, run_profiled, save_profile
+from grin.program_state import ProgramState
+from grin.statements import AddStatement, FusedStatement
+from grin.test_utilities import rerun_with_engine
+from grin.transpiler import generate_source
+
+_profile_dir = tempfile.TemporaryDirectory()
+
+# Every test in test_execution.py, run again while recording profiles (and,
+# for programs a test runs more than once, building from them)
+rerun_with_engine(
+    globals(),
+    test_execution,
+    'Profiled',
+    'statements',
+    profile_dir=_profile_dir.name,
+)
+
+
+def tearDownModule():
+    _profile_dir.cleanup()
+
+
+_LOOP = [
+    'LET I 0',
+    'LET X 0.5',
+    'ADD I 1',
+    'ADD X I',
+    'GOTO -2 IF I < 10',
+    'GOSUB 2 IF I = 3',
+    'END',
+    'RETURN',
+]
+
+
+def _token_lines(lines: list[str]):
+    return list(parse(lines + ['.']))
+
+
+def _record(lines: list[str]) -> Profile:
+    profile = Profile()
+    execution.compile(_token_lines(lines)).run(profile=profile)
+    return profile
+
+
+class TestProfileRecording(unittest.TestCase):
+    def test_hits(self):
+        profile = _record(_LOOP)
+        self.assertEqual(profile.hits, {0: 1, 1: 1, 2: 10, 3: 10, 4: 10, 5: 1, 6: 1})
+        self.assertEqual(profile.total_hits(), 34)
+        self.assertEqual(profile.hot_lines(), [2, 3, 4, 0, 1, 5, 6])
+
+    def test_operand_types(self):
+        profile = _record(_LOOP)
+        self.assertEqual(profile.operand_types[2], {(int, int): 10})
+        self.assertEqual(profile.operand_types[3], {(float, int): 10})
+        self.assertEqual(profile.monomorphic_types(2), (int, int))
+
+    def test_polymorphic_line(self):
+        profile = _record(['LET X 1', 'ADD X 0.5', 'GOTO -1 IF X < 3'])
+        self.assertEqual(profile.operand_types[1], {(int, float): 1, (float, float): 3})
+        self.assertIsNone(profile.monomorphic_types(1))
+
+    def test_both_halves_of_a_superinstruction(self):
+        token_lines = _token_lines(['LET I 0.5', 'ADD I 1', 'GOTO -1 IF I < 10'])
+        built = execution._build_statements(token_lines)
+        execution._resolve_static_targets(built, {})
+        fused, _ = fuse_superinstructions(built)
+        self.assertIsInstance(fused[1], FusedStatement)
+
+        profiles = []
+        for statements in (built, fused):
+            profile = Profile()
+            run_profiled(tuple(statements), ProgramState(token_lines), profile)
+            profiles.append(profile)
+        self.assertEqual(profiles[1].hits, profiles[0].hits)
+        self.assertEqual(profiles[1].operand_types, {1: {(float, int): 10}})
+
+
+class TestProfileFiles(unittest.TestCase):
+    def test_save_and_load(self):
+        token_lines = _token_lines(_LOOP)
+        profile = _record(_LOOP)
+        with tempfile.TemporaryDirectory() as profile_dir:
+            self.assertIsNone(load_profile(profile_dir, token_lines))
+            save_profile(profile, profile_dir, token_lines)
+            loaded = load_profile(profile_dir, token_lines)
+        self.assertEqual(loaded.hits, profile.hits)
+        self.assertEqual(loaded.operand_types, profile.operand_types)
+
+    def test_unreadable_profile_is_ignored(self):
+        token_lines = _token_lines(_LOOP)
+        with tempfile.TemporaryDirectory() as profile_dir:
+            save_profile(Profile(), profile_dir, token_lines)
+            (name,) = os.listdir(profile_dir)
+            with open(os.path.join(profile_dir, name), 'w') as profile_file:
+                profile_file.write('{"version": 0}')
+            self.assertIsNone(load_profile(profile_dir, token_lines))
+
+    def test_execute_records_then_uses_profile(self):
+        token_lines = _token_lines(_LOOP)
+        with tempfile.TemporaryDirectory() as profile_dir:
+            self.assertEqual(
+                execution.execute(token_lines, profile_dir=profile_dir), []
+            )
+            profile = load_profile(profile_dir, token_lines)
+            self.assertEqual(profile.hits[2], 10)
+
+            self.assertEqual(
+                execution.execute(token_lines, profile_dir=profile_dir), []
+            )
+            # The second run was built from the profile, not recorded into it
+            self.assertEqual(load_profile(profile_dir, token_lines).hits[2], 10)
+
+
+class TestProfileGuidedCompile(unittest.TestCase):
+    def test_pre_specializes_monomorphic_lines(self):
+        profile = _record(_LOOP + ['ADD X "a"'])
+        program = execution.compile(_token_lines(_LOOP), profile=profile)
+        statements = program.statements()
+        self.assertIsInstance(statements[2], AddStatement)
+        self.assertEqual(statements[2].specialization(), (int, int))
+        # (float, int) has no fast operation to specialize to
+        self.assertIsNone(statements[3].specialization())
+
+    def test_hot_blocks_dispatched_first(self):
+        token_lines = _token_lines(_LOOP)
+        profile = _record(_LOOP)
+        source = generate_source(token_lines, {}, profile.hot_lines())
+        self.assertLess(source.index('if _ip == 2:'), source.index('if _ip <'))
+        self.assertNotIn('if _ip == 2:', generate_source(token_lines, {}))
+
+        program = execution.compile(token_lines, 'python', profile=profile)
+        self.assertEqual(program.run(), [])
+
+    def test_hot_program_starts_promoted(self):
+        profile = _record(_LOOP)
+        program = execution.compile(_token_lines(_LOOP), 'tiered', profile=profile)
+        self.assertFalse(program.tiers().promoted())
+
+        profile.hits[2] = 5000
+        program = execution.compile(_token_lines(_LOOP), 'tiered', profile=profile)
+        self.assertTrue(program.tiers().promoted())
+        self.assertEqual(program.run(), [])
+        self.assertEqual(program.tiers().instructions, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from grin.parsing import parse
+from grin.slots import SlotProgramState, assign_slots
+
+
+def _token_lines(lines: list[str]):
+    return list(parse(lines + ['.']))
+
+
+class TestAssignSlots(unittest.TestCase):
+    def test_slots_follow_first_appearance(self):
+        token_lines = _token_lines(['LET B 1', 'ADD A B', 'PRINT C'])
+        self.assertEqual(assign_slots(token_lines), {'B': 0, 'A': 1, 'C': 2})
+
+    def test_labels_are_not_variables(self):
+        token_lines = _token_lines(['L: PRINT 1', 'GOTO "L"', 'GOTO T IF X < Y'])
+        self.assertEqual(assign_slots(token_lines), {'T': 0, 'X': 1, 'Y': 2})
+
+
+class TestSlotProgramState(unittest.TestCase):
+    def setUp(self):
+        token_lines = _token_lines(['LET A 1', 'LET B 2'])
+        self.state = SlotProgramState(token_lines, assign_slots(token_lines))
+
+    def test_slots_start_at_zero(self):
+        self.assertEqual(self.state.slots, [0, 0])
+        self.assertEqual(self.state.vars.get('A', 0), 0)
+
+    def test_vars_view_reads_and_writes_slots(self):
+        self.state.slots[1] = 'x'
+        self.assertEqual(self.state.vars['B'], 'x')
+        self.state.vars['A'] = 5
+        self.assertEqual(self.state.slots, [5, 'x'])
+
+    def test_vars_view_keeps_other_names(self):
+        self.state.vars['Z'] = 3
+        self.assertEqual(dict(self.state.vars), {'A': 0, 'B': 0, 'Z': 3})
+        del self.state.vars['Z']
+        self.assertNotIn('Z', self.state.vars)
+
+    def test_assigning_vars_copies_into_slots(self):
+        slots = self.state.slots
+        self.state.vars = {'B': 7}
+        self.assertIs(self.state.slots, slots)
+        self.assertEqual(slots, [0, 7])
+
+
+if __name__ == '__main__':
+    unittest.main()
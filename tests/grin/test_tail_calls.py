@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import grin.execution as execution
+from grin.parsing import parse
+from grin.statements import GoSubStatement, TailCallStatement
+from grin.utility import GrinRuntimeError, is_tail_call
+
+# Counts N down to 0 by recursing, every level ending with a tail call
+_COUNTDOWN = [
+    'LET N {depth}',
+    'GOSUB "DOWN"',
+    'PRINT N',
+    'END',
+    'DOWN: SUB N 1',
+    'GOSUB "DOWN" IF N > 0',
+    'RETURN',
+]
+
+# The same, but ending the program from the bottom of the recursion, so the
+# return stack is left as it was there
+_COUNTDOWN_TO_END = [
+    'LET N {depth}',
+    'GOSUB "DOWN"',
+    'END',
+    'DOWN: SUB N 1',
+    'GOTO "DONE" IF N < 1',
+    'GOSUB "DOWN"',
+    'RETURN',
+    'DONE: END',
+]
+
+
+def _lines(program: list[str], depth: int) -> list[str]:
+    return [line.format(depth=depth) for line in program]
+
+
+def _compile(lines: list[str], engine: str = 'statements', **kwargs):
+    return execution.compile(list(parse(lines + ['.'])), engine, **kwargs)
+
+
+def _final_stack_depth(lines: list[str], engine: str, tail_calls: bool) -> int:
+    program = _compile(lines, engine, tail_calls=tail_calls)
+    state = program._new_state(input, None)
+    state.goto_labels = program.goto_labels()
+    program._runner(state)
+    return len(state.return_stack)
+
+
+class TestIsTailCall(unittest.TestCase):
+    def test_is_tail_call(self):
+        token_lines = list(
+            parse(
+                ['GOSUB 2', 'RETURN', 'L: GOSUB -1 IF A < 1', 'RETURN', 'GOSUB 1', '.']
+            )
+        )
+        self.assertEqual(
+            [is_tail_call(token_lines, index) for index in range(5)],
+            [True, False, True, False, False],
+        )
+
+    def test_statements_built_for_tail_calls(self):
+        token_lines = list(parse(['GOSUB 2', 'RETURN', 'GOSUB 2', 'PRINT 1', '.']))
+        statements = execution._build_statements(token_lines)
+        self.assertIsInstance(statements[0], TailCallStatement)
+        self.assertIsInstance(statements[2], GoSubStatement)
+
+        statements = execution._build_statements(token_lines, tail_calls=False)
+        self.assertIsInstance(statements[0], GoSubStatement)
+
+
+class TestTailCalls(unittest.TestCase):
+    def test_deep_recursion_on_every_engine(self):
+        lines = _lines(_COUNTDOWN, 100000)
+        for engine in execution.ENGINES:
+            for optimize in (False, True):
+                with self.subTest(engine=engine, optimize=optimize):
+                    program = _compile(lines, engine, optimize=optimize)
+                    self.assertEqual(program.run(), ['0'])
+
+    def test_return_stack_stays_small(self):
+        lines = _lines(_COUNTDOWN_TO_END, 1000)
+        for engine in execution.ENGINES:
+            with self.subTest(engine=engine):
+                self.assertEqual(_final_stack_depth(lines, engine, True), 1)
+                self.assertEqual(_final_stack_depth(lines, engine, False), 1000)
+
+    def test_same_output_without_tail_calls(self):
+        lines = [
+            'LET N 5',
+            'GOSUB "FACT"',
+            'PRINT F',
+            'END',
+            'FACT: LET F 1',
+            'LOOP: MULT F N',
+            'SUB N 1',
+            'GOSUB "MORE"',
+            'RETURN',
+            'MORE: GOSUB "LOOP" IF N > 0',
+            'RETURN',
+        ]
+        for engine in execution.ENGINES:
+            with self.subTest(engine=engine):
+                self.assertEqual(_compile(lines, engine).run(), ['120'])
+                self.assertEqual(
+                    _compile(lines, engine, tail_calls=False).run(), ['120']
+                )
+
+    def test_return_without_gosub_still_fails(self):
+        lines = ['GOSUB 2', 'RETURN', 'PRINT 1', 'RETURN']
+        for engine in execution.ENGINES:
+            with self.subTest(engine=engine):
+                output = []
+                program = _compile(lines, engine)
+                with self.assertRaises(GrinRuntimeError):
+                    program.run(output_func=output.append)
+                self.assertEqual(output, ['1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import unittest
+import unittest.mock as mock
+
+import test_execution
+
+import grin.execution as execution
+import grin.tiers as tiers
+from grin.parsing import parse
+from grin.test_utilities import rerun_with_engine
+from grin.utility import GrinRuntimeError
+
+# Every test in test_execution.py, run again on the tiered engine
+rerun_with_engine(globals(), test_execution, 'Tiered', 'tiered')
+
+_threshold = mock.patch.object(tiers, 'PROMOTION_INSTRUCTIONS', 2)
+
+
+def setUpModule():
+    # Promote after the second line, so the suite above moves its programs'
+    # state from one tier to the other partway through
+    _threshold.start()
+
+
+def tearDownModule():
+    _threshold.stop()
+
+
+def _compile(lines: list[str]) -> execution.CompiledProgram:
+    return execution.compile(list(parse(lines + ['.'])), 'tiered')
+
+
+class TestTieredRunner(unittest.TestCase):
+    def test_short_program_stays_on_interpreter(self):
+        program = _compile(['PRINT 1'])
+        self.assertEqual(program.run(), ['1'])
+        self.assertFalse(program.tiers().promoted())
+        self.assertEqual(program.tiers().promotions, 0)
+
+    def test_hot_loop_is_promoted_mid_run(self):
+        program = _compile(['LET I 0', 'ADD I 1', 'GOTO -1 IF I < 500', 'PRINT I'])
+        runner = program.tiers()
+        runner.promotion_instructions = 1000
+        runner.promotion_backward_jumps = 10
+        self.assertEqual(program.run(), ['500'])
+        self.assertTrue(runner.promoted())
+        self.assertEqual(runner.promotions, 1)
+        self.assertEqual(runner.backward_jumps, 10)
+
+    def test_state_moves_to_compiled_tier(self):
+        program = _compile(
+            [
+                'LET S "a"',
+                'GOSUB 3',
+                'PRINT S',
+                'END',
+                'LET X 2.5',
+                'ADD S "b"',
+                'RETURN',
+            ]
+        )
+        # Promotes at RETURN, with the GOSUB's return address on the stack
+        program.tiers().promotion_instructions = 4
+        output = []
+        self.assertEqual(program.run(output_func=output.append), ['ab'])
+        self.assertEqual(output, ['ab'])
+        self.assertEqual(program.tiers().promotions, 1)
+
+    def test_promoted_program_starts_on_compiled_tier(self):
+        program = _compile(['LET I 0', 'ADD I 1', 'GOTO -1 IF I < 3', 'PRINT I'])
+        program.tiers().promotion_instructions = 5
+        self.assertEqual(program.run(), ['3'])
+        instructions = program.tiers().instructions
+        self.assertEqual(program.run(), ['3'])
+        self.assertEqual(program.tiers().instructions, instructions)
+
+    def test_error_after_promotion(self):
+        program = _compile(['LET I 0', 'ADD I 1', 'GOTO -1 IF I < 5', 'DIV I 0'])
+        program.tiers().promotion_instructions = 3
+        with self.assertRaises(GrinRuntimeError):
+            program.run()
+
+    def test_execute_defaults_to_tiered(self):
+        with mock.patch.object(execution, 'TieredRunner') as runner:
+            execution.execute(list(parse(['PRINT 1', '.'])))
+        runner.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+import unittest
+import unittest.mock as mock
+
+import test_execution
+
+import grin.execution as execution
+import grin.tracing as tracing
+from grin.parsing import parse
+from grin.program_state import ProgramState
+from grin.statements import ConstantLetsStatement, NopStatement
+from grin.test_utilities import rerun_with_engine
+from grin.utility import GrinRuntimeError
+
+# Every test in test_execution.py, run again on the tracing engine, with and
+# without the optimization passes
+rerun_with_engine(globals(), test_execution, 'Tracing', 'tracing')
+rerun_with_engine(
+    globals(), test_execution, 'TracingOptimized', 'tracing', optimize=True
+)
+
+_threshold = mock.patch.object(tracing, 'HOT_LOOP_THRESHOLD', 1)
+
+
+def setUpModule():
+    # Trace every loop as soon as it comes around, so the suite above runs
+    # through compiled traces rather than only the interpreter
+    _threshold.start()
+
+
+def tearDownModule():
+    _threshold.stop()
+
+
+def _compile(lines: list[str]) -> execution.CompiledProgram:
+    return execution.compile(list(parse(lines + ['.'])), 'tracing')
+
+
+class TestTracingJIT(unittest.TestCase):
+    def test_hot_loop_is_traced(self):
+        program = _compile(
+            [
+                'LET I 0',
+                'LET S 0',
+                'ADD I 1',
+                'ADD S I',
+                'GOTO -2 IF I < 100',
+                'PRINT S',
+            ]
+        )
+        self.assertEqual(program.run(), ['5050'])
+        stats = program.tracer().stats()
+        self.assertEqual(stats.recorded, {2: 1})
+        self.assertEqual(stats.entries, {2: 1})
+        self.assertEqual(stats.side_exits, {5: 1})
+
+    def test_cold_loop_is_not_traced(self):
+        program = _compile(['LET I 0', 'ADD I 1', 'GOTO -1 IF I < 3', 'PRINT I'])
+        program.tracer().hot_loop_threshold = 10
+        self.assertEqual(program.run(), ['3'])
+        self.assertEqual(program.tracer().traces(), {})
+
+    def test_trace_is_reused_across_runs(self):
+        program = _compile(['LET I 0', 'ADD I 1', 'GOTO -1 IF I < 5', 'PRINT I'])
+        self.assertEqual(program.run(), ['5'])
+        self.assertEqual(program.run(), ['5'])
+        stats = program.tracer().stats()
+        self.assertEqual(stats.recorded, {1: 1})
+        self.assertEqual(stats.entries, {1: 2})
+
+    def test_branch_inside_loop_exits_trace(self):
+        program = _compile(
+            [
+                'LET I 0',
+                'ADD I 1',
+                'GOTO 2 IF I = 7',
+                'GOTO -2 IF I < 10',
+                'PRINT I',
+            ]
+        )
+        self.assertEqual(program.run(), ['7'])
+        self.assertEqual(program.tracer().stats().side_exits, {4: 1})
+
+    def test_top_tested_loop_writes_back_the_whole_body(self):
+        program = _compile(
+            [
+                'TOP: GOTO "DONE" IF I >= 200',
+                'ADD I 1',
+                'ADD S 2',
+                'GOTO "TOP"',
+                'DONE: PRINT I',
+                'PRINT S',
+            ]
+        )
+        self.assertEqual(program.run(), ['200', '400'])
+        self.assertEqual(program.tracer().stats().side_exits, {4: 1})
+        # Leaving before going around writes back nothing the loop hasn't set
+        state = ProgramState([])
+        state.vars['I'] = 200
+        self.assertEqual(program.tracer().traces()[0](state), 4)
+        self.assertEqual(state.vars, {'I': 200})
+
+    def test_printing_inside_trace(self):
+        output = []
+        program = _compile(['LET I 0', 'ADD I 1', 'PRINT I', 'GOTO -2 IF I < 4'])
+        self.assertEqual(program.run(output_func=output.append), ['1', '2', '3', '4'])
+        self.assertEqual(output, ['1', '2', '3', '4'])
+
+    def test_division_by_zero_exits_to_interpreter(self):
+        program = _compile(
+            ['LET I 3', 'LET X 60', 'SUB I 1', 'DIV X I', 'GOTO -2 IF I > -1']
+        )
+        with self.assertRaises(GrinRuntimeError):
+            program.run()
+        self.assertEqual(program.tracer().stats().side_exits, {3: 1})
+
+    def test_division_by_zero_on_the_loop_head(self):
+        program = _compile(['LET A -100', 'L0: DIV C A', 'ADD A 1', 'GOTO -2'])
+        with self.assertRaises(GrinRuntimeError):
+            program.run()
+        self.assertEqual(program.tracer().stats().recorded, {1: 1})
+        self.assertEqual(program.tracer().stats().side_exits, {1: 1})
+
+    def test_integer_division_truncates(self):
+        program = _compile(
+            [
+                'LET I 0',
+                'LET X -100',
+                'ADD I 1',
+                'DIV X 3',
+                'GOTO -2 IF I < 3',
+                'PRINT X',
+            ]
+        )
+        self.assertEqual(program.run(), ['-3'])
+
+    def test_type_guard_falls_back_to_interpreter(self):
+        program = _compile(['LET I 0', 'ADD I 1', 'GOTO -1 IF I < 4', 'PRINT I'])
+        self.assertEqual(program.run(), ['4'])
+        program.statements()[0]._value_token = next(parse(['LET I 0.5', '.']))[2]
+        self.assertEqual(program.run(), ['4.5'])
+        # Every trip around the loop tries the trace and falls back
+        self.assertEqual(program.tracer().stats().guard_failures, {1: 4})
+
+    def test_gosub_aborts_and_blacklists(self):
+        program = _compile(
+            ['LET I 0', 'GOSUB 3', 'GOTO -1 IF I < 5', 'END', 'ADD I 1', 'RETURN']
+        )
+        self.assertEqual(program.run(), [])
+        stats = program.tracer().stats()
+        self.assertEqual(stats.recorded, {})
+        # Line 1 is reached by the GOTO and line 2 by the RETURN
+        self.assertEqual(stats.aborted, {'untraceable GoSubStatement': 2})
+
+    def test_unstable_types_abort(self):
+        program = _compile(
+            [
+                'LET A 1',
+                'LET B "b"',
+                'LET I 0',
+                'LET T A',
+                'LET A B',
+                'LET B T',
+                'ADD I 1',
+                'GOTO -4 IF I < 4',
+            ]
+        )
+        program.run()
+        self.assertEqual(program.tracer().stats().aborted, {'unstable types': 1})
+
+    def test_overlong_trace_aborts(self):
+        program = _compile(['LET I 0', 'ADD I 1', 'ADD I 1', 'GOTO -2 IF I < 20'])
+        program.tracer().max_trace_length = 2
+        program.run()
+        self.assertEqual(program.tracer().stats().aborted, {'trace too long': 1})
+
+    def test_string_loop(self):
+        program = _compile(
+            [
+                'LET S ""',
+                'LET I 0',
+                'ADD S "ab"',
+                'ADD I 1',
+                'GOTO -2 IF I < 3',
+                'PRINT S',
+            ]
+        )
+        self.assertEqual(program.run(), ['ababab'])
+        self.assertEqual(program.tracer().stats().recorded, {2: 1})
+
+    def test_constants_folded_inside_loop_are_traced(self):
+        program = execution.compile(
+            list(
+                parse(
+                    [
+                        'PRINT 0',
+                        'ADD I 1',
+                        'GOTO 1 IF 1 > 2',
+                        'LET A 2',
+                        'LET B 3',
+                        'ADD S A',
+                        'GOTO -5 IF I < 10',
+                        'PRINT S',
+                        '.',
+                    ]
+                )
+            ),
+            'tracing',
+            optimize=True,
+        )
+        self.assertIsInstance(program.statements()[2], NopStatement)
+        self.assertIsInstance(program.statements()[3], ConstantLetsStatement)
+        self.assertEqual(program.run(), ['0', '20'])
+        self.assertEqual(program.tracer().stats().recorded, {1: 1})
+
+    def test_other_engines_have_no_tracer(self):
+        program = execution.compile(list(parse(['PRINT 1', '.'])))
+        self.assertIsNone(program.tracer())
+
+
+if __name__ == '__main__':
+    unittest.main()
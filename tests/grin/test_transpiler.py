@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import test_execution
+
+import grin.execution as execution
+import grin.transpiler as transpiler
+from grin.parsing import parse
+from grin.test_utilities import rerun_with_engine
+from grin.utility import GrinRuntimeError
+
+# Every test in test_execution.py, run again on the transpiled engine
+rerun_with_engine(globals(), test_execution, 'Python', 'python')
+
+
+def _token_lines(lines: list[str]):
+    return list(parse(lines + ['.']))
+
+
+def _error_message(lines: list[str], engine: str) -> str:
+    try:
+        execution.execute(_token_lines(lines), input_func=str, engine=engine)
+    except GrinRuntimeError as error:
+        return str(error)
+    return ''
+
+
+class TestTranspiledErrors(unittest.TestCase):
+    def test_messages_match_statements(self):
+        programs = [
+            ['LET A "x"', 'SUB A 1'],
+            ['LET A 1', 'ADD A "x"'],
+            ['LET A "x"', 'MULT A -1'],
+            ['DIV A 0'],
+            ['GOTO 0'],
+            ['GOTO 5'],
+            ['GOTO "NOWHERE"'],
+            ['LET T 1.5', 'GOTO T'],
+            ['RETURN'],
+            ['GOTO 1 IF "A" < 1', 'END'],
+        ]
+        for lines in programs:
+            with self.subTest(lines=lines):
+                expected = _error_message(lines, 'statements')
+                self.assertNotEqual(expected, '')
+                self.assertEqual(_error_message(lines, 'python'), expected)
+
+
+class TestTranspiledVariables(unittest.TestCase):
+    def test_identifiers_that_are_not_python_names(self):
+        out = execution.execute(
+            _token_lines(['LET déf 2', 'ADD déf 1', 'PRINT déf']), engine='python'
+        )
+        self.assertEqual(out, ['3'])
+
+    def test_dynamic_jump_into_middle_of_block(self):
+        out = execution.execute(
+            _token_lines(['LET T 2', 'GOTO T', 'PRINT "A"', 'PRINT "B"']),
+            engine='python',
+        )
+        self.assertEqual(out, ['B'])
+
+    def test_empty_program(self):
+        self.assertEqual(execution.execute([], engine='python'), [])
+
+
+class TestCodeCache(unittest.TestCase):
+    def setUp(self):
+        transpiler.clear_code_cache()
+        self.addCleanup(transpiler.clear_code_cache)
+
+    def test_memory_cache_skips_generation(self):
+        token_lines = _token_lines(['LET A 1', 'PRINT A'])
+        execution.compile(token_lines, 'python')
+        with mock.patch.object(transpiler, 'generate_source') as generate:
+            program = execution.compile(token_lines, 'python')
+        generate.assert_not_called()
+        self.assertEqual(program.run(), ['1'])
+
+    def test_disk_cache_survives_memory_cache(self):
+        token_lines = _token_lines(['LET A 2', 'PRINT A'])
+        with tempfile.TemporaryDirectory() as cache_dir:
+            execution.compile(token_lines, 'python', cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            transpiler.clear_code_cache()
+            with mock.patch.object(transpiler, 'generate_source') as generate:
+                program = execution.compile(token_lines, 'python', cache_dir)
+            generate.assert_not_called()
+            self.assertEqual(program.run(), ['2'])
+
+    def test_corrupt_cache_file_is_regenerated(self):
+        token_lines = _token_lines(['PRINT 3'])
+        with tempfile.TemporaryDirectory() as cache_dir:
+            execution.compile(token_lines, 'python', cache_dir)
+            [name] = os.listdir(cache_dir)
+            with open(os.path.join(cache_dir, name), 'wb') as cache_file:
+                cache_file.write(b'not marshal data')
+
+            transpiler.clear_code_cache()
+            program = execution.compile(token_lines, 'python', cache_dir)
+            self.assertEqual(program.run(), ['3'])
+
+    def test_different_programs_get_different_code(self):
+        first = execution.compile(_token_lines(['PRINT 1']), 'python')
+        second = execution.compile(_token_lines(['PRINT 2']), 'python')
+        self.assertEqual(first.run(), ['1'])
+        self.assertEqual(second.run(), ['2'])
+
+
+if __name__ == '__main__':
+    unittest.main()